@@ -2,13 +2,27 @@
 API для управления пользователями и отчетами.
 Старые функции PPTX перенесены в slides_admin.py
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Header
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import and_, exists, select
+from sqlalchemy.orm import Session, aliased
 from pathlib import Path
+from typing import Optional
+import csv
+import os
+import io
+import json
 
-from database import get_db
-from models import User, Presentation, UserCompletion
-from utils.security import decode_access_token, hash_password
+from database import get_db, SessionLocal
+from models import User, Presentation, UserCompletion, UserPresentationPosition, PresentationStats
+from counters import (
+    on_role_changed, remove_user, get_global_stats, rebuild_counters, rebuild_presentation_stats
+)
+from dependencies import Principal, get_current_admin, invalidate_user
+from utils.security import hash_password_async
+from auth import add_user, find_user_by_email
+from files import image_cache
 
 router = APIRouter(prefix="/admin", tags=["admin"])
 
@@ -16,26 +30,8 @@ UPLOADS_DIR = "/tmp/slideconfirm_uploads"
 Path(UPLOADS_DIR).mkdir(parents=True, exist_ok=True)
 
 
-def get_current_admin(authorization: str = Header(None), db: Session = Depends(get_db)):
-    """Проверяет, что пользователь - администратор"""
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
-    
-    token = authorization.split(" ")[1]
-    payload = decode_access_token(token)
-    if not payload or "sub" not in payload:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    
-    user_id = int(payload["sub"])
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user or user.role != "admin":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
-    
-    return user
-
-
 @router.get("/presentations")
-def get_presentations(admin: User = Depends(get_current_admin), db: Session = Depends(get_db)):
+def get_presentations(admin: Principal = Depends(get_current_admin), db: Session = Depends(get_db)):
     """Получить список всех презентаций"""
     presentations = db.query(Presentation).all()
     return {
@@ -55,7 +51,7 @@ def get_presentations(admin: User = Depends(get_current_admin), db: Session = De
 
 
 @router.get("/users")
-def get_users(admin: User = Depends(get_current_admin), db: Session = Depends(get_db)):
+def get_users(admin: Principal = Depends(get_current_admin), db: Session = Depends(get_db)):
     """Получить список всех пользователей"""
     users = db.query(User).all()
     return {
@@ -75,9 +71,9 @@ def get_users(admin: User = Depends(get_current_admin), db: Session = Depends(ge
 
 
 @router.post("/create_user")
-def create_user(first_name: str, last_name: str, email: str, password: str, role: str = "user", admin: User = Depends(get_current_admin), db: Session = Depends(get_db)):
-    """Создать нового пользователя"""
-    existing = db.query(User).filter(User.email == email).first()
+async def create_user(first_name: str, last_name: str, email: str, password: str, role: str = "user", admin: Principal = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Создать нового пользователя (✅ хеширование пароля не занимает поток пула запросов)"""
+    existing = await run_in_threadpool(find_user_by_email, db, email)
     if existing:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already exists")
     
@@ -85,12 +81,11 @@ def create_user(first_name: str, last_name: str, email: str, password: str, role
         first_name=first_name,
         last_name=last_name,
         email=email,
-        password_hash=hash_password(password),
+        password_hash=await hash_password_async(password),
         role=role
     )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    await run_in_threadpool(add_user, db, user)
+    invalidate_user(user.id)
     
     return {
         "status": "success",
@@ -104,7 +99,7 @@ def create_user(first_name: str, last_name: str, email: str, password: str, role
 
 
 @router.put("/set_role/{user_id}")
-def set_user_role(user_id: int, role: str, admin: User = Depends(get_current_admin), db: Session = Depends(get_db)):
+def set_user_role(user_id: int, role: str, admin: Principal = Depends(get_current_admin), db: Session = Depends(get_db)):
     """Установить роль пользователя"""
     if role not in ["user", "admin"]:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid role")
@@ -113,61 +108,88 @@ def set_user_role(user_id: int, role: str, admin: User = Depends(get_current_adm
     if not user:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
     
+    old_role = user.role
     user.role = role
+    on_role_changed(db, user, old_role)
     db.commit()
+    invalidate_user(user_id)
     
     return {"status": "success", "message": f"User role updated to {role}"}
 
 
+@router.delete("/users/{user_id}")
+def delete_user(user_id: int, admin: Principal = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Удалить пользователя вместе с его прогрессом"""
+    if user_id == admin.id:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cannot delete yourself")
+    
+    user = db.query(User).filter(User.id == user_id).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User not found")
+    
+    db.query(UserPresentationPosition).filter(
+        UserPresentationPosition.user_id == user_id
+    ).delete(synchronize_session=False)
+    # Просмотры и завершения удаляются каскадом, счетчики отчета обновляются
+    remove_user(db, user)
+    db.commit()
+    invalidate_user(user_id)
+    
+    return {"status": "success", "message": "User deleted"}
+
+
+def completion_titles_by_user(db: Session, user_ids=None) -> dict:
+    """{user_id: [названия завершенных презентаций]} одним запросом"""
+    query = db.query(UserCompletion.user_id, Presentation.title).outerjoin(
+        Presentation, Presentation.id == UserCompletion.presentation_id
+    )
+    if user_ids is not None:
+        query = query.filter(UserCompletion.user_id.in_(user_ids))
+    
+    titles = {}
+    for user_id, title in query.order_by(UserCompletion.user_id, UserCompletion.id):
+        # None - презентация удалена, завершение учитывается только в количестве
+        titles.setdefault(user_id, []).append(title)
+    return titles
+
+
+@router.get("/cache/images")
+def get_image_cache_stats(admin: Principal = Depends(get_current_admin)):
+    """Статистика кэша изображений текущего воркера (для подбора IMAGE_CACHE_MAX_BYTES)"""
+    return {"status": "success", "data": {"pid": os.getpid(), **image_cache.stats()}}
+
+
 @router.get("/report")
-def get_report(admin: User = Depends(get_current_admin), db: Session = Depends(get_db)):
+def get_report(admin: Principal = Depends(get_current_admin), db: Session = Depends(get_db)):
     """Получить отчет об ознакомлении с презентациями"""
-    from backend.models import Presentation
-    
     # Получаем всех пользователей (не админов)
-    all_users = db.query(User).filter(User.role == "user").all()
-    users_count = len(all_users)
+    all_users = db.query(User).filter(User.role == "user").order_by(User.id).all()
     
     # Получаем все опубликованные презентации
-    all_presentations = db.query(Presentation).filter(
-        Presentation.status == "published"
-    ).all()
-    presentation_list = [p.title for p in all_presentations]
+    presentation_list = [
+        title for (title,) in db.query(Presentation.title).filter(Presentation.status == "published")
+    ]
+    
+    # Завершения всех пользователей с названиями презентаций - один запрос
+    titles_by_user = completion_titles_by_user(db, select(User.id).where(User.role == "user"))
     
-    # Получаем пользователей, которые завершили
-    completed_users = db.query(UserCompletion.user_id).distinct().all()
-    completed_user_ids = {uc[0] for uc in completed_users}
-    completed = len(completed_user_ids)
+    # ✅ Итоговые цифры - из счетчиков
+    stats = get_global_stats(db)
+    users_count = stats.total_users
+    completed = stats.completed_users
     
     # Формируем списки пользователей
     users_data = []
     for user in all_users:
-        is_completed = user.id in completed_user_ids
-        
-        # Get completed presentations for this user
-        completed_presentations = db.query(UserCompletion).filter(
-            UserCompletion.user_id == user.id
-        ).all()
-        
-        # Get presentation names
-        completed_presentation_names = []
-        for uc in completed_presentations:
-            presentation = db.query(Presentation).filter(
-                Presentation.id == uc.presentation_id
-            ).first()
-            if presentation:
-                completed_presentation_names.append(presentation.title)
-        
-        completion_count = len(completed_presentations)
-        
+        titles = titles_by_user.get(user.id, [])
         users_data.append({
             "id": user.id,
             "first_name": user.first_name,
             "last_name": user.last_name,
             "email": user.email,
-            "completion_count": completion_count,
-            "is_completed": is_completed,
-            "completed_presentations": completed_presentation_names
+            "completion_count": len(titles),
+            "is_completed": bool(titles),
+            "completed_presentations": [title for title in titles if title is not None]
         })
     
     return {
@@ -181,3 +203,165 @@ def get_report(admin: User = Depends(get_current_admin), db: Session = Depends(g
             "all_presentations": presentation_list
         }
     }
+
+
+@router.get("/report/summary")
+def get_report_summary(admin: Principal = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Итоговые цифры отчета из счетчиков (без обхода пользователей)"""
+    stats = get_global_stats(db)
+    
+    rows = db.query(Presentation, PresentationStats.completed_users).outerjoin(
+        PresentationStats, PresentationStats.presentation_id == Presentation.id
+    ).filter(Presentation.status == "published").order_by(Presentation.id).all()
+    
+    presentations = []
+    for presentation, completed_users in rows:
+        if completed_users is None:
+            completed_users = rebuild_presentation_stats(db, presentation.id).completed_users
+        presentations.append({
+            "id": presentation.id,
+            "title": presentation.title,
+            "completed": completed_users,
+            "pending": stats.total_users - completed_users
+        })
+    db.commit()
+    
+    return {
+        "status": "success",
+        "data": {
+            "total_users": stats.total_users,
+            "completed": stats.completed_users,
+            "pending": stats.total_users - stats.completed_users,
+            "completion_percentage": (stats.completed_users / stats.total_users * 100) if stats.total_users > 0 else 0,
+            "presentations": presentations
+        }
+    }
+
+
+@router.post("/report/reconcile")
+def reconcile_report_counters(admin: Principal = Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Пересчитывает счетчики отчета из UserCompletion"""
+    rebuild_counters(db)
+    db.commit()
+    stats = get_global_stats(db)
+    return {
+        "status": "success",
+        "data": {"total_users": stats.total_users, "completed": stats.completed_users}
+    }
+
+
+EXPORT_FIELDS = ["id", "first_name", "last_name", "email", "completion_count", "is_completed", "completed_presentations"]
+EXPORT_BATCH_SIZE = 1000
+
+
+def iter_report_rows(status_filter: Optional[str], presentation_id: Optional[int]):
+    """
+    Строки отчета по пользователям, читаемые серверным курсором.
+    Отдельная сессия: генератор живет дольше запроса.
+    """
+    db = SessionLocal()
+    try:
+        completion_join = [UserCompletion.user_id == User.id]
+        if presentation_id is not None:
+            completion_join.append(UserCompletion.presentation_id == presentation_id)
+        
+        query = db.query(
+            User.id, User.first_name, User.last_name, User.email, UserCompletion.id, Presentation.title
+        ).outerjoin(
+            UserCompletion, and_(*completion_join)
+        ).outerjoin(
+            Presentation, Presentation.id == UserCompletion.presentation_id
+        ).filter(User.role == "user")
+        
+        if status_filter:
+            done = aliased(UserCompletion)
+            done_filter = [done.user_id == User.id]
+            if presentation_id is not None:
+                done_filter.append(done.presentation_id == presentation_id)
+            completed_exists = exists().where(and_(*done_filter))
+            query = query.filter(completed_exists if status_filter == "completed" else ~completed_exists)
+        
+        query = query.order_by(User.id, UserCompletion.id).execution_options(
+            stream_results=True, yield_per=EXPORT_BATCH_SIZE
+        )
+        
+        # Строки одного пользователя идут подряд - собираем их по мере чтения
+        current = None
+        for user_id, first_name, last_name, email, completion_id, title in query:
+            if current is None or current["id"] != user_id:
+                if current is not None:
+                    yield current
+                current = {
+                    "id": user_id,
+                    "first_name": first_name,
+                    "last_name": last_name,
+                    "email": email,
+                    "completion_count": 0,
+                    "is_completed": False,
+                    "completed_presentations": []
+                }
+            if completion_id is not None:
+                current["completion_count"] += 1
+                current["is_completed"] = True
+                if title is not None:
+                    current["completed_presentations"].append(title)
+        if current is not None:
+            yield current
+    finally:
+        db.close()
+
+
+def stream_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow([
+            "; ".join(row[field]) if field == "completed_presentations" else row[field]
+            for field in EXPORT_FIELDS
+        ])
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_ndjson(rows):
+    batch = []
+    for row in rows:
+        batch.append(json.dumps(row, ensure_ascii=False))
+        if len(batch) >= EXPORT_BATCH_SIZE:
+            yield "\n".join(batch) + "\n"
+            batch = []
+    if batch:
+        yield "\n".join(batch) + "\n"
+
+
+@router.get("/report/export")
+def export_report(
+    format: str = "csv",
+    status_filter: Optional[str] = Query(None, alias="status"),
+    presentation_id: Optional[int] = None,
+    admin: Principal = Depends(get_current_admin)
+):
+    """
+    Потоковая выгрузка отчета (CSV или NDJSON).
+    status: completed / pending, presentation_id - учитывать только эту презентацию
+    """
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Format must be csv or ndjson")
+    if status_filter and status_filter not in ("completed", "pending"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid status")
+    
+    rows = iter_report_rows(status_filter, presentation_id)
+    if format == "csv":
+        body, media_type = stream_csv(rows), "text/csv; charset=utf-8"
+    else:
+        body, media_type = stream_ndjson(rows), "application/x-ndjson"
+    
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=report.{format}"}
+    )
@@ -1,21 +1,39 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 from database import get_db
 from models import User
 from schemas import UserCreate, UserLogin, TokenResponse, UserResponse
-from utils.security import hash_password, verify_password, create_access_token
+from counters import on_user_added
+from utils.security import hash_password_async, verify_password_async, create_access_token
 
 router = APIRouter(prefix="/auth", tags=["auth"])
 
+
+# ✅ Эндпоинты с паролями - async: bcrypt ждут в event loop (пул процессов),
+# синхронные запросы к БД выполняются в пуле потоков
+def find_user_by_email(db: Session, email: str):
+    return db.query(User).filter(User.email == email).first()
+
+
+def add_user(db: Session, user: User) -> User:
+    """Сохраняет нового пользователя вместе со счетчиками"""
+    db.add(user)
+    on_user_added(db, user)
+    db.commit()
+    db.refresh(user)
+    return user
+
+
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
+async def register(user: UserCreate, db: Session = Depends(get_db)):
     # Проверка, не существует ли пользователь
-    existing = db.query(User).filter(User.email == user.email).first()
+    existing = await run_in_threadpool(find_user_by_email, db, user.email)
     if existing:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered")
     
     # Создание пользователя
-    hashed_password = hash_password(user.password)
+    hashed_password = await hash_password_async(user.password)
     # Используем переданную роль, если она есть, иначе "user" по умолчанию
     role = getattr(user, 'role', 'user') or 'user'
     db_user = User(
@@ -25,20 +43,17 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
         password_hash=hashed_password,
         role=role
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return await run_in_threadpool(add_user, db, db_user)
 
 @router.post("/login", response_model=TokenResponse)
-def login(user: UserLogin, db: Session = Depends(get_db)):
+async def login(user: UserLogin, db: Session = Depends(get_db)):
     # Поиск пользователя
-    db_user = db.query(User).filter(User.email == user.email).first()
+    db_user = await run_in_threadpool(find_user_by_email, db, user.email)
     if not db_user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
     # Проверка пароля
-    if not verify_password(user.password, db_user.password_hash):
+    if not await verify_password_async(user.password, db_user.password_hash):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
     
     # Создание токена
@@ -0,0 +1,94 @@
+"""
+Бенчмарк отдачи изображений слайдов: файл через uvicorn (с кэшем в памяти и без)
+или X-Accel-Redirect.
+
+Запуск из каталога backend:
+    python benchmarks/bench_image_offload.py --requests 2000 --concurrency 16 --size 1920x1080
+
+Поднимает только роутер files (без БД) и меряет, сколько запросов в секунду
+выдерживает Python-воркер в каждом режиме. В режиме x-accel байты отправляет nginx,
+поэтому цифра показывает, сколько времени воркера освобождается для API.
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+BENCH_PRESENTATION_ID = 999999
+
+
+def make_slides(count, size):
+    from PIL import Image
+    import files
+
+    slides_dir = os.path.join(files.UPLOADS_DIR, "slides", str(BENCH_PRESENTATION_ID))
+    os.makedirs(slides_dir, exist_ok=True)
+    for i in range(1, count + 1):
+        image = Image.effect_noise(size, 64).convert("RGB")
+        image.save(os.path.join(slides_dir, f"slide{i}.jpg"), "JPEG", quality=90)
+    return slides_dir
+
+
+def run(label, client, urls, requests, concurrency):
+    # Прогрев (хеши файлов и размеры попадают в кэш)
+    for url in urls:
+        client.get(url)
+
+    sent = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = executor.map(lambda i: client.get(urls[i % len(urls)]), range(requests))
+        for response in responses:
+            if response.status_code != 200:
+                raise RuntimeError(f"{label}: HTTP {response.status_code}")
+            sent += len(response.content)
+    elapsed = time.perf_counter() - started
+
+    print(f"{label:<12} {requests:>6} req {elapsed:>8.2f}s {requests / elapsed:>9.1f} req/s "
+          f"{sent / elapsed / 1024 / 1024:>9.1f} MiB/s через Python")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--slides", type=int, default=20)
+    parser.add_argument("--size", default="1920x1080", help="размер JPEG, ШxВ")
+    args = parser.parse_args()
+
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    import files
+
+    width, height = (int(v) for v in args.size.split("x"))
+    slides_dir = make_slides(args.slides, (width, height))
+    urls = [f"/slides/image/{BENCH_PRESENTATION_ID}/slide{i}.jpg" for i in range(1, args.slides + 1)]
+
+    app = FastAPI()
+    app.include_router(files.router)
+    client = TestClient(app)
+
+    size_kb = sum(os.path.getsize(os.path.join(slides_dir, f)) for f in os.listdir(slides_dir)
+                  if f.endswith(".jpg")) / args.slides / 1024
+    print(f"slides={args.slides} size={args.size} (~{size_kb:.0f} KiB) "
+          f"requests={args.requests} concurrency={args.concurrency}")
+    try:
+        for label, mode, cache_bytes in (("off", "off", 0),
+                                         ("off+cache", "off", files.IMAGE_CACHE_MAX_BYTES),
+                                         ("x-accel", "x-accel", files.IMAGE_CACHE_MAX_BYTES)):
+            files.IMAGE_OFFLOAD = mode
+            files.image_cache.clear()
+            files.image_cache.max_bytes = cache_bytes
+            run(label, client, urls, args.requests, args.concurrency)
+        print("cache:", files.image_cache.stats())
+    finally:
+        shutil.rmtree(slides_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Бенчмарк проверки паролей (путь /auth/login): пропускная способность на ядро.
+
+Запуск из каталога backend:
+    python benchmarks/bench_password_hashing.py --rounds 12 --requests 200 --concurrency 32
+
+Сравнивает проверку в потоке (как раньше) и через пул процессов
+utils.security при разном числе воркеров.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def run(label, verify, password, hashed, requests, concurrency, cores):
+    # Прогрев (запуск процессов пула)
+    verify(password, hashed)
+
+    busy = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(verify, password, hashed) for _ in range(requests)]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                if type(e).__name__ != "PasswordHasherBusy":
+                    raise
+                busy += 1
+    elapsed = time.perf_counter() - started
+
+    done = requests - busy
+    throughput = done / elapsed
+    print(f"{label:<22} {done:>6} ok {busy:>6} 503 {elapsed:>8.2f}s "
+          f"{throughput:>8.1f} logins/s {throughput / cores:>8.1f} logins/s/core")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=12, help="BCRYPT_ROUNDS")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных логинов")
+    parser.add_argument("--workers", type=int, nargs="*", help="размеры пула (по умолчанию 1..CPU)")
+    args = parser.parse_args()
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["PASSWORD_POOL_MAX_QUEUE"] = str(args.requests)
+    from utils import security
+
+    hashed = security._hash("benchmark-password")
+    cpu = os.cpu_count() or 1
+    print(f"bcrypt rounds={args.rounds} cpu={cpu} requests={args.requests} concurrency={args.concurrency}")
+
+    run("inline (threads)", security._verify, "benchmark-password", hashed,
+        args.requests, args.concurrency, cores=1)
+
+    for workers in args.workers or sorted({1, max(1, cpu // 2), cpu}):
+        security.PASSWORD_POOL_WORKERS = workers
+        security._executor = None
+        run(f"process pool x{workers}", security.verify_password, "benchmark-password", hashed,
+            args.requests, args.concurrency, cores=workers)
+        security._executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Бенчмарк запасного рендерера PPTX (python-pptx, без LibreOffice).
+
+Запуск из каталога backend:
+    python benchmarks/bench_pptx_render.py --pptx ../sample.pptx --repeat 20 --workers 0 2 4
+
+Презентация "размножается" до --repeat копий слайдов (как большая колода)
+и рендерится в текущем процессе (workers=0) и пулом процессов разного размера.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pptx", default=os.path.join(os.path.dirname(__file__), "..", "..", "sample.pptx"))
+    parser.add_argument("--repeat", type=int, default=20, help="копий каждого слайда")
+    parser.add_argument("--workers", type=int, nargs="*", help="размеры пула (по умолчанию 0..CPU)")
+    args = parser.parse_args()
+
+    from pptx import Presentation
+    from utils import pptx_render
+
+    prs = Presentation(args.pptx)
+    blocks = [pptx_render.extract_slide_content(slide) for slide in prs.slides]
+    cpu = os.cpu_count() or 1
+    workers_list = args.workers if args.workers else [0] + list(range(1, cpu + 1))
+    print(f"{args.pptx}: {len(blocks)} слайдов x {args.repeat} = {len(blocks) * args.repeat}, cpu={cpu}")
+
+    for workers in workers_list:
+        output_dir = tempfile.mkdtemp(prefix="bench_pptx_")
+        try:
+            tasks = [
+                (idx, content, os.path.join(output_dir, f"slide_{idx:03d}.jpg"))
+                for idx, content in enumerate(blocks * args.repeat, 1)
+            ]
+            if workers > 0:
+                pptx_render.PPTX_RENDER_WORKERS = workers
+                pptx_render._executor = None
+                pptx_render.render_slides(tasks[:workers], workers=workers)  # Прогрев (запуск процессов)
+
+            started = time.perf_counter()
+            pptx_render.render_slides(tasks, workers=workers)
+            elapsed = time.perf_counter() - started
+
+            label = "in-process" if workers == 0 else f"pool x{workers}"
+            print(f"{label:<12} {elapsed:>8.2f}s {len(tasks) / elapsed:>8.1f} slides/s")
+        finally:
+            if pptx_render._executor is not None:
+                pptx_render._executor.shutdown()
+                pptx_render._executor = None
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""
+Счетчики завершений для мгновенных сводок админки.
+
+Обновляются в той же транзакции, что и UserCompletion (complete / reset)
+и пользователи (создание, смена роли). Учитываются только пользователи
+с ролью "user", как в отчете. Отсутствующая строка счетчика
+пересчитывается из UserCompletion при первом обновлении или чтении.
+
+Одновременные запросы: изменения завершений одного пользователя идут
+под блокировкой его строки в users (иначе два первых завершения оба
+видят "первое" и прибавляют 2), а недостающая строка счетчика создается
+в точке сохранения - проигравший INSERT пересчитывает строку победителя.
+
+Сверка со всеми данными (из каталога backend):
+    python counters.py
+"""
+from sqlalchemy import distinct, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import User, Presentation, UserCompletion, PresentationStats, CompletionStats
+
+GLOBAL_STATS_ID = 1
+
+
+def count_total_users(db: Session) -> int:
+    return db.query(func.count(User.id)).filter(User.role == "user").scalar()
+
+
+def count_completed_users(db: Session, presentation_id: int = None) -> int:
+    query = db.query(func.count(distinct(UserCompletion.user_id))).join(
+        User, User.id == UserCompletion.user_id
+    ).filter(User.role == "user")
+    if presentation_id is not None:
+        query = query.filter(UserCompletion.presentation_id == presentation_id)
+    return query.scalar()
+
+
+def lock_counter_row(db: Session, model, **key):
+    """
+    Строка счетчика под блокировкой до конца транзакции; отсутствующая создается.
+    Если ее одновременно вставил другой запрос, INSERT откатывается к точке
+    сохранения и блокируется строка, созданная первым
+    """
+    stats = db.get(model, tuple(key.values()), with_for_update=True)
+    if stats is not None:
+        return stats
+    try:
+        with db.begin_nested():
+            db.add(model(**key))
+    except IntegrityError:
+        pass
+    return db.get(model, tuple(key.values()), with_for_update=True, populate_existing=True)
+
+
+def lock_user(db: Session, user_id: int) -> None:
+    """Блокирует строку пользователя: его завершения учитываются по очереди"""
+    db.query(User.id).filter(User.id == user_id).with_for_update().scalar()
+
+
+def rebuild_global_stats(db: Session) -> CompletionStats:
+    """Пересчитывает глобальную строку из users и user_completion"""
+    db.flush()
+    stats = lock_counter_row(db, CompletionStats, id=GLOBAL_STATS_ID)
+    stats.total_users = count_total_users(db)
+    stats.completed_users = count_completed_users(db)
+    return stats
+
+
+def rebuild_presentation_stats(db: Session, presentation_id: int) -> PresentationStats:
+    """Пересчитывает счетчик одной презентации"""
+    db.flush()
+    stats = lock_counter_row(db, PresentationStats, presentation_id=presentation_id)
+    stats.completed_users = count_completed_users(db, presentation_id)
+    return stats
+
+
+def rebuild_counters(db: Session) -> None:
+    """Полная сверка всех счетчиков с UserCompletion"""
+    db.query(PresentationStats).delete()
+    rows = db.query(
+        UserCompletion.presentation_id, func.count(distinct(UserCompletion.user_id))
+    ).join(
+        User, User.id == UserCompletion.user_id
+    ).filter(User.role == "user").group_by(UserCompletion.presentation_id).all()
+    
+    existing_ids = {pid for (pid,) in db.query(Presentation.id)}
+    for presentation_id, completed in rows:
+        if presentation_id in existing_ids:
+            db.add(PresentationStats(presentation_id=presentation_id, completed_users=completed))
+    
+    rebuild_global_stats(db)
+
+
+def bump_global_stats(db: Session, total_users: int = 0, completed_users: int = 0) -> None:
+    if not total_users and not completed_users:
+        return
+    result = db.execute(
+        update(CompletionStats).where(CompletionStats.id == GLOBAL_STATS_ID).values(
+            total_users=CompletionStats.total_users + total_users,
+            completed_users=CompletionStats.completed_users + completed_users
+        )
+    )
+    if result.rowcount == 0:
+        rebuild_global_stats(db)
+
+
+def bump_presentation_stats(db: Session, presentation_id: int, delta: int) -> None:
+    result = db.execute(
+        update(PresentationStats).where(PresentationStats.presentation_id == presentation_id).values(
+            completed_users=PresentationStats.completed_users + delta
+        )
+    )
+    if result.rowcount == 0:
+        rebuild_presentation_stats(db, presentation_id)
+
+
+def user_completion_count(db: Session, user_id: int) -> int:
+    return db.query(func.count(UserCompletion.id)).filter(UserCompletion.user_id == user_id).scalar()
+
+
+def on_completion_added(db: Session, user: User, presentation_id: int) -> None:
+    """Вызывать после db.add(UserCompletion), до commit"""
+    if user.role != "user":
+        return
+    lock_user(db, user.id)
+    db.flush()
+    bump_presentation_stats(db, presentation_id, 1)
+    bump_global_stats(db, completed_users=1 if user_completion_count(db, user.id) == 1 else 0)
+
+
+def on_completion_removed(db: Session, user: User, presentation_id: int, removed: int) -> None:
+    """Вызывать после удаления завершений пользователя (removed - число удаленных строк)"""
+    if not removed or user.role != "user":
+        return
+    lock_user(db, user.id)
+    bump_presentation_stats(db, presentation_id, -1)
+    bump_global_stats(db, completed_users=-1 if user_completion_count(db, user.id) == 0 else 0)
+
+
+def on_user_added(db: Session, user: User) -> None:
+    """Вызывать после db.add(User), до commit"""
+    if user.role == "user":
+        db.flush()
+        bump_global_stats(db, total_users=1)
+
+
+def on_role_changed(db: Session, user: User, old_role: str) -> None:
+    """Вызывать после изменения user.role, до commit"""
+    if old_role == user.role or "user" not in (old_role, user.role):
+        return
+    db.flush()
+    shift_user_counters(db, completed_presentation_ids(db, user.id), 1 if user.role == "user" else -1)
+
+
+def remove_user(db: Session, user: User) -> None:
+    """Удаляет пользователя (завершения - каскадом) и исключает его из счетчиков"""
+    presentation_ids = completed_presentation_ids(db, user.id)
+    counted = user.role == "user"
+    db.delete(user)
+    db.flush()
+    if counted:
+        shift_user_counters(db, presentation_ids, -1)
+
+
+def completed_presentation_ids(db: Session, user_id: int) -> list[int]:
+    return [
+        presentation_id for (presentation_id,) in db.query(UserCompletion.presentation_id).filter(
+            UserCompletion.user_id == user_id
+        ).distinct()
+    ]
+
+
+def shift_user_counters(db: Session, presentation_ids: list[int], delta: int) -> None:
+    """
+    Добавляет (delta=1) или исключает (delta=-1) пользователя из всех счетчиков.
+    Вызывать после flush изменения, чтобы пересчет недостающих строк уже его учитывал.
+    """
+    for presentation_id in presentation_ids:
+        bump_presentation_stats(db, presentation_id, delta)
+    bump_global_stats(db, total_users=delta, completed_users=delta if presentation_ids else 0)
+
+
+def get_global_stats(db: Session) -> CompletionStats:
+    """Сводка одним чтением по первичному ключу"""
+    stats = db.get(CompletionStats, GLOBAL_STATS_ID)
+    if stats is None:
+        stats = rebuild_global_stats(db)
+        db.commit()
+    return stats
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+    
+    session = SessionLocal()
+    try:
+        rebuild_counters(session)
+        session.commit()
+        stats = session.get(CompletionStats, GLOBAL_STATS_ID)
+        print(f"Counters rebuilt: total_users={stats.total_users}, completed_users={stats.completed_users}")
+    finally:
+        session.close()
@@ -0,0 +1,97 @@
+"""
+Общий слой аутентификации для всех роутеров.
+
+Декодированные токены и данные пользователя кэшируются в процессе
+(TTL + ограничение размера), поэтому на горячем пути запрос к БД делается
+только для бизнес-логики. Кэш сбрасывается при смене роли, создании
+и удалении пользователя. Кэш локален для процесса: при нескольких
+воркерах изменения видны остальным не позже чем через AUTH_CACHE_TTL секунд.
+"""
+import os
+import time
+from dataclasses import dataclass
+
+from fastapi import Depends, Header, HTTPException, status
+from sqlalchemy.orm import Session
+
+from database import get_db
+from models import User
+from utils.security import decode_access_token
+from utils.ttl_cache import TTLCache
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Данные аутентифицированного пользователя (без привязки к сессии БД)"""
+    id: int
+    first_name: str
+    last_name: str
+    email: str
+    role: str
+    
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            id=user.id,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            email=user.email,
+            role=user.role
+        )
+
+
+# token -> user_id, user_id -> Principal
+token_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+principal_cache = TTLCache(AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def invalidate_user(user_id: int) -> None:
+    """Сбрасывает закэшированные данные пользователя (роль, удаление)"""
+    principal_cache.pop(user_id)
+
+
+def resolve_token(token: str):
+    """user_id из токена; None - токен невалиден"""
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    
+    payload = decode_access_token(token)
+    if not payload or "sub" not in payload:
+        return None
+    
+    user_id = int(payload["sub"])
+    # Не держим токен в кэше дольше срока его действия
+    ttl = payload["exp"] - time.time() if "exp" in payload else None
+    token_cache.set(token, user_id, ttl)
+    return user_id
+
+
+def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)) -> Principal:
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
+    
+    token = authorization.split(" ")[1]
+    user_id = resolve_token(token)
+    if user_id is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    
+    principal = principal_cache.get(user_id)
+    if principal is None:
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+        principal = Principal.from_user(user)
+        principal_cache.set(user_id, principal)
+    
+    return principal
+
+
+def get_current_admin(user: Principal = Depends(get_current_user)) -> Principal:
+    """Проверяет, что пользователь - администратор"""
+    if user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return user
@@ -1,15 +1,162 @@
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
 from fastapi.responses import FileResponse
 import os
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
+
+from utils.http_cache import etag_matches
+from utils.image_variants import VARIANT_FORMATS, choose_variant, preferred_format
 
 router = APIRouter(tags=["files"])
 
 UPLOADS_DIR = "/tmp/slideconfirm_uploads"
 
-@router.get("/slides/image/{presentation_id}/{filename}")
-def get_slide_image(presentation_id: int, filename: str):
-    """Получить изображение слайда"""
+# ✅ URL с хешем содержимого не меняется никогда - кэшируем навсегда
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+LEGACY_CACHE_CONTROL = "max-age=3600"
+# Временная замена пересоздаваемого варианта: не кэшируется ни клиентом, ни CDN
+STAND_IN_CACHE_CONTROL = "no-store"
+URL_HASH_LENGTH = 16
+
+# ✅ Отдача файлов через веб-сервер: приложение только проверяет запрос,
+# байты отправляет nginx (x-accel) или Apache/lighttpd (x-sendfile).
+# off - файл отдает сам uvicorn
+IMAGE_OFFLOAD = os.getenv("IMAGE_OFFLOAD", "off")
+IMAGE_OFFLOAD_PREFIX = os.getenv("IMAGE_OFFLOAD_PREFIX", "/protected-uploads/")
+
+# ✅ Кэш горячих изображений в памяти процесса (байты + готовые заголовки)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+IMAGE_CACHE_MAX_FILE_BYTES = int(os.getenv("IMAGE_CACHE_MAX_FILE_BYTES", str(2 * 1024 * 1024)))
+IMAGE_CACHE_MAX_ENTRIES = int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "4096"))
+
+
+@dataclass(frozen=True)
+class CachedImage:
+    """Подготовленный ответ для изображения; body=None - файл отдается с диска"""
+    path: str
+    media_type: str
+    content_hash: str
+    headers: dict
+    mtime: float
+    source_mtime_ns: int
+    source_size: int
+    stat_result: os.stat_result
+    body: Optional[bytes] = None
+    exact: bool = True  # False - ближайший вариант вместо пересоздаваемого
+
+
+class ImageCache:
+    """
+    LRU-кэш изображений, ограниченный суммарным размером байтов.
+    Запись сверяется с mtime/размером исходного файла, поэтому файл,
+    замененный другим воркером, не отдается из кэша.
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, source_stat: os.stat_result) -> Optional[CachedImage]:
+        with self._lock:
+            image = self._data.get(key)
+            if image is not None and (image.source_mtime_ns != source_stat.st_mtime_ns
+                                      or image.source_size != source_stat.st_size):
+                self._remove(key)
+                image = None
+            if image is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image: CachedImage) -> None:
+        if image.body is not None and len(image.body) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = image
+            self._bytes += len(image.body or b"")
+            while self._data and (self._bytes > self.max_bytes or len(self._data) > self.max_entries):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def invalidate_prefix(self, prefix: str) -> int:
+        """Удаляет записи файлов из каталога; возвращает их число"""
+        with self._lock:
+            keys = [key for key in self._data if key[0].startswith(prefix)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / requests, 4) if requests else None,
+                "evictions": self.evictions,
+                "entries": len(self._data),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries
+            }
+
+    def _remove(self, key) -> None:
+        image = self._data.pop(key)
+        self._bytes -= len(image.body or b"")
+
+
+image_cache = ImageCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_ENTRIES)
+
+
+def invalidate_presentation_images(presentation_id: int) -> int:
+    """Сбрасывает кэш изображений презентации (удаление, замена слайдов)"""
+    return image_cache.invalidate_prefix(f"{UPLOADS_DIR}/slides/{presentation_id}/")
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 файла (читается блоками)"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=8192)
+def cached_file_sha256(path: str, mtime_ns: int, size: int) -> str:
+    """Хеш файла, пересчитывается только при изменении mtime/размера"""
+    return file_sha256(path)
+
+
+def slide_image_url(presentation_id: int, filename: str, content_hash: Optional[str]) -> str:
+    """URL изображения слайда: версионированный по хешу, если хеш известен"""
+    if content_hash:
+        return f"/slides/image/{presentation_id}/{content_hash[:URL_HASH_LENGTH]}/{filename}"
+    return f"/slides/image/{presentation_id}/{filename}"
+
+
+def slide_image_path(presentation_id: int, filename: str) -> str:
     # Проверяем, что filename содержит только разрешенные символы
     if not filename.endswith('.jpg'):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only JPG files are allowed")
@@ -17,13 +164,118 @@ def get_slide_image(presentation_id: int, filename: str):
     if '/' in filename or '\\' in filename or '..' in filename:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid filename")
     
-    file_path = f"{UPLOADS_DIR}/slides/{presentation_id}/{filename}"
+    return f"{UPLOADS_DIR}/slides/{presentation_id}/{filename}"
+
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Проверка условного запроса: If-None-Match приоритетнее If-Modified-Since"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
     
-    if not os.path.exists(file_path):
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def offload_response(file_path: str, media_type: str, headers: dict) -> Optional[Response]:
+    """Пустой ответ с внутренним редиректом на файл или None, если режим выключен"""
+    if IMAGE_OFFLOAD == "x-accel":
+        relative_path = os.path.relpath(file_path, UPLOADS_DIR).replace(os.sep, "/")
+        header = ("X-Accel-Redirect", IMAGE_OFFLOAD_PREFIX.rstrip("/") + "/" + relative_path)
+    elif IMAGE_OFFLOAD == "x-sendfile":
+        header = ("X-Sendfile", os.path.abspath(file_path))
+    else:
+        return None
+    return Response(media_type=media_type, headers={**headers, header[0]: header[1]})
+
+
+def load_image(file_path: str, width: Optional[int], accept: Optional[str]) -> CachedImage:
+    """Ответ для изображения из кэша или с диска (с выбором варианта)"""
+    try:
+        source_stat = os.stat(file_path)
+    except FileNotFoundError:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image not found")
     
-    return FileResponse(
-        file_path,
-        media_type="image/jpeg",
-        headers={"Cache-Control": "max-age=3600"}
+    key = (file_path, width, preferred_format(accept))
+    image = image_cache.get(key, source_stat)
+    if image is not None:
+        return image
+    
+    content_hash = cached_file_sha256(file_path, source_stat.st_mtime_ns, source_stat.st_size)
+    
+    # ✅ Вариант по ширине и Accept (WebP/AVIF); тег варианта входит в ETag
+    variant_path, media_type, variant_tag, exact = choose_variant(file_path, width, accept)
+    variant_stat = source_stat if variant_path == file_path else os.stat(variant_path)
+    
+    # ✅ У временной замены нет валидаторов - иначе клиент подтвердил бы ее через 304
+    headers = {}
+    if exact:
+        headers["ETag"] = f'"{content_hash[:URL_HASH_LENGTH]}{variant_tag}"'
+        headers["Last-Modified"] = formatdate(source_stat.st_mtime, usegmt=True)
+    if len(VARIANT_FORMATS) > 1:
+        headers["Vary"] = "Accept"
+    
+    body = None
+    if IMAGE_OFFLOAD == "off" and variant_stat.st_size <= IMAGE_CACHE_MAX_FILE_BYTES:
+        with open(variant_path, "rb") as f:
+            body = f.read()
+    
+    image = CachedImage(
+        path=variant_path,
+        media_type=media_type,
+        content_hash=content_hash,
+        headers=headers,
+        mtime=source_stat.st_mtime,
+        source_mtime_ns=source_stat.st_mtime_ns,
+        source_size=source_stat.st_size,
+        stat_result=variant_stat,
+        body=body,
+        exact=exact
     )
+    if exact:  # Временная замена пересоздаваемого варианта в кэш не попадает
+        image_cache.put(key, image)
+    return image
+
+
+def serve_image(request: Request, file_path: str, cache_control: str, expected_hash: str = None,
+                width: Optional[int] = None):
+    image = load_image(file_path, width, request.headers.get("accept"))
+    
+    # Файл заменен - старый версионированный URL больше не действителен
+    if expected_hash is not None and (len(expected_hash) < 8 or not image.content_hash.startswith(expected_hash)):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Image version not found")
+    
+    if not image.exact:
+        cache_control = STAND_IN_CACHE_CONTROL
+    headers = {**image.headers, "Cache-Control": cache_control}
+    if image.exact and is_not_modified(request, headers["ETag"], image.mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    offloaded = offload_response(image.path, image.media_type, headers)
+    if offloaded is not None:
+        return offloaded
+    
+    if image.body is not None:
+        return Response(content=image.body, media_type=image.media_type, headers=headers)
+    return FileResponse(image.path, media_type=image.media_type, headers=headers, stat_result=image.stat_result)
+
+
+@router.get("/slides/image/{presentation_id}/{filename}")
+def get_slide_image(presentation_id: int, filename: str, request: Request,
+                    w: Optional[int] = Query(None, ge=1, le=4096)):
+    """Получить изображение слайда (старый путь без версии, с ETag и 304)"""
+    file_path = slide_image_path(presentation_id, filename)
+    return serve_image(request, file_path, LEGACY_CACHE_CONTROL, width=w)
+
+
+@router.get("/slides/image/{presentation_id}/{content_hash}/{filename}")
+def get_versioned_slide_image(presentation_id: int, content_hash: str, filename: str, request: Request,
+                              w: Optional[int] = Query(None, ge=1, le=4096)):
+    """Получить изображение слайда по URL с хешем содержимого (immutable)"""
+    file_path = slide_image_path(presentation_id, filename)
+    return serve_image(request, file_path, IMMUTABLE_CACHE_CONTROL, expected_hash=content_hash, width=w)
@@ -0,0 +1,474 @@
+"""
+Обработчики фоновых задач загрузки слайдов (см. jobs.py).
+
+Каждый обработчик получает сессию, номер задачи, параметры и функцию прогресса,
+складывает файлы в staging/{job_id} и вызывает finalize_presentation:
+презентация и слайды вставляются в одной транзакции, каталог переносится
+в slides/{presentation_id} одним rename перед commit.
+
+Загрузка PPTX/PDF (ingest_document) конвертирует файл в JPEG; одновременно
+идет не больше CONVERT_MAX_CONCURRENCY конвертаций, остальные ждут очереди.
+PDF загружается постранично (ingest_pdf_pages): презентация создается сразу
+со статусом processing, готовые страницы видны администратору по мере растеризации.
+
+Повторная загрузка PPTX (ingest_pptx_update) обновляет существующую
+презентацию: перерисовываются только слайды с измененным отпечатком.
+"""
+import os
+import shutil
+import threading
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from models import IngestJob, Presentation, Slide
+from files import invalidate_presentation_images, file_sha256
+from jobs import JobFailed, JobProgress, staging_dir
+from progress import load_deck, reset_slides_progress
+from utils.folder_import import scan_slide_folder, import_slides
+from utils.image_variants import remove_variants, schedule_variants
+from utils.uploads import (
+    InvalidPackage, UPLOAD_MAX_PACKAGE_BYTES, UploadBudget, extract_slide_package, read_slide_package, validate_images
+)
+
+UPLOADS_DIR = "/tmp/slideconfirm_uploads"
+PPTX_SOURCE_NAME = "source.pptx"  # Загруженный PPTX в staging/{job_id}
+DOCUMENT_EXTENSIONS = (".pptx", ".pdf")
+
+# ✅ Конвертаций PPTX/PDF одновременно (на процесс): остальные задачи ждут,
+# пул задач и процессы приложения не заняты рендерингом целиком
+CONVERT_MAX_CONCURRENCY = int(os.getenv("CONVERT_MAX_CONCURRENCY", "1"))
+_convert_slots = threading.BoundedSemaphore(max(1, CONVERT_MAX_CONCURRENCY))
+
+
+def slides_dir(presentation_id: int) -> str:
+    return os.path.join(UPLOADS_DIR, "slides", str(presentation_id))
+
+
+def finalize_presentation(db: Session, job_id: int, title: str, source_name: str, rows: list[dict]) -> Presentation:
+    """
+    Создает презентацию и слайды (rows: filename, order, content_hash[, fingerprint]) и переносит
+    файлы задачи в каталог презентации. При ошибке commit каталог удаляется.
+    """
+    presentation = Presentation(title=title, filename=source_name, status="draft")
+    db.add(presentation)
+    db.flush()  # Получаем ID без коммита
+
+    # Все записи слайдов - одним INSERT
+    db.execute(insert(Slide), [
+        {
+            "presentation_id": presentation.id,
+            "filename": row["filename"],
+            "order": row["order"],
+            "title": f"Слайд {row['order']}",  # Название по умолчанию
+            "content_hash": row["content_hash"],
+            "fingerprint": row.get("fingerprint")
+        }
+        for row in rows
+    ])
+
+    # Каталог мог остаться от удаленной презентации с тем же ID
+    dest_dir = slides_dir(presentation.id)
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(dest_dir), exist_ok=True)
+    os.rename(staging_dir(job_id), dest_dir)
+    invalidate_presentation_images(presentation.id)
+
+    try:
+        db.commit()
+    except BaseException:
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        raise
+    return presentation
+
+
+def build_variants(presentation_id: int, rows: list[dict]) -> None:
+    """Миниатюры, 720p/1080p и WebP/AVIF - в фоне, задача их не ждет"""
+    schedule_variants([os.path.join(slides_dir(presentation_id), row["filename"]) for row in rows])
+
+
+def ingest_folder(db: Session, job_id: int, params: dict, progress: JobProgress) -> dict:
+    """Загрузка slide*.jpg из папки на сервере"""
+    folder_path = params["folder_path"]
+    if not os.path.isdir(folder_path):
+        raise JobFailed(f"Папка не найдена: {folder_path}")
+
+    slide_files = scan_slide_folder(folder_path)
+    if not slide_files:
+        raise JobFailed("В папке не найдены файлы slide*.jpg")
+
+    progress(0, len(slide_files), force=True)
+    staging = staging_dir(job_id)
+    os.makedirs(staging, exist_ok=True)
+    imported = import_slides(slide_files, staging, on_progress=progress)
+
+    rows = [
+        {"filename": slide.filename, "order": slide.order, "content_hash": content_hash}
+        for slide, (_, content_hash) in zip(slide_files, imported)
+    ]
+    presentation = finalize_presentation(db, job_id, params["title"], os.path.basename(folder_path), rows)
+    build_variants(presentation.id, rows)
+
+    methods = {}
+    for method, _ in imported:
+        methods[method] = methods.get(method, 0) + 1
+    return {"presentation_id": presentation.id, "slides_count": len(rows), "copy_methods": methods}
+
+
+def ingest_files(db: Session, job_id: int, params: dict, progress: JobProgress) -> dict:
+    """Загрузка файлов из браузера: файлы уже сохранены запросом в staging/{job_id}"""
+    staging = staging_dir(job_id)
+    files = params["files"]
+    progress(0, len(files), force=True)
+
+    # ✅ Проверка заголовков и размеров JPEG параллельно
+    _, errors = validate_images(
+        [(item["order"], os.path.join(staging, item["filename"]), item["source_name"]) for item in files],
+        on_progress=progress
+    )
+    if errors:
+        raise JobFailed(f"Ошибки в {len(errors)} файлах", result={"errors": errors})
+
+    rows = [
+        {"filename": item["filename"], "order": item["order"], "content_hash": item["content_hash"]}
+        for item in files
+    ]
+    presentation = finalize_presentation(db, job_id, params["title"], "upload", rows)
+    build_variants(presentation.id, rows)
+    return {"presentation_id": presentation.id, "slides_count": len(rows)}
+
+
+def ingest_package(db: Session, job_id: int, params: dict, progress: JobProgress) -> dict:
+    """
+    Загрузка ZIP-пакета слайдов, собранного докачиваемой загрузкой (resumable_uploads.py).
+    Пакет удаляется после задачи независимо от результата.
+    """
+    package_path = params["path"]
+    try:
+        if not os.path.isfile(package_path):
+            raise JobFailed("Файл пакета не найден (сессия загрузки истекла?)")
+
+        # ✅ Контрольная сумма всего пакета после сборки из частей
+        if params.get("sha256") and file_sha256(package_path) != params["sha256"]:
+            raise JobFailed("Контрольная сумма пакета не совпадает с заявленной")
+
+        try:
+            entries = read_slide_package(package_path)
+        except InvalidPackage as e:
+            raise JobFailed(f"Некорректный пакет: {e}")
+
+        progress(0, len(entries) * 2, force=True)
+        staging = staging_dir(job_id)
+        os.makedirs(staging, exist_ok=True)
+        stored, errors = extract_slide_package(package_path, entries, staging, UploadBudget(UPLOAD_MAX_PACKAGE_BYTES),
+                                               on_progress=progress)
+        if errors:
+            raise JobFailed(f"Ошибки в {len(errors)} файлах", result={"errors": errors})
+
+        _, errors = validate_images(
+            [(order, os.path.join(staging, f"slide{order}.jpg"), info.filename) for order, info in entries],
+            on_progress=lambda done: progress(len(entries) + done)
+        )
+        if errors:
+            raise JobFailed(f"Ошибки в {len(errors)} файлах", result={"errors": errors})
+
+        rows = [
+            {"filename": f"slide{order}.jpg", "order": order, "content_hash": stored[order]["content_hash"]}
+            for order, _ in entries
+        ]
+        presentation = finalize_presentation(db, job_id, params["title"], params["source_name"], rows)
+        build_variants(presentation.id, rows)
+        return {"presentation_id": presentation.id, "slides_count": len(rows)}
+    finally:
+        if os.path.exists(package_path):
+            os.remove(package_path)
+
+
+def ingest_document(db: Session, job_id: int, params: dict, progress: JobProgress) -> dict:
+    """Загрузка PPTX или PDF: конвертация в JPEG и создание презентации"""
+    from utils.convert_pptx import convert_pptx_to_images, render_settings
+    from utils.slide_fingerprint import slide_fingerprints
+
+    staging = staging_dir(job_id)
+    source_path = os.path.join(staging, params["filename"])
+    render_dir = os.path.join(staging, "render")
+    os.makedirs(render_dir, exist_ok=True)
+
+    if source_path.lower().endswith(".pdf"):
+        with _convert_slots:
+            return ingest_pdf_pages(db, job_id, params, source_path, render_dir, progress)
+
+    with _convert_slots:
+        try:
+            image_paths = convert_pptx_to_images(source_path, render_dir, on_progress=progress)
+        except Exception as e:
+            raise JobFailed(f"Не удалось конвертировать файл: {e}")
+    if not image_paths:
+        raise JobFailed("Файл не содержит слайдов")
+
+    # Отпечатки слайдов - для повторной загрузки исправленного PPTX
+    fingerprints = []
+    try:
+        fingerprints = slide_fingerprints(source_path, render_settings())
+    except Exception as e:
+        print(f"Warning: Could not fingerprint slides: {e}")
+    if len(fingerprints) != len(image_paths):
+        fingerprints = [None] * len(image_paths)  # Рендерер выдал не все страницы
+
+    rows = []
+    for order, (image_path, fingerprint) in enumerate(zip(image_paths, fingerprints), 1):
+        filename = f"slide{order}.jpg"
+        dest_path = os.path.join(staging, filename)
+        os.replace(image_path, dest_path)
+        rows.append({
+            "filename": filename,
+            "order": order,
+            "content_hash": file_sha256(dest_path),
+            "fingerprint": fingerprint
+        })
+    # В каталог презентации переносятся только изображения
+    shutil.rmtree(render_dir, ignore_errors=True)
+    os.remove(source_path)
+
+    presentation = finalize_presentation(db, job_id, params["title"], params["source_name"], rows)
+    build_variants(presentation.id, rows)
+    return {"presentation_id": presentation.id, "slides_count": len(rows)}
+
+
+def discard_partial_presentation(db: Session, presentation_id: int) -> None:
+    """Удаляет недозагруженную презентацию (status=processing) вместе со слайдами и файлами"""
+    processing = db.query(Presentation.id).filter(
+        Presentation.id == presentation_id, Presentation.status == "processing"
+    ).first()
+    if processing is None:
+        return  # Уже удалена или это готовая презентация (например, задача pptx_update)
+    db.query(IngestJob).filter(IngestJob.presentation_id == presentation_id).update(
+        {IngestJob.presentation_id: None}, synchronize_session=False
+    )
+    db.query(Slide).filter(Slide.presentation_id == presentation_id).delete(synchronize_session=False)
+    db.query(Presentation).filter(Presentation.id == presentation_id).delete(synchronize_session=False)
+    db.commit()
+    shutil.rmtree(slides_dir(presentation_id), ignore_errors=True)
+    invalidate_presentation_images(presentation_id)
+
+
+def ingest_pdf_pages(db: Session, job_id: int, params: dict, source_path: str,
+                     render_dir: str, progress: JobProgress) -> dict:
+    """
+    Загрузка PDF постранично: презентация создается сразу (status=processing),
+    слайды каждой готовой порции страниц коммитятся и видны администратору,
+    не дожидаясь конца растеризации. После последней страницы - status=draft.
+    """
+    from utils.convert_pptx import pdf_page_count, rasterize_pdf
+
+    try:
+        page_count = pdf_page_count(source_path)
+    except Exception as e:
+        raise JobFailed(f"Не удалось прочитать PDF: {e}")
+    if page_count == 0:
+        raise JobFailed("PDF не содержит страниц")
+    progress(0, page_count, force=True)
+
+    presentation = Presentation(title=params["title"], filename=params["source_name"], status="processing")
+    db.add(presentation)
+    db.flush()
+    presentation_id = presentation.id
+    db.query(IngestJob).filter(IngestJob.id == job_id).update(
+        {IngestJob.presentation_id: presentation_id}, synchronize_session=False
+    )
+    # Каталог мог остаться от удаленной презентации с тем же ID
+    dest_dir = slides_dir(presentation_id)
+    shutil.rmtree(dest_dir, ignore_errors=True)
+    os.makedirs(dest_dir)
+    db.commit()
+
+    def store_pages(first_page: int, image_paths: list[str]) -> None:
+        # Презентацию могли удалить, пока шла растеризация
+        if db.query(Presentation.id).filter(Presentation.id == presentation_id).first() is None:
+            raise JobFailed("Презентация удалена во время загрузки")
+        rows = []
+        for order, image_path in enumerate(image_paths, first_page):
+            filename = f"slide{order}.jpg"
+            dest_path = os.path.join(dest_dir, filename)
+            os.replace(image_path, dest_path)
+            rows.append({"filename": filename, "order": order, "content_hash": file_sha256(dest_path)})
+        db.execute(insert(Slide), [
+            {
+                "presentation_id": presentation_id,
+                "filename": row["filename"],
+                "order": row["order"],
+                "title": f"Слайд {row['order']}",
+                "content_hash": row["content_hash"]
+            }
+            for row in rows
+        ])
+        db.query(Presentation).filter(Presentation.id == presentation_id).update(
+            {Presentation.updated_at: func.now()}, synchronize_session=False
+        )
+        db.commit()
+        invalidate_presentation_images(presentation_id)
+        build_variants(presentation_id, rows)
+
+    try:
+        try:
+            rasterize_pdf(source_path, render_dir, on_progress=progress, on_pages=store_pages)
+        except JobFailed:
+            raise
+        except Exception as e:
+            raise JobFailed(f"Не удалось конвертировать файл: {e}")
+    except BaseException:
+        db.rollback()
+        discard_partial_presentation(db, presentation_id)
+        raise
+
+    db.query(Presentation).filter(Presentation.id == presentation_id).update(
+        {Presentation.status: "draft", Presentation.updated_at: func.now()}, synchronize_session=False
+    )
+    db.commit()
+    return {"presentation_id": presentation_id, "slides_count": page_count}
+
+
+def match_slides(slides: list[Slide], fingerprints: list[str], dest_dir: str) -> dict[int, int]:
+    """
+    Сопоставляет слайды нового PPTX со старыми по отпечатку: {новый номер: индекс старого слайда}.
+    Сначала слайд на прежней позиции, затем первый свободный с тем же отпечатком
+    (вставка или удаление слайда в начале не перерисовывает остальные).
+    """
+    available = {}
+    for index, slide in enumerate(slides):
+        if slide.fingerprint and os.path.isfile(os.path.join(dest_dir, slide.filename)):
+            available.setdefault(slide.fingerprint, []).append(index)
+
+    matched = {}
+    for number, fingerprint in enumerate(fingerprints, 1):
+        candidates = available.get(fingerprint, [])
+        if number - 1 in candidates:
+            candidates.remove(number - 1)
+            matched[number] = number - 1
+    for number, fingerprint in enumerate(fingerprints, 1):
+        candidates = available.get(fingerprint)
+        if number not in matched and candidates:
+            matched[number] = candidates.pop(0)
+    return matched
+
+
+def ingest_pptx_update(db: Session, job_id: int, params: dict, progress: JobProgress) -> dict:
+    """
+    Повторная загрузка исправленного PPTX в существующую презентацию.
+    Слайды сопоставляются по отпечатку: найденный слайд остается как есть
+    (изображение, ID и просмотры пользователей) и только переставляется,
+    остальные перерисовываются. Измененный слайд на прежней позиции получает
+    новый файл под тем же ID; просмотры сбрасываются только у перерисованных.
+    """
+    from utils.convert_pptx import render_pptx_slides, render_settings
+    from utils.slide_fingerprint import slide_fingerprints
+
+    presentation_id = params["presentation_id"]
+    staging = staging_dir(job_id)
+    pptx_path = os.path.join(staging, PPTX_SOURCE_NAME)
+    try:
+        fingerprints = slide_fingerprints(pptx_path, render_settings())
+    except Exception as e:
+        raise JobFailed(f"Не удалось прочитать PPTX: {e}")
+    if not fingerprints:
+        raise JobFailed("PPTX файл не содержит слайдов")
+
+    if db.get(Presentation, presentation_id) is None:
+        raise JobFailed("Презентация не найдена")
+    slides = load_deck(db, presentation_id)
+    dest_dir = slides_dir(presentation_id)
+    matched = match_slides(slides, fingerprints, dest_dir)
+    changed = [number for number in range(1, len(fingerprints) + 1) if number not in matched]
+
+    # ✅ Рендерим только измененные слайды (в общей очереди конвертаций)
+    progress(0, len(changed), force=True)
+    render_dir = os.path.join(staging, "render")
+    os.makedirs(render_dir, exist_ok=True)
+    with _convert_slots:
+        try:
+            rendered = render_pptx_slides(pptx_path, render_dir, changed, len(fingerprints), on_progress=progress)
+        except Exception as e:
+            raise JobFailed(f"Не удалось конвертировать слайды: {e}")
+
+    # Новые изображения - под новыми именами: старые файлы отдаются до commit
+    os.makedirs(dest_dir, exist_ok=True)
+    new_files = {}
+    for number, path in rendered.items():
+        content_hash = file_sha256(path)
+        filename = f"slide{number}-{content_hash[:8]}.jpg"
+        os.replace(path, os.path.join(dest_dir, filename))
+        new_files[number] = (filename, content_hash)
+    in_use = {filename for filename, _ in new_files.values()}
+    original_files = {slide.filename for slide in slides}
+
+    presentation = db.query(Presentation).filter(Presentation.id == presentation_id).with_for_update().first()
+    used = set(matched.values())
+    deck = {number: slides[index] for number, index in matched.items()}
+    old_files, reset_ids = [], []
+    for number in changed:
+        filename, content_hash = new_files[number]
+        if number <= len(slides) and number - 1 not in used:
+            # Измененный слайд на прежнем месте - тот же ID, новое изображение
+            slide = slides[number - 1]
+            used.add(number - 1)
+            old_files.append(slide.filename)
+            slide.filename = filename
+            slide.content_hash = content_hash
+            slide.fingerprint = fingerprints[number - 1]
+            reset_ids.append(slide.id)
+        else:
+            slide = Slide(
+                presentation_id=presentation_id,
+                filename=filename,
+                title=f"Слайд {number}",  # Название по умолчанию
+                content_hash=content_hash,
+                fingerprint=fingerprints[number - 1]
+            )
+            db.add(slide)
+        deck[number] = slide
+
+    for number, slide in deck.items():
+        if slide.order != number:
+            if slide.title == f"Слайд {slide.order}":
+                slide.title = f"Слайд {number}"  # Название по умолчанию следует за позицией
+            slide.order = number
+
+    removed = [slide for index, slide in enumerate(slides) if index not in used]
+    reset_ids.extend(slide.id for slide in removed)
+    for slide in removed:
+        old_files.append(slide.filename)
+        db.delete(slide)
+    db.flush()  # ID новых слайдов
+
+    moves = {index: number - 1 for number, index in matched.items()}
+    deck_ids = [deck[number].id for number in range(1, len(fingerprints) + 1)]
+    reset_slides_progress(db, presentation_id, reset_ids, moves, deck_ids)
+
+    presentation.filename = params["source_name"]
+    presentation.updated_at = func.now()
+    try:
+        db.commit()
+    except BaseException:
+        for filename in in_use:
+            if filename not in original_files:
+                os.remove(os.path.join(dest_dir, filename))
+        raise
+
+    invalidate_presentation_images(presentation_id)
+    for filename in old_files:
+        if filename in in_use:
+            continue
+        old_path = os.path.join(dest_dir, filename)
+        remove_variants(old_path)
+        if os.path.exists(old_path):
+            os.remove(old_path)
+    build_variants(presentation_id, [{"filename": filename} for filename in in_use])
+
+    return {
+        "presentation_id": presentation_id,
+        "slides_count": len(fingerprints),
+        "rerendered": len(changed),
+        "reused": len(matched),
+        "moved": sum(1 for number, index in matched.items() if index != number - 1),
+        "removed": len(removed)
+    }
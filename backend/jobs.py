@@ -0,0 +1,357 @@
+"""
+Фоновые задачи загрузки слайдов.
+
+HTTP-запрос только создает строку IngestJob (и при загрузке из браузера
+сохраняет файлы во временный каталог задачи), после чего сразу отвечает
+номером задачи. Сама загрузка выполняется в пуле:
+- INGEST_EXECUTOR=thread  - потоки процесса приложения (по умолчанию)
+- INGEST_EXECUTOR=process - отдельные процессы-воркеры
+Одновременно выполняется не больше INGEST_MAX_CONCURRENCY задач на процесс.
+
+Файлы задачи пишутся в staging/{job_id} и переносятся в slides/{presentation_id}
+одним rename только после успешной загрузки, поэтому упавшая задача
+не оставляет частичных файлов в UPLOADS_DIR. Исключение - постраничная
+загрузка PDF: ее презентация при ошибке удаляется целиком.
+"""
+import importlib
+import json
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal
+from models import IngestJob
+
+UPLOADS_DIR = "/tmp/slideconfirm_uploads"
+STAGING_DIR = os.path.join(UPLOADS_DIR, "staging")
+
+INGEST_EXECUTOR = os.getenv("INGEST_EXECUTOR", "thread")
+INGEST_MAX_CONCURRENCY = int(os.getenv("INGEST_MAX_CONCURRENCY", "2"))
+# ✅ Воркер отмечается в строке задачи раз в INGEST_HEARTBEAT_SECONDS, даже когда
+# прогресс не меняется (долгая конвертация); задача без сигналов дольше
+# INGEST_STALE_SECONDS считается прерванной - проверка раз в INGEST_SWEEP_SECONDS
+INGEST_HEARTBEAT_SECONDS = int(os.getenv("INGEST_HEARTBEAT_SECONDS", "30"))
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", "120"))
+INGEST_SWEEP_SECONDS = int(os.getenv("INGEST_SWEEP_SECONDS", "60"))
+# Временный каталог без задачи (запрос упал до commit) удаляется через час
+STAGING_ORPHAN_SECONDS = 3600
+PROGRESS_INTERVAL = 0.5
+
+# Обработчики задач: "модуль:функция" (импортируются и в процессах-воркерах)
+JOB_HANDLERS = {
+    "folder": "ingest:ingest_folder",
+    "files": "ingest:ingest_files",
+    "package": "ingest:ingest_package",
+    "document": "ingest:ingest_document",
+    "pptx_update": "ingest:ingest_pptx_update",
+}
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobFailed(Exception):
+    """Ожидаемая ошибка задачи: сообщение для админки и результат (например, ошибки по файлам)"""
+
+    def __init__(self, message: str, result: Optional[dict] = None):
+        super().__init__(message)
+        self.result = result
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            if INGEST_EXECUTOR == "process":
+                _executor = ProcessPoolExecutor(
+                    max_workers=INGEST_MAX_CONCURRENCY,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                _executor = ThreadPoolExecutor(max_workers=INGEST_MAX_CONCURRENCY, thread_name_prefix="ingest")
+        return _executor
+
+
+def staging_dir(job_id: int) -> str:
+    """Временный каталог файлов задачи"""
+    return os.path.join(STAGING_DIR, str(job_id))
+
+
+def create_job(db: Session, kind: str, params: dict, created_by: Optional[int] = None) -> IngestJob:
+    """Создает задачу в текущей транзакции (ставится в очередь после commit и enqueue_job)"""
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    job = IngestJob(kind=kind, status="queued", params=json.dumps(params),
+                    progress_done=0, progress_total=0, created_by=created_by)
+    db.add(job)
+    db.flush()
+    return job
+
+
+def _report_crash(future) -> None:
+    """Ошибка вне run_job (например, упал процесс-воркер) - иначе она потеряется"""
+    error = future.exception()
+    if error is not None:
+        print(f"Warning: Ingest worker failed: {error!r}")
+
+
+def enqueue_job(job_id: int) -> None:
+    """Отправляет задачу в пул (строка задачи уже должна быть закоммичена)"""
+    global _executor
+    try:
+        future = _get_executor().submit(run_job, job_id)
+    except BrokenProcessPool:
+        # Воркер упал - пересоздаем пул и повторяем
+        with _executor_lock:
+            _executor = None
+        future = _get_executor().submit(run_job, job_id)
+    future.add_done_callback(_report_crash)
+
+
+def submit_job(db: Session, kind: str, params: dict, created_by: Optional[int] = None) -> IngestJob:
+    """Создает, коммитит и запускает задачу"""
+    job = create_job(db, kind, params, created_by)
+    db.commit()
+    enqueue_job(job.id)
+    return job
+
+
+class JobProgress:
+    """Пишет прогресс задачи отдельной короткой транзакцией (не чаще PROGRESS_INTERVAL)"""
+
+    def __init__(self, job_id: int):
+        self.job_id = job_id
+        self.done = 0
+        self.total = None
+        self._written_at = 0.0
+
+    def __call__(self, done: int, total: Optional[int] = None, force: bool = False) -> None:
+        self.done = done
+        if total is not None:
+            self.total = total
+        now = time.monotonic()
+        if not force and now - self._written_at < PROGRESS_INTERVAL:
+            return
+        self._written_at = now
+
+        values = {IngestJob.progress_done: done, IngestJob.updated_at: func.now()}
+        if self.total is not None:
+            values[IngestJob.progress_total] = self.total
+        db = SessionLocal()
+        try:
+            db.query(IngestJob).filter(IngestJob.id == self.job_id).update(values, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+class JobHeartbeat:
+    """Пока задача выполняется, фоновый поток обновляет updated_at ее строки"""
+
+    def __init__(self, job_id: int, interval: int = INGEST_HEARTBEAT_SECONDS):
+        self.job_id = job_id
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self) -> "JobHeartbeat":
+        self._thread = threading.Thread(target=self._run, daemon=True, name=f"ingest-heartbeat-{self.job_id}")
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            db = SessionLocal()
+            try:
+                db.query(IngestJob).filter(
+                    IngestJob.id == self.job_id, IngestJob.status == "running"
+                ).update({IngestJob.updated_at: func.now()}, synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                print(f"Warning: Ingest heartbeat failed: {e}")
+            finally:
+                db.close()
+
+
+def _claim(job_id: int) -> bool:
+    """Атомарно переводит задачу queued -> running (задачу выполняет только один воркер)"""
+    db = SessionLocal()
+    try:
+        now = func.now()
+        claimed = db.execute(
+            update(IngestJob)
+            .where(IngestJob.id == job_id, IngestJob.status == "queued")
+            .values(status="running", started_at=now, updated_at=now)
+        ).rowcount
+        db.commit()
+        return claimed == 1
+    finally:
+        db.close()
+
+
+def _finish(job_id: int, status: str, result: Optional[dict] = None, error: Optional[str] = None,
+            progress: Optional[JobProgress] = None) -> None:
+    db = SessionLocal()
+    try:
+        now = func.now()
+        values = {
+            IngestJob.status: status,
+            IngestJob.result: json.dumps(result) if result is not None else None,
+            IngestJob.error: error,
+            IngestJob.updated_at: now,
+            IngestJob.finished_at: now
+        }
+        if result and result.get("presentation_id"):
+            values[IngestJob.presentation_id] = result["presentation_id"]
+        if progress is not None:
+            values[IngestJob.progress_done] = progress.done
+            if progress.total is not None:
+                values[IngestJob.progress_total] = progress.total
+        db.query(IngestJob).filter(IngestJob.id == job_id).update(values, synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+
+def resolve_handler(kind: str):
+    module_name, func_name = JOB_HANDLERS[kind].split(":")
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def run_job(job_id: int) -> None:
+    """Выполняет задачу (в потоке или процессе пула)"""
+    if not _claim(job_id):
+        return
+
+    db = SessionLocal()
+    progress = JobProgress(job_id)
+    try:
+        job = db.get(IngestJob, job_id)
+        handler = resolve_handler(job.kind)
+        params = json.loads(job.params or "{}")
+        with JobHeartbeat(job_id):
+            result = handler(db, job_id, params, progress)
+        _finish(job_id, "succeeded", result=result, progress=progress)
+    except JobFailed as e:
+        db.rollback()
+        _finish(job_id, "failed", result=e.result, error=str(e), progress=progress)
+    except Exception as e:
+        db.rollback()
+        traceback.print_exc()
+        _finish(job_id, "failed", error=f"{type(e).__name__}: {e}", progress=progress)
+    finally:
+        db.close()
+        # После успеха каталог уже перенесен; после ошибки - удаляем частичные файлы
+        shutil.rmtree(staging_dir(job_id), ignore_errors=True)
+
+
+def fail_stale_jobs() -> int:
+    """
+    Задачи в running без сигналов дольше INGEST_STALE_SECONDS (процесс-воркер упал
+    или перезапущен) помечаются failed, их временные файлы и недозагруженные
+    презентации удаляются. Возвращает число таких задач.
+    """
+    db = SessionLocal()
+    try:
+        stale_before = datetime.now(timezone.utc) - timedelta(seconds=INGEST_STALE_SECONDS)
+        stale = db.query(IngestJob).filter(
+            IngestJob.status == "running",
+            IngestJob.updated_at < stale_before
+        ).with_for_update(skip_locked=True).all()
+        partial_ids = []
+        for job in stale:
+            job.status = "failed"
+            job.error = "Задача прервана: воркер перестал отвечать"
+            job.finished_at = func.now()
+            shutil.rmtree(staging_dir(job.id), ignore_errors=True)
+            if job.presentation_id is not None:
+                partial_ids.append(job.presentation_id)
+        db.commit()
+
+        # Презентации, которые загружались постранично (PDF), удаляются целиком
+        if partial_ids:
+            from ingest import discard_partial_presentation
+            for presentation_id in partial_ids:
+                discard_partial_presentation(db, presentation_id)
+        return len(stale)
+    finally:
+        db.close()
+
+
+def recover_jobs() -> None:
+    """
+    При старте: зависшие задачи помечаются failed (fail_stale_jobs),
+    задачи в очереди запускаются снова.
+    """
+    fail_stale_jobs()
+
+    db = SessionLocal()
+    try:
+        active_ids = {
+            job_id for (job_id,) in db.query(IngestJob.id).filter(IngestJob.status.in_(ACTIVE_STATUSES))
+        }
+        queued_ids = [
+            job_id for (job_id,) in db.query(IngestJob.id).filter(IngestJob.status == "queued").order_by(IngestJob.id)
+        ]
+    finally:
+        db.close()
+
+    # Временные каталоги без активной задачи (запрос упал до commit)
+    if os.path.isdir(STAGING_DIR):
+        for entry in os.scandir(STAGING_DIR):
+            if not entry.name.isdigit() or int(entry.name) in active_ids:
+                continue
+            if entry.stat().st_mtime < time.time() - STAGING_ORPHAN_SECONDS:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    for job_id in queued_ids:
+        enqueue_job(job_id)
+
+
+def start_stale_sweeper(interval: int = INGEST_SWEEP_SECONDS) -> None:
+    """Периодическая проверка зависших задач (задачу прерванного процесса подберет любой живой)"""
+    def sweep() -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                fail_stale_jobs()
+            except Exception as e:
+                print(f"Warning: Could not sweep stale ingest jobs: {e}")
+
+    threading.Thread(target=sweep, daemon=True, name="ingest-sweeper").start()
+
+
+def job_to_dict(job: IngestJob) -> dict:
+    """Представление задачи для API"""
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "progress": {
+            "done": job.progress_done,
+            "total": job.progress_total
+        },
+        "presentation_id": job.presentation_id,
+        "result": json.loads(job.result) if job.result else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
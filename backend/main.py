@@ -1,5 +1,6 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 import models
 from database import engine, SessionLocal
 from models import User
@@ -9,7 +10,10 @@ from admin import router as admin_router
 from slides_admin import router as slides_admin_router
 from files import router as files_router
 from user import router as user_router
-from utils.security import hash_password
+from utils.security import hash_password, PasswordHasherBusy
+from counters import on_user_added
+from resumable_uploads import router as resumable_uploads_router, expire_upload_sessions, start_expiry_sweeper
+from jobs import recover_jobs, start_stale_sweeper
 
 # Создание таблиц
 models.Base.metadata.create_all(bind=engine)
@@ -20,13 +24,15 @@ def create_initial_data():
         db = SessionLocal()
         try:
             if not db.query(User).filter_by(email="user@gss.aero").first():
-                db.add(User(
+                user = User(
                     first_name="User",
                     last_name="GSS",
                     email="user@gss.aero",
                     password_hash=hash_password("123456"),
                     role="user"
-                ))
+                )
+                db.add(user)
+                on_user_added(db, user)
             if not db.query(User).filter_by(email="admin@gss.aero").first():
                 db.add(User(
                     first_name="Admin",
@@ -44,6 +50,20 @@ def create_initial_data():
 
 create_initial_data()
 
+# ✅ Фоновые задачи загрузки, прерванные перезапуском сервера
+try:
+    recover_jobs()
+except Exception as e:
+    print(f"Warning: Could not recover ingest jobs: {e}")
+start_stale_sweeper()
+
+# ✅ Брошенные докачиваемые загрузки
+try:
+    expire_upload_sessions()
+except Exception as e:
+    print(f"Warning: Could not expire upload sessions: {e}")
+start_expiry_sweeper()
+
 # Создание FastAPI приложения
 app = FastAPI(
     title="SlideConfirm API",
@@ -60,11 +80,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ✅ Пул хеширования паролей перегружен - просим клиента повторить позже
+@app.exception_handler(PasswordHasherBusy)
+def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Server is busy, please retry"},
+        headers={"Retry-After": "1"}
+    )
+
 # Регистрация роутеров
 app.include_router(auth_router)
 app.include_router(slides_router)
 app.include_router(admin_router)
 app.include_router(slides_admin_router)
+app.include_router(resumable_uploads_router)
 app.include_router(files_router)
 app.include_router(user_router)
 
@@ -0,0 +1,72 @@
+"""Progress watermark: contiguous_viewed on user_presentation_position
+
+Revision ID: 002_progress_watermark
+Revises: 001_initial_migration
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers used by Alembic.
+revision = '002_progress_watermark'
+down_revision = '001_initial_migration'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+
+    # ✅ Удаляем дубликаты позиций (оставляем самую свежую запись)
+    duplicates = bind.execute(sa.text(
+        "SELECT user_id, presentation_id, MAX(id) FROM user_presentation_position "
+        "GROUP BY user_id, presentation_id HAVING COUNT(*) > 1"
+    )).fetchall()
+    for user_id, presentation_id, keep_id in duplicates:
+        bind.execute(sa.text(
+            "DELETE FROM user_presentation_position "
+            "WHERE user_id = :u AND presentation_id = :p AND id <> :k"
+        ), {"u": user_id, "p": presentation_id, "k": keep_id})
+
+    with op.batch_alter_table('user_presentation_position') as batch_op:
+        batch_op.add_column(sa.Column('contiguous_viewed', sa.Integer(), nullable=True))
+        batch_op.create_unique_constraint(
+            'uq_user_presentation_position', ['user_id', 'presentation_id']
+        )
+
+    # ✅ Заполняем водяной знак по существующим просмотрам.
+    # Строки, которые не удалось посчитать, остаются NULL и досчитываются приложением
+    slides = bind.execute(sa.text(
+        'SELECT id, presentation_id FROM slides ORDER BY presentation_id, "order"'
+    )).fetchall()
+    deck = {}
+    for slide_id, presentation_id in slides:
+        deck.setdefault(presentation_id, []).append(slide_id)
+
+    viewed = {}
+    for user_id, slide_id in bind.execute(sa.text(
+        "SELECT user_id, slide_id FROM user_slide_progress WHERE viewed = :v"
+    ), {"v": True}):
+        viewed.setdefault(user_id, set()).add(slide_id)
+
+    positions = bind.execute(sa.text(
+        "SELECT id, user_id, presentation_id FROM user_presentation_position"
+    )).fetchall()
+    for position_id, user_id, presentation_id in positions:
+        user_viewed = viewed.get(user_id, set())
+        watermark = 0
+        for slide_id in deck.get(presentation_id, []):
+            if slide_id not in user_viewed:
+                break
+            watermark += 1
+        bind.execute(sa.text(
+            "UPDATE user_presentation_position SET contiguous_viewed = :w WHERE id = :id"
+        ), {"w": watermark, "id": position_id})
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('user_presentation_position') as batch_op:
+        batch_op.drop_constraint('uq_user_presentation_position', type_='unique')
+        batch_op.drop_column('contiguous_viewed')
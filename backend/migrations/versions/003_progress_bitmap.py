@@ -0,0 +1,82 @@
+"""Bitmap progress storage: viewed_bits on user_presentation_position
+
+Revision ID: 003_progress_bitmap
+Revises: 002_progress_watermark
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers used by Alembic.
+revision = '003_progress_bitmap'
+down_revision = '002_progress_watermark'
+branch_labels = None
+depends_on = None
+
+
+def pack_positions(positions) -> bytes:
+    """Упаковывает позиции слайдов (с нуля) в битовую маску"""
+    buf = bytearray((max(positions) // 8 + 1) if positions else 0)
+    for index in positions:
+        buf[index // 8] |= 1 << (index % 8)
+    return bytes(buf)
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('user_presentation_position') as batch_op:
+        batch_op.add_column(sa.Column('viewed_bits', sa.LargeBinary(), nullable=True))
+
+    bind = op.get_bind()
+
+    # ✅ Позиция каждого слайда в своей презентации
+    slide_position = {}
+    counters = {}
+    for slide_id, presentation_id in bind.execute(sa.text(
+        'SELECT id, presentation_id FROM slides ORDER BY presentation_id, "order"'
+    )):
+        slide_position[slide_id] = (presentation_id, counters.get(presentation_id, 0))
+        counters[presentation_id] = counters.get(presentation_id, 0) + 1
+
+    # ✅ Собираем просмотры в маски по (user_id, presentation_id)
+    viewed = {}
+    for user_id, slide_id in bind.execute(sa.text(
+        "SELECT user_id, slide_id FROM user_slide_progress WHERE viewed = :v"
+    ), {"v": True}):
+        if slide_id not in slide_position:
+            continue
+        presentation_id, index = slide_position[slide_id]
+        viewed.setdefault((user_id, presentation_id), set()).add(index)
+
+    existing = {
+        (user_id, presentation_id): position_id
+        for position_id, user_id, presentation_id in bind.execute(sa.text(
+            "SELECT id, user_id, presentation_id FROM user_presentation_position"
+        ))
+    }
+
+    for (user_id, presentation_id), positions in viewed.items():
+        bits = pack_positions(positions)
+        watermark = 0
+        while watermark in positions:
+            watermark += 1
+
+        position_id = existing.get((user_id, presentation_id))
+        if position_id is not None:
+            bind.execute(sa.text(
+                "UPDATE user_presentation_position SET viewed_bits = :b, contiguous_viewed = :w "
+                "WHERE id = :id"
+            ), {"b": bits, "w": watermark, "id": position_id})
+        else:
+            bind.execute(sa.text(
+                "INSERT INTO user_presentation_position "
+                "(user_id, presentation_id, last_slide_index, contiguous_viewed, viewed_bits) "
+                "VALUES (:u, :p, :i, :w, :b)"
+            ), {"u": user_id, "p": presentation_id, "i": max(watermark - 1, 0), "w": watermark, "b": bits})
+
+
+def downgrade() -> None:
+    # Строки user_slide_progress миграция не удаляет, поэтому откат - только удаление колонки
+    with op.batch_alter_table('user_presentation_position') as batch_op:
+        batch_op.drop_column('viewed_bits')
@@ -0,0 +1,40 @@
+"""Completion counters: presentation_stats and completion_stats
+
+Revision ID: 004_completion_counters
+Revises: 003_progress_bitmap
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers used by Alembic.
+revision = '004_completion_counters'
+down_revision = '003_progress_bitmap'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # ✅ Счетчики заполняются приложением при первом обращении
+    # (или командой сверки: python counters.py)
+    op.create_table(
+        'presentation_stats',
+        sa.Column('presentation_id', sa.Integer(), nullable=False),
+        sa.Column('completed_users', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['presentation_id'], ['presentations.id'], ),
+        sa.PrimaryKeyConstraint('presentation_id')
+    )
+    op.create_table(
+        'completion_stats',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('total_users', sa.Integer(), nullable=False),
+        sa.Column('completed_users', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('completion_stats')
+    op.drop_table('presentation_stats')
@@ -0,0 +1,28 @@
+"""Presentation.updated_at for ETag versioning
+
+Revision ID: 005_presentation_updated_at
+Revises: 004_completion_counters
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers used by Alembic.
+revision = '005_presentation_updated_at'
+down_revision = '004_completion_counters'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('presentations') as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+
+    op.execute("UPDATE presentations SET updated_at = COALESCE(published_at, uploaded_at)")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('presentations') as batch_op:
+        batch_op.drop_column('updated_at')
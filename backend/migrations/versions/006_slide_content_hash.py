@@ -0,0 +1,48 @@
+"""Slide.content_hash for versioned image URLs
+
+Revision ID: 006_slide_content_hash
+Revises: 005_presentation_updated_at
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+import hashlib
+import os
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers used by Alembic.
+revision = '006_slide_content_hash'
+down_revision = '005_presentation_updated_at'
+branch_labels = None
+depends_on = None
+
+UPLOADS_DIR = "/tmp/slideconfirm_uploads"
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('slides') as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    # ✅ Хешируем уже загруженные изображения; отсутствующие файлы остаются без хеша
+    # (для них отдается URL без версии)
+    bind = op.get_bind()
+    for slide_id, presentation_id, filename in bind.execute(sa.text(
+        "SELECT id, presentation_id, filename FROM slides"
+    )).fetchall():
+        path = os.path.join(UPLOADS_DIR, "slides", str(presentation_id), filename)
+        if not os.path.isfile(path):
+            continue
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        bind.execute(sa.text(
+            "UPDATE slides SET content_hash = :h WHERE id = :id"
+        ), {"h": digest.hexdigest(), "id": slide_id})
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('slides') as batch_op:
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,28 @@
+"""Slide.fingerprint for incremental PPTX re-rendering
+
+Revision ID: 009_slide_fingerprint
+Revises: 008_upload_sessions
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers used by Alembic.
+revision = '009_slide_fingerprint'
+down_revision = '008_upload_sessions'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Уже загруженные слайды остаются без отпечатка: при первой повторной
+    # загрузке PPTX они перерисовываются, ID слайдов сохраняются
+    with op.batch_alter_table('slides') as batch_op:
+        batch_op.add_column(sa.Column('fingerprint', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('slides') as batch_op:
+        batch_op.drop_column('fingerprint')
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
@@ -23,9 +23,11 @@ class Presentation(Base):
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     filename = Column(String, nullable=False)
-    status = Column(String, default="draft")  # draft или published
+    status = Column(String, default="draft")  # draft, published; processing - PDF еще загружается
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
     published_at = Column(DateTime(timezone=True), nullable=True)
+    # ✅ Любое изменение презентации или ее слайдов (используется для ETag)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 class Slide(Base):
     __tablename__ = "slides"
@@ -35,6 +37,8 @@ class Slide(Base):
     filename = Column(String, nullable=False)
     title = Column(String, nullable=True)  # Название слайда
     order = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=True)  # ✅ SHA-256 изображения (версия URL)
+    fingerprint = Column(String(64), nullable=True)  # ✅ Отпечаток исходного слайда PPTX (XML + медиа)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
     
     progress = relationship("UserSlideProgress", back_populates="slide", cascade="all, delete-orphan")
@@ -68,9 +72,66 @@ class UserPresentationPosition(Base):
     user_id = Column(Integer, ForeignKey("users.id"), index=True)
     presentation_id = Column(Integer, ForeignKey("presentations.id"), index=True)
     last_slide_index = Column(Integer, default=0)  # Индекс последнего слайда
+    # ✅ Сколько слайдов подряд с начала просмотрено (водяной знак прогресса).
+    # NULL - строка создана до появления поля, значение досчитывается при первом обращении
+    contiguous_viewed = Column(Integer, nullable=True, default=0)
+    # ✅ Битовая маска просмотренных позиций слайдов (PROGRESS_STORAGE=bitmap)
+    viewed_bits = Column(LargeBinary, nullable=True)
     last_viewed_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
     
     # Уникальный индекс для быстрого поиска
     __table_args__ = (
+        UniqueConstraint('user_id', 'presentation_id', name='uq_user_presentation_position'),
         {'sqlite_autoincrement': True},
     )
+
+class PresentationStats(Base):
+    """✅ Счетчик пользователей, завершивших презентацию (обновляется вместе с UserCompletion)"""
+    __tablename__ = "presentation_stats"
+    
+    presentation_id = Column(Integer, ForeignKey("presentations.id"), primary_key=True)
+    completed_users = Column(Integer, nullable=False, default=0)
+
+class CompletionStats(Base):
+    """✅ Глобальные счетчики для сводки админки (одна строка с id=1)"""
+    __tablename__ = "completion_stats"
+    
+    id = Column(Integer, primary_key=True)
+    total_users = Column(Integer, nullable=False, default=0)
+    completed_users = Column(Integer, nullable=False, default=0)
+
+class IngestJob(Base):
+    """✅ Фоновая задача загрузки слайдов (состояние и прогресс для админки)"""
+    __tablename__ = "ingest_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(32), nullable=False)  # folder, files, ...
+    status = Column(String(16), nullable=False, default="queued", index=True)  # queued, running, succeeded, failed
+    params = Column(Text, nullable=True)  # JSON параметров задачи
+    result = Column(Text, nullable=True)  # JSON результата (число слайдов, ошибки по файлам)
+    error = Column(Text, nullable=True)
+    progress_done = Column(Integer, nullable=False, default=0)
+    progress_total = Column(Integer, nullable=False, default=0)
+    presentation_id = Column(Integer, ForeignKey("presentations.id", ondelete="SET NULL"), nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    updated_at = Column(DateTime(timezone=True), nullable=True)  # Последний сигнал от воркера
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class UploadSession(Base):
+    """✅ Сессия докачиваемой загрузки пакета слайдов (PATCH по смещению)"""
+    __tablename__ = "upload_sessions"
+    
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    filename = Column(String, nullable=False)
+    title = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)  # Объявленный размер пакета
+    offset = Column(Integer, nullable=False, default=0)  # Сколько байт принято
+    sha256 = Column(String(64), nullable=True)  # Ожидаемый хеш всего пакета
+    status = Column(String(16), nullable=False, default="active", index=True)  # active, completed, aborted, expired
+    job_id = Column(Integer, ForeignKey("ingest_jobs.id", ondelete="SET NULL"), nullable=True)
+    created_by = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,333 @@
+"""
+Движок последовательного просмотра слайдов.
+Загружает колоду и прогресс пользователя фиксированным числом запросов,
+доступность слайдов считается одним проходом по префиксу.
+
+Водяной знак (UserPresentationPosition.contiguous_viewed) - число слайдов,
+просмотренных подряд с начала. Проверка порядка, обновление позиции и расчет
+прогресса читают только эту строку.
+
+Хранилище просмотров выбирается через PROGRESS_STORAGE:
+- rows   - строка UserSlideProgress на каждый слайд (по умолчанию)
+- bitmap - битовая маска позиций в UserPresentationPosition.viewed_bits,
+           одна строка на пару (пользователь, презентация)
+"""
+import os
+from typing import Optional
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Slide, UserSlideProgress, UserPresentationPosition
+
+PROGRESS_STORAGE = os.getenv("PROGRESS_STORAGE", "rows")
+
+
+def use_bitmap() -> bool:
+    return PROGRESS_STORAGE == "bitmap"
+
+
+def bit_is_set(bits: Optional[bytes], index: int) -> bool:
+    """Проверяет бит позиции слайда в маске"""
+    if not bits or index // 8 >= len(bits):
+        return False
+    return bool(bits[index // 8] >> (index % 8) & 1)
+
+
+def set_bit(bits: Optional[bytes], index: int) -> bytes:
+    """Возвращает маску с установленным битом позиции"""
+    buf = bytearray(bits or b"")
+    if len(buf) <= index // 8:
+        buf.extend(b"\x00" * (index // 8 + 1 - len(buf)))
+    buf[index // 8] |= 1 << (index % 8)
+    return bytes(buf)
+
+
+def count_bits(bits: Optional[bytes]) -> int:
+    return sum(bin(byte).count("1") for byte in bits or b"")
+
+
+def leading_bits(bits: Optional[bytes]) -> int:
+    """Число установленных битов подряд с нулевой позиции"""
+    count = 0
+    while bit_is_set(bits, count):
+        count += 1
+    return count
+
+
+def load_deck(db: Session, presentation_id: int) -> list[Slide]:
+    """Все слайды презентации в порядке показа (один запрос)"""
+    return db.query(Slide).filter(
+        Slide.presentation_id == presentation_id
+    ).order_by(Slide.order).all()
+
+
+def load_viewed_slide_ids(db: Session, user_id: int, presentation_id: int) -> set[int]:
+    """ID просмотренных пользователем слайдов презентации (один запрос с JOIN)"""
+    rows = db.query(UserSlideProgress.slide_id).join(
+        Slide, Slide.id == UserSlideProgress.slide_id
+    ).filter(
+        UserSlideProgress.user_id == user_id,
+        UserSlideProgress.viewed == True,
+        Slide.presentation_id == presentation_id
+    ).all()
+    return {row[0] for row in rows}
+
+
+def load_viewed_flags(db: Session, user_id: int, presentation_id: int, slides: list[Slide],
+                      position: Optional[UserPresentationPosition]) -> list[bool]:
+    """Флаг просмотра для каждого слайда колоды (в режиме bitmap - без запросов)"""
+    if use_bitmap():
+        bits = position.viewed_bits if position else None
+        return [bit_is_set(bits, idx) for idx in range(len(slides))]
+    
+    viewed_ids = load_viewed_slide_ids(db, user_id, presentation_id)
+    return [slide.id in viewed_ids for slide in slides]
+
+
+def compute_gating(slides: list[Slide], viewed_flags: list[bool]) -> list[tuple[Slide, bool, bool]]:
+    """
+    Возвращает (slide, viewed, can_view) для каждого слайда.
+    Слайд доступен, если все предыдущие просмотрены - один проход по префиксу.
+    """
+    result = []
+    prefix_viewed = True  # Первый слайд всегда доступен
+    for slide, viewed in zip(slides, viewed_flags):
+        result.append((slide, viewed, prefix_viewed))
+        prefix_viewed = prefix_viewed and viewed
+    return result
+
+
+def count_slides(db: Session, presentation_id: int) -> int:
+    """Количество слайдов презентации"""
+    return db.query(Slide).filter(Slide.presentation_id == presentation_id).count()
+
+
+def slide_index(db: Session, slide: Slide) -> int:
+    """Позиция слайда в колоде (с нуля) - один COUNT по индексу presentation_id"""
+    return db.query(Slide).filter(
+        Slide.presentation_id == slide.presentation_id,
+        Slide.order < slide.order
+    ).count()
+
+
+def get_position(db: Session, user_id: int, presentation_id: int,
+                 for_update: bool = False) -> Optional[UserPresentationPosition]:
+    """Строка позиции пользователя; for_update блокирует ее до конца транзакции"""
+    query = db.query(UserPresentationPosition).filter(
+        UserPresentationPosition.user_id == user_id,
+        UserPresentationPosition.presentation_id == presentation_id
+    )
+    if for_update:
+        query = query.with_for_update()
+    return query.first()
+
+
+def lock_position(db: Session, user_id: int, presentation_id: int) -> UserPresentationPosition:
+    """
+    Строка позиции под блокировкой до конца транзакции; отсутствующая создается.
+    При двух одновременных первых просмотрах второй INSERT упирается в уникальный
+    индекс, откатывается к точке сохранения и блокирует строку, созданную первым
+    """
+    position = get_position(db, user_id, presentation_id, for_update=True)
+    if position is not None:
+        return position
+    try:
+        with db.begin_nested():
+            # contiguous_viewed=NULL: водяной знак досчитается по хранилищу просмотров
+            db.add(UserPresentationPosition(
+                user_id=user_id,
+                presentation_id=presentation_id,
+                last_slide_index=0,
+                contiguous_viewed=None
+            ))
+    except IntegrityError:
+        pass
+    return get_position(db, user_id, presentation_id, for_update=True)
+
+
+def get_watermark(db: Session, position: Optional[UserPresentationPosition],
+                  user_id: int, presentation_id: int) -> int:
+    """
+    Водяной знак из строки позиции.
+    Для старых данных (нет строки или поле NULL) считается один раз по хранилищу просмотров.
+    """
+    if position is not None and position.contiguous_viewed is not None:
+        return position.contiguous_viewed
+    
+    if use_bitmap():
+        watermark = leading_bits(position.viewed_bits if position else None)
+        if position is not None:
+            position.contiguous_viewed = watermark
+        return watermark
+    
+    viewed_ids = load_viewed_slide_ids(db, user_id, presentation_id)
+    if not viewed_ids:
+        return 0
+    
+    watermark = 0
+    for slide in load_deck(db, presentation_id):
+        if slide.id not in viewed_ids:
+            break
+        watermark += 1
+    
+    if position is not None:
+        position.contiguous_viewed = watermark
+    return watermark
+
+
+def progress_version(presentation, position: Optional[UserPresentationPosition]) -> tuple:
+    """Версия прогресса для ETag: изменение презентации и строка позиции пользователя"""
+    version = (presentation.id, presentation.status, str(presentation.updated_at))
+    if position is None:
+        return version
+    return version + (
+        position.contiguous_viewed,
+        position.last_slide_index,
+        position.viewed_bits,
+        str(position.last_viewed_at)
+    )
+
+
+def extend_watermark(db: Session, position: Optional[UserPresentationPosition],
+                     user_id: int, presentation_id: int, watermark: int) -> int:
+    """
+    Сдвигает водяной знак через уже просмотренные слайды за ним: после повторной
+    загрузки презентации измененный слайд может стоять перед просмотренными
+    """
+    if use_bitmap():
+        bits = position.viewed_bits if position else None
+        while bit_is_set(bits, watermark):
+            watermark += 1
+        return watermark
+    
+    viewed_ids = load_viewed_slide_ids(db, user_id, presentation_id)
+    # Префикс [0, watermark) вмещает не больше watermark просмотров - дальше смотреть нечего
+    if len(viewed_ids) < watermark:
+        return watermark
+    following = db.query(Slide.id).filter(
+        Slide.presentation_id == presentation_id
+    ).order_by(Slide.order).offset(watermark)
+    for (slide_id,) in following:
+        if slide_id not in viewed_ids:
+            break
+        watermark += 1
+    return watermark
+
+
+def advance_position(db: Session, position: Optional[UserPresentationPosition],
+                     user_id: int, presentation_id: int, index: int, watermark: int) -> UserPresentationPosition:
+    """Сохраняет текущий слайд и сдвигает водяной знак (в рамках текущей транзакции)"""
+    new_watermark = max(watermark, index + 1)
+    if new_watermark > watermark:
+        new_watermark = extend_watermark(db, position, user_id, presentation_id, new_watermark)
+    if position:
+        position.last_slide_index = index
+        position.contiguous_viewed = new_watermark
+    else:
+        position = UserPresentationPosition(
+            user_id=user_id,
+            presentation_id=presentation_id,
+            last_slide_index=index,
+            contiguous_viewed=new_watermark
+        )
+        db.add(position)
+    return position
+
+
+def record_view(db: Session, user_id: int, slide_id: int, index: int,
+                position: UserPresentationPosition) -> None:
+    """Отмечает слайд просмотренным в выбранном хранилище"""
+    if use_bitmap():
+        position.viewed_bits = set_bit(position.viewed_bits, index)
+        return
+    
+    progress = db.query(UserSlideProgress).filter(
+        UserSlideProgress.user_id == user_id,
+        UserSlideProgress.slide_id == slide_id
+    ).first()
+    
+    if progress:
+        progress.viewed = True
+    else:
+        db.add(UserSlideProgress(user_id=user_id, slide_id=slide_id, viewed=True))
+
+
+def reset_progress(db: Session, user_id: int, presentation_id: int) -> None:
+    """Удаляет все просмотры пользователя в презентации (в обоих хранилищах)"""
+    slide_ids = db.query(Slide.id).filter(Slide.presentation_id == presentation_id)
+    db.query(UserSlideProgress).filter(
+        UserSlideProgress.user_id == user_id,
+        UserSlideProgress.slide_id.in_(slide_ids)
+    ).delete(synchronize_session=False)
+    
+    position = get_position(db, user_id, presentation_id, for_update=True)
+    if position:
+        position.last_slide_index = 0
+        position.contiguous_viewed = 0
+        position.viewed_bits = None
+
+
+def remap_bits(bits: Optional[bytes], moves: dict[int, int]) -> Optional[bytes]:
+    """
+    Маска новой колоды: бит старой позиции переносится на новую (moves: старая -> новая),
+    биты остальных позиций сбрасываются; None - просмотров не осталось
+    """
+    kept = [new_index for old_index, new_index in moves.items() if bit_is_set(bits, old_index)]
+    if not kept:
+        return None  # Пустая маска - NULL: список презентаций считает NULL "нет просмотров"
+    buf = bytearray(max(kept) // 8 + 1)
+    for index in kept:
+        buf[index // 8] |= 1 << (index % 8)
+    return bytes(buf)
+
+
+def reset_slides_progress(db: Session, presentation_id: int, reset_ids: list[int],
+                          moves: dict[int, int], deck_ids: list[int]) -> None:
+    """
+    Переносит прогресс всех пользователей на обновленную колоду (оба хранилища).
+    reset_ids - ID измененных и удаленных слайдов (их просмотры удаляются),
+    moves - позиции сохраненных слайдов (старая -> новая, с нуля),
+    deck_ids - ID слайдов новой колоды по порядку.
+    Водяной знак пересчитывается по оставшимся просмотрам.
+    """
+    if reset_ids:
+        db.query(UserSlideProgress).filter(
+            UserSlideProgress.slide_id.in_(reset_ids)
+        ).delete(synchronize_session=False)
+    
+    positions = db.query(UserPresentationPosition).filter(
+        UserPresentationPosition.presentation_id == presentation_id
+    ).with_for_update().all()
+    if not positions:
+        return
+    
+    viewed_by_user = {}
+    if not use_bitmap():
+        rows = db.query(UserSlideProgress.user_id, UserSlideProgress.slide_id).filter(
+            UserSlideProgress.slide_id.in_(deck_ids),
+            UserSlideProgress.viewed == True
+        ).all()
+        for user_id, slide_id in rows:
+            viewed_by_user.setdefault(user_id, set()).add(slide_id)
+    
+    for position in positions:
+        position.viewed_bits = remap_bits(position.viewed_bits, moves)
+        if use_bitmap():
+            position.contiguous_viewed = leading_bits(position.viewed_bits)
+        else:
+            viewed_ids = viewed_by_user.get(position.user_id, set())
+            watermark = 0
+            while watermark < len(deck_ids) and deck_ids[watermark] in viewed_ids:
+                watermark += 1
+            position.contiguous_viewed = watermark
+        if position.last_slide_index is not None:
+            last_index = moves.get(position.last_slide_index, position.last_slide_index)
+            position.last_slide_index = min(last_index, max(len(deck_ids) - 1, 0))
+
+
+def delete_presentation_progress(db: Session, presentation_id: int) -> None:
+    """Удаляет позиции и маски всех пользователей перед удалением презентации"""
+    db.query(UserPresentationPosition).filter(
+        UserPresentationPosition.presentation_id == presentation_id
+    ).delete(synchronize_session=False)
@@ -0,0 +1,404 @@
+"""
+Докачиваемая загрузка больших пакетов слайдов (по образцу протокола tus).
+
+1. POST   /admin/uploads          - создать сессию (имя, название, размер, sha256)
+2. PATCH  /admin/uploads/{id}     - дописать часть: заголовок Upload-Offset равен
+                                    числу уже принятых байт, тело - байты части;
+                                    необязательный Upload-Checksum: sha256 <base64>
+3. HEAD   /admin/uploads/{id}     - узнать смещение после обрыва связи
+4. DELETE /admin/uploads/{id}     - отменить загрузку
+
+Часть принимается во временный файл без открытой транзакции и дописывается
+в resumable/{id}.part короткой транзакцией. Когда принят последний байт,
+создается фоновая задача "package" (ingest.py): проверка sha256 всего пакета,
+распаковка slide*.jpg и создание презентации, как при загрузке файлов.
+Сессии без новых частей дольше UPLOAD_SESSION_TTL_SECONDS истекают, файлы удаляются
+(проверка раз в UPLOAD_SWEEP_SECONDS).
+"""
+import base64
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, get_db
+from models import IngestJob, UploadSession
+from schemas import UploadSessionCreate
+from jobs import ACTIVE_STATUSES, create_job, enqueue_job, job_to_dict
+from utils.uploads import UPLOAD_MAX_PACKAGE_BYTES
+from dependencies import Principal, get_current_admin as verify_admin
+
+router = APIRouter(prefix="/admin/uploads", tags=["admin-uploads"])
+
+UPLOADS_DIR = "/tmp/slideconfirm_uploads"
+RESUMABLE_DIR = os.path.join(UPLOADS_DIR, "resumable")
+
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+# Максимум байт в одном PATCH (клиент режет пакет на части не больше этого)
+UPLOAD_MAX_PATCH_BYTES = int(os.getenv("UPLOAD_MAX_PATCH_BYTES", str(32 * 1024 * 1024)))
+# Как часто удаляются истекшие сессии
+UPLOAD_SWEEP_SECONDS = int(os.getenv("UPLOAD_SWEEP_SECONDS", "600"))
+CHUNK_SUFFIX = ".chunk"  # Принимаемая часть до commit: resumable/{id}.XXXX.chunk
+
+SHA256_HEX_RE = re.compile(r"^[0-9a-f]{64}$")
+HTTP_460_CHECKSUM_MISMATCH = 460  # Код tus для несовпадения контрольной суммы части
+
+
+def part_path(upload_id: str) -> str:
+    return os.path.join(RESUMABLE_DIR, f"{upload_id}.part")
+
+
+def _utc(value: datetime) -> datetime:
+    """Время из БД как UTC с часовым поясом (SQLite возвращает наивное UTC, PostgreSQL - с поясом)"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _remove_part(upload_id: str) -> None:
+    try:
+        os.remove(part_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def session_to_dict(session: UploadSession, job: Optional[IngestJob] = None) -> dict:
+    """Представление сессии для API"""
+    return {
+        "upload_id": session.id,
+        "filename": session.filename,
+        "title": session.title,
+        "size": session.size,
+        "offset": session.offset,
+        "status": session.status,
+        "expires_at": session.expires_at,
+        "max_chunk_bytes": UPLOAD_MAX_PATCH_BYTES,
+        "job_id": session.job_id,
+        "job": job_to_dict(job) if job is not None else None
+    }
+
+
+def offset_headers(session: UploadSession) -> dict:
+    return {
+        "Upload-Offset": str(session.offset),
+        "Upload-Length": str(session.size),
+        "Cache-Control": "no-store"
+    }
+
+
+def get_active_session(db: Session, upload_id: str, for_update: bool = False) -> UploadSession:
+    """Сессия, в которую еще можно писать; истекшая помечается и удаляется здесь же"""
+    query = db.query(UploadSession).filter(UploadSession.id == upload_id)
+    if for_update:
+        query = query.with_for_update()  # Части одной сессии пишутся строго по очереди
+    session = query.first()
+    if not session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+    if session.status == "active" and _utc(session.expires_at) < datetime.now(timezone.utc):
+        session.status = "expired"
+        db.commit()
+        _remove_part(session.id)
+    if session.status != "active":
+        raise HTTPException(status_code=status.HTTP_410_GONE, detail=f"Upload is {session.status}")
+    return session
+
+
+def expire_upload_sessions() -> int:
+    """
+    Удаляет брошенные сессии: истекшие помечаются expired, их части удаляются.
+    Также удаляет файлы .part без активной сессии и без ожидающей их задачи.
+    Возвращает число истекших сессий.
+    """
+    db = SessionLocal()
+    try:
+        now = datetime.now(timezone.utc)
+        expired = db.query(UploadSession).filter(
+            UploadSession.status == "active",
+            UploadSession.expires_at < now
+        ).all()
+        for session in expired:
+            session.status = "expired"
+        db.commit()
+        for session in expired:
+            _remove_part(session.id)
+
+        keep = {
+            upload_id for (upload_id,) in db.query(UploadSession.id).filter(UploadSession.status == "active")
+        }
+        keep.update(
+            upload_id for (upload_id,) in db.query(UploadSession.id)
+            .join(IngestJob, IngestJob.id == UploadSession.job_id)
+            .filter(IngestJob.status.in_(ACTIVE_STATUSES))
+        )
+    finally:
+        db.close()
+
+    if os.path.isdir(RESUMABLE_DIR):
+        for entry in os.scandir(RESUMABLE_DIR):
+            if entry.name.endswith(CHUNK_SUFFIX):
+                # Часть запроса, прерванного вместе с процессом
+                if entry.stat().st_mtime < time.time() - 3600:
+                    os.remove(entry.path)
+                continue
+            upload_id = entry.name.split(".", 1)[0]
+            if upload_id in keep:
+                continue
+            # Файл моложе TTL может принадлежать сессии, созданной прямо сейчас
+            if entry.stat().st_mtime < time.time() - UPLOAD_SESSION_TTL_SECONDS:
+                _remove_part(upload_id)
+    return len(expired)
+
+
+@router.post("", status_code=status.HTTP_201_CREATED)
+def create_upload(
+    payload: UploadSessionCreate,
+    response: Response,
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Создает сессию загрузки ZIP-пакета со слайдами (slide1.jpg, slide2.jpg, ...).
+    Части отправляются PATCH /admin/uploads/{upload_id}
+    """
+    if not payload.filename.lower().endswith(".zip"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                          detail="Пакет должен быть ZIP-архивом со слайдами")
+    if payload.size <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Пустой пакет")
+    if payload.size > UPLOAD_MAX_PACKAGE_BYTES:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                          detail=f"Пакет больше {UPLOAD_MAX_PACKAGE_BYTES} байт")
+    sha256 = payload.sha256.lower() if payload.sha256 else None
+    if sha256 and not SHA256_HEX_RE.match(sha256):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="sha256 должен быть hex-строкой из 64 символов")
+
+    # Заодно убираем брошенные загрузки
+    expire_upload_sessions()
+
+    session = UploadSession(
+        id=uuid.uuid4().hex,
+        filename=os.path.basename(payload.filename),
+        title=payload.presentation_title,
+        size=payload.size,
+        offset=0,
+        sha256=sha256,
+        status="active",
+        created_by=admin.id,
+        updated_at=func.now(),
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+    )
+    os.makedirs(RESUMABLE_DIR, exist_ok=True)
+    open(part_path(session.id), "wb").close()
+    db.add(session)
+    db.commit()
+
+    response.headers["Location"] = f"{router.prefix}/{session.id}"
+    response.headers.update(offset_headers(session))
+    return {"status": "success", "upload": session_to_dict(session)}
+
+
+@router.head("/{upload_id}")
+def get_upload_offset(
+    upload_id: str,
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """Смещение, с которого продолжать загрузку (заголовок Upload-Offset)"""
+    session = get_active_session(db, upload_id)
+    return Response(status_code=status.HTTP_200_OK, headers=offset_headers(session))
+
+
+@router.get("/{upload_id}")
+def get_upload(
+    upload_id: str,
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """Состояние сессии загрузки (после завершения - и задачи обработки пакета)"""
+    session = db.query(UploadSession).filter(UploadSession.id == upload_id).first()
+    if not session:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found")
+
+    job = db.get(IngestJob, session.job_id) if session.job_id else None
+    return {"status": "success", "upload": session_to_dict(session, job)}
+
+
+def _parse_checksum(value: Optional[str]) -> Optional[bytes]:
+    """Upload-Checksum: sha256 <base64>"""
+    if value is None:
+        return None
+    algorithm, _, encoded = value.strip().partition(" ")
+    if algorithm.lower() != "sha256":
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                          detail="Поддерживается только Upload-Checksum: sha256 <base64>")
+    try:
+        return base64.b64decode(encoded.strip(), validate=True)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Некорректный Upload-Checksum")
+
+
+def _check_offset(db: Session, upload_id: str, upload_offset: int) -> tuple:
+    """Короткая транзакция до приема тела: (смещение совпало, заголовки, размер части)"""
+    try:
+        session = get_active_session(db, upload_id)
+        headers = offset_headers(session)
+        limit = min(UPLOAD_MAX_PATCH_BYTES, session.size - session.offset)
+        return upload_offset == session.offset, headers, limit
+    finally:
+        db.rollback()
+
+
+def _commit_chunk(db: Session, upload_id: str, upload_offset: int, chunk_path: str,
+                  written: int, admin_id: int) -> tuple:
+    """
+    Вторая короткая транзакция: под блокировкой строки сессии проверяет, что смещение
+    не сдвинулось (параллельный PATCH), дописывает часть в .part и сдвигает смещение.
+    Возвращает (принято, заголовки, номер задачи обработки пакета или None).
+    """
+    session = get_active_session(db, upload_id, for_update=True)
+    if session.offset != upload_offset:
+        headers = offset_headers(session)
+        db.rollback()
+        return False, headers, None
+
+    path = part_path(session.id)
+    # Хвост после offset (часть, не подтвержденная commit) перезаписывается
+    with open(path, "r+b" if os.path.exists(path) else "wb") as part, open(chunk_path, "rb") as chunk:
+        part.seek(session.offset)
+        shutil.copyfileobj(chunk, part, 1024 * 1024)
+        part.truncate()
+
+    now = datetime.now(timezone.utc)
+    session.offset += written
+    session.updated_at = func.now()
+    session.expires_at = now + timedelta(seconds=UPLOAD_SESSION_TTL_SECONDS)
+
+    job = None
+    if session.offset == session.size:
+        # ✅ Пакет собран - дальше обычная фоновая загрузка слайдов
+        job = create_job(db, "package", {
+            "path": path,
+            "sha256": session.sha256,
+            "title": session.title,
+            "source_name": session.filename
+        }, admin_id)
+        session.status = "completed"
+        session.job_id = job.id
+    headers = offset_headers(session)
+    job_id = job.id if job is not None else None
+    db.commit()
+    if job_id is not None:
+        enqueue_job(job_id)
+    return True, headers, job_id
+
+
+def _offset_conflict(headers: dict) -> JSONResponse:
+    offset = int(headers["Upload-Offset"])
+    return JSONResponse(
+        status_code=status.HTTP_409_CONFLICT,
+        content={"detail": f"Ожидалось смещение {offset}", "offset": offset},
+        headers=headers
+    )
+
+
+@router.patch("/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset", ge=0),
+    upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum"),
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Дописывает часть пакета с позиции Upload-Offset.
+    Несовпадение смещения - 409 (клиент уточняет его через HEAD),
+    несовпадение Upload-Checksum - 460, часть при этом отбрасывается.
+
+    ✅ Пока принимается тело, транзакция и блокировка строки не удерживаются:
+    смещение проверяется до приема, а дописывается и фиксируется после -
+    только если его не сдвинул параллельный PATCH. Работа с БД - в пуле потоков.
+    """
+    expected_digest = _parse_checksum(upload_checksum)
+    matches, headers, limit = await run_in_threadpool(_check_offset, db, upload_id, upload_offset)
+    if not matches:
+        return _offset_conflict(headers)
+
+    digest = hashlib.sha256()
+    written = 0
+    os.makedirs(RESUMABLE_DIR, exist_ok=True)
+    fd, chunk_path = tempfile.mkstemp(prefix=f"{upload_id}.", suffix=CHUNK_SUFFIX, dir=RESUMABLE_DIR)
+    try:
+        # Тело пишется на диск по мере получения, без буферизации части в памяти
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                written += len(chunk)
+                if written > limit:
+                    raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                                      detail=f"Часть больше {limit} байт")
+                digest.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+        if expected_digest is not None and digest.digest() != expected_digest:
+            raise HTTPException(status_code=HTTP_460_CHECKSUM_MISMATCH,
+                              detail="Контрольная сумма части не совпадает")
+
+        accepted, headers, job_id = await run_in_threadpool(
+            _commit_chunk, db, upload_id, upload_offset, chunk_path, written, admin.id
+        )
+    finally:
+        os.remove(chunk_path)
+    if not accepted:
+        return _offset_conflict(headers)
+
+    return JSONResponse(
+        content={
+            "status": "success",
+            "offset": int(headers["Upload-Offset"]),
+            "complete": job_id is not None,
+            "job_id": job_id
+        },
+        headers=headers
+    )
+
+
+def start_expiry_sweeper(interval: int = UPLOAD_SWEEP_SECONDS) -> None:
+    """Периодическое удаление брошенных сессий (не только при создании новой и старте)"""
+    def sweep() -> None:
+        while True:
+            time.sleep(interval)
+            try:
+                expire_upload_sessions()
+            except Exception as e:
+                print(f"Warning: Could not expire upload sessions: {e}")
+
+    threading.Thread(target=sweep, daemon=True, name="upload-sweeper").start()
+
+
+@router.delete("/{upload_id}")
+def abort_upload(
+    upload_id: str,
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """Отменяет загрузку и удаляет принятые части"""
+    session = get_active_session(db, upload_id, for_update=True)
+    session.status = "aborted"
+    session.updated_at = func.now()
+    db.commit()
+    _remove_part(session.id)
+    return {"status": "success", "message": "Загрузка отменена", "upload_id": upload_id}
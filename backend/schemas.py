@@ -35,6 +35,8 @@ class SlideResponse(BaseModel):
     order: int
     viewed: bool = False
     can_view: bool = True  # ✅ Поле для проверки доступности слайда
+    content_hash: Optional[str] = None
+    image_url: Optional[str] = None  # ✅ URL изображения с версией по хешу содержимого
 
     class Config:
         from_attributes = True
@@ -45,6 +47,13 @@ class SlidesListResponse(BaseModel):
     slides: list[SlideResponse]
     last_slide_index: int = 0  # ✅ Последняя просмотренная позиция
 
+# Resumable Upload Schemas
+class UploadSessionCreate(BaseModel):
+    filename: str
+    presentation_title: str
+    size: int  # Полный размер пакета в байтах
+    sha256: Optional[str] = None  # ✅ Хеш всего пакета (hex), проверяется после сборки
+
 # Progress Schemas
 class ProgressResponse(BaseModel):
     presentation_id: int
@@ -1,30 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Response
 from sqlalchemy.orm import Session
 from database import get_db
-from models import User, Slide, UserSlideProgress, UserCompletion, Presentation, UserPresentationPosition
+from models import Slide, UserCompletion, Presentation
 from schemas import ProgressResponse, SlidesListResponse, SlideResponse
-from utils.security import decode_access_token
+from progress import (
+    load_deck, load_viewed_flags, compute_gating, count_slides, slide_index,
+    get_position, lock_position, get_watermark, advance_position, record_view, progress_version
+)
+from counters import lock_user, on_completion_added
+from dependencies import Principal, get_current_user
+from files import slide_image_url
+from utils.http_cache import make_etag, etag_matches
 
 router = APIRouter(prefix="/slides", tags=["slides"])
 
-def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
-    
-    token = authorization.split(" ")[1]
-    payload = decode_access_token(token)
-    if not payload or "sub" not in payload:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    
-    user_id = int(payload["sub"])
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    
-    return user
+# Клиент обязан перепроверять ответ, но может получить 304 по ETag
+REVALIDATE_HEADERS = {"Cache-Control": "private, no-cache"}
 
 @router.get("/list", response_model=SlidesListResponse)
-def list_slides(presentation_id: int = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def list_slides(
+    response: Response,
+    presentation_id: int = None,
+    if_none_match: Optional[str] = Header(None),
+    user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     # Если presentation_id не указан, берём первую опубликованную
     if presentation_id:
         presentation = db.query(Presentation).filter(
@@ -38,53 +39,39 @@ def list_slides(presentation_id: int = None, user: User = Depends(get_current_us
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No published presentations found")
     
     presentation_id = presentation.id
-    slides = db.query(Slide).filter(Slide.presentation_id == presentation_id).order_by(Slide.order).all()
+    
+    # ✅ Получаем последнюю позицию пользователя
+    position = get_position(db, user.id, presentation_id)
+    
+    # ✅ Неизменившийся список - 304 без загрузки колоды и просмотров
+    etag = make_etag("list", progress_version(presentation, position))
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, **REVALIDATE_HEADERS})
+    response.headers.update({"ETag": etag, **REVALIDATE_HEADERS})
+    
+    slides = load_deck(db, presentation_id)
     
     if not slides:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No slides found")
     
-    # ✅ Получаем последнюю позицию пользователя
-    position = db.query(UserPresentationPosition).filter(
-        UserPresentationPosition.user_id == user.id,
-        UserPresentationPosition.presentation_id == presentation_id
-    ).first()
-    
     last_slide_index = position.last_slide_index if position else 0
     
-    # Получаем статус просмотра для каждого слайда
-    slide_responses = []
-    for idx, slide in enumerate(slides):
-        progress = db.query(UserSlideProgress).filter(
-            UserSlideProgress.user_id == user.id,
-            UserSlideProgress.slide_id == slide.id
-        ).first()
-        
-        # ✅ Проверяем, разрешено ли просмотреть этот слайд
-        # Слайд доступен если:
-        # 1. Это первый слайд
-        # 2. Все предыдущие слайды просмотрены
-        can_view = idx == 0  # Первый слайд всегда доступен
-        
-        if not can_view and idx > 0:
-            # Проверяем просмотрены ли все предыдущие слайды
-            previous_slides = [s for s in slides[:idx]]
-            can_view = all(
-                db.query(UserSlideProgress).filter(
-                    UserSlideProgress.user_id == user.id,
-                    UserSlideProgress.slide_id == prev_slide.id,
-                    UserSlideProgress.viewed == True
-                ).first() is not None
-                for prev_slide in previous_slides
-            )
-        
-        slide_responses.append(SlideResponse(
+    # ✅ Просмотренные слайды одним запросом, доступность - проходом по префиксу
+    viewed_flags = load_viewed_flags(db, user.id, presentation_id, slides, position)
+    
+    slide_responses = [
+        SlideResponse(
             id=slide.id,
             presentation_id=slide.presentation_id,
             filename=slide.filename,
             order=slide.order,
-            viewed=progress.viewed if progress else False,
-            can_view=can_view  # ✅ Добавляем информацию о доступности
-        ))
+            viewed=viewed,
+            can_view=can_view,  # ✅ Добавляем информацию о доступности
+            content_hash=slide.content_hash,
+            image_url=slide_image_url(slide.presentation_id, slide.filename, slide.content_hash)
+        )
+        for slide, viewed, can_view in compute_gating(slides, viewed_flags)
+    ]
     
     return SlidesListResponse(
         presentation_id=presentation_id,
@@ -94,73 +81,35 @@ def list_slides(presentation_id: int = None, user: User = Depends(get_current_us
     )
 
 @router.post("/mark/{slide_id}")
-def mark_slide_viewed(slide_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def mark_slide_viewed(slide_id: int, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Проверяем существование слайда
     slide = db.query(Slide).filter(Slide.id == slide_id).first()
     if not slide:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Slide not found")
     
-    # ✅ Проверяем последовательность просмотра
-    # Получаем все слайды этой презентации в порядке
-    all_slides = db.query(Slide).filter(
-        Slide.presentation_id == slide.presentation_id
-    ).order_by(Slide.order).all()
-    
-    # Находим индекс текущего слайда
-    current_index = next((idx for idx, s in enumerate(all_slides) if s.id == slide_id), None)
-    
-    if current_index is None:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid slide")
-    
-    # Проверяем просмотрены ли все предыдущие слайды
-    if current_index > 0:
-        for prev_slide in all_slides[:current_index]:
-            prev_progress = db.query(UserSlideProgress).filter(
-                UserSlideProgress.user_id == user.id,
-                UserSlideProgress.slide_id == prev_slide.id,
-                UserSlideProgress.viewed == True
-            ).first()
-            
-            if not prev_progress:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"You must view slides in order. Please review slide {prev_slide.order + 1} first."
-                )
-    
-    # Обновляем или создаём запись о просмотре
-    progress = db.query(UserSlideProgress).filter(
-        UserSlideProgress.user_id == user.id,
-        UserSlideProgress.slide_id == slide_id
-    ).first()
+    # ✅ Проверяем последовательность просмотра по водяному знаку позиции
+    current_index = slide_index(db, slide)
+    position = lock_position(db, user.id, slide.presentation_id)
+    watermark = get_watermark(db, position, user.id, slide.presentation_id)
     
-    if progress:
-        progress.viewed = True
-    else:
-        progress = UserSlideProgress(user_id=user.id, slide_id=slide_id, viewed=True)
-        db.add(progress)
+    if current_index > watermark:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail=f"You must view slides in order. Please review slide {watermark + 1} first."
+        )
     
-    # ✅ Обновляем последнюю позицию
-    position = db.query(UserPresentationPosition).filter(
-        UserPresentationPosition.user_id == user.id,
-        UserPresentationPosition.presentation_id == slide.presentation_id
-    ).first()
+    # ✅ Обновляем последнюю позицию и водяной знак в той же транзакции
+    position = advance_position(db, position, user.id, slide.presentation_id, current_index, watermark)
     
-    if position:
-        position.last_slide_index = current_index
-    else:
-        position = UserPresentationPosition(
-            user_id=user.id,
-            presentation_id=slide.presentation_id,
-            last_slide_index=current_index
-        )
-        db.add(position)
+    # Отмечаем просмотр (строка UserSlideProgress или бит маски)
+    record_view(db, user.id, slide_id, current_index, position)
     
     db.commit()
     return {"status": "success", "message": "Slide marked as viewed"}
 
 
 @router.post("/complete")
-def complete_presentation(presentation_id: int = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def complete_presentation(presentation_id: int = None, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     # Если presentation_id не указан, берём первую опубликованную
     if presentation_id:
         presentation = db.query(Presentation).filter(
@@ -174,23 +123,17 @@ def complete_presentation(presentation_id: int = None, user: User = Depends(get_
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No published presentations found")
     
     presentation_id = presentation.id
-    all_slides = db.query(Slide).filter(Slide.presentation_id == presentation_id).all()
+    total_count = count_slides(db, presentation_id)
     
-    if not all_slides:
+    if not total_count:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No slides found")
     
-    # Проверяем просмотрены ли все слайды
-    viewed_slides = db.query(UserSlideProgress).filter(
-        UserSlideProgress.user_id == user.id,
-        UserSlideProgress.viewed == True
-    ).with_entities(UserSlideProgress.slide_id).all()
+    # Проверяем просмотрены ли все слайды (по водяному знаку)
+    position = get_position(db, user.id, presentation_id)
+    watermark = get_watermark(db, position, user.id, presentation_id)
     
-    viewed_ids = {v[0] for v in viewed_slides}
-    all_ids = {s.id for s in all_slides}
-    
-    missing = list(all_ids - viewed_ids)
-    
-    if missing:
+    if watermark < total_count:
+        missing = [s.id for s in load_deck(db, presentation_id)[watermark:]]
         return {
             "status": "error",
             "message": f"Not all slides viewed",
@@ -198,6 +141,8 @@ def complete_presentation(presentation_id: int = None, user: User = Depends(get_
         }
     
     # Проверяем не завершена ли уже презентация
+    # (под блокировкой пользователя: повторный запрос не добавит второе завершение)
+    lock_user(db, user.id)
     existing = db.query(UserCompletion).filter(
         UserCompletion.user_id == user.id,
         UserCompletion.presentation_id == presentation_id
@@ -209,12 +154,19 @@ def complete_presentation(presentation_id: int = None, user: User = Depends(get_
             presentation_id=presentation_id
         )
         db.add(completion)
+        on_completion_added(db, user, presentation_id)
         db.commit()
     
     return {"status": "success", "message": "Presentation completed"}
 
 @router.get("/progress", response_model=ProgressResponse)
-def get_progress(presentation_id: int = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_progress(
+    response: Response,
+    presentation_id: int = None,
+    if_none_match: Optional[str] = Header(None),
+    user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     # Если presentation_id не указан, берём первую опубликованную
     if presentation_id:
         presentation = db.query(Presentation).filter(
@@ -228,14 +180,16 @@ def get_progress(presentation_id: int = None, user: User = Depends(get_current_u
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No published presentations found")
     
     presentation_id = presentation.id
-    all_slides = db.query(Slide).filter(Slide.presentation_id == presentation_id).all()
+    position = get_position(db, user.id, presentation_id)
+    
+    etag = make_etag("progress", progress_version(presentation, position))
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag, **REVALIDATE_HEADERS})
+    response.headers.update({"ETag": etag, **REVALIDATE_HEADERS})
     
-    viewed_count = db.query(UserSlideProgress).filter(
-        UserSlideProgress.user_id == user.id,
-        UserSlideProgress.viewed == True
-    ).count()
+    total_count = count_slides(db, presentation_id)
+    viewed_count = get_watermark(db, position, user.id, presentation_id)
     
-    total_count = len(all_slides)
     percentage = (viewed_count / total_count * 100) if total_count > 0 else 0
     
     return ProgressResponse(
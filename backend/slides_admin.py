@@ -1,41 +1,65 @@
 """
 API для управления слайдами (загрузка из папки, редактирование, публикация)
 """
-from fastapi import APIRouter, Depends, HTTPException, status, Header, UploadFile, File, Form, Query
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 import os
 from pathlib import Path
 import shutil
 from typing import List
 import re
+import json
 
 from database import get_db
-from models import Presentation, Slide, User
-from utils.security import decode_access_token
+from models import Presentation, Slide, PresentationStats, IngestJob
+from progress import delete_presentation_progress
+from files import slide_image_url, invalidate_presentation_images
+from utils.folder_import import scan_slide_folder
+from utils.uploads import UPLOAD_MAX_FILE_BYTES, UploadBudget, UploadTooLarge, save_upload, store_images
+from jobs import create_job, enqueue_job, submit_job, staging_dir, job_to_dict
+from ingest import DOCUMENT_EXTENSIONS, PPTX_SOURCE_NAME
+from dependencies import Principal, get_current_admin as verify_admin
 
 router = APIRouter(prefix="/admin", tags=["admin-slides"])
 
 UPLOADS_DIR = "/tmp/slideconfirm_uploads"
 
-def verify_admin(authorization: str = Header(None), db: Session = Depends(get_db)):
-    """Проверяет, что пользователь - администратор"""
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    
-    token = authorization.replace("Bearer ", "")
-    payload = decode_access_token(token)
-    
-    user = db.query(User).filter(User.id == int(payload["sub"])).first()
-    if not user or user.role != "admin":
-        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not admin")
-    
-    return user
+def touch_presentation(db: Session, presentation_id: int):
+    """Отмечает изменение слайдов презентации (сбрасывает ETag клиентов)"""
+    db.query(Presentation).filter(Presentation.id == presentation_id).update(
+        {Presentation.updated_at: func.now()}, synchronize_session=False
+    )
+
+
+def upload_failed_response(errors: list) -> JSONResponse:
+    """Ответ со списком ошибок по файлам; detail - строка для старого frontend"""
+    status_code = 413 if any(error["status"] == 413 for error in errors) else 400
+    summary = "; ".join(f"{error['file']}: {error['error']}" for error in errors[:5])
+    if len(errors) > 5:
+        summary += f" (и еще {len(errors) - 5})"
+    return JSONResponse(status_code=status_code, content={
+        "detail": f"Ошибки в {len(errors)} файлах: {summary}",
+        "errors": errors
+    })
+
+
+def job_accepted_response(job: IngestJob) -> dict:
+    """Ответ 202 на запуск загрузки"""
+    return {
+        "status": "accepted",
+        "job_id": job.id,
+        "job": job_to_dict(job),
+        "message": f"Загрузка поставлена в очередь (задача {job.id})"
+    }
 
 
 @router.post("/slides/check-folder")
 def check_folder_for_slides(
     folder_path: str,
-    admin: User = Depends(verify_admin),
+    admin: Principal = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
     """
@@ -46,21 +70,16 @@ def check_folder_for_slides(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
                           detail=f"Папка не найдена: {folder_path}")
     
-    # Ищем файлы slide*.jpg
-    slide_files = []
-    for i in range(1, 1000):  # Максимум 999 слайдов
-        filename = f"slide{i}.jpg"
-        filepath = os.path.join(folder_path, filename)
-        
-        if os.path.exists(filepath):
-            size = os.path.getsize(filepath)
-            slide_files.append({
-                "order": i,
-                "filename": filename,
-                "size": size
-            })
-        elif i > 1 and not os.path.exists(os.path.join(folder_path, f"slide{i-1}.jpg")):
-            break
+    # ✅ Индекс slide*.jpg одним проходом по папке
+    slide_files = [
+        {
+            "order": slide.order,
+            "filename": slide.filename,
+            "size": slide.size,
+            "mtime": slide.mtime
+        }
+        for slide in scan_slide_folder(folder_path)
+    ]
     
     if not slide_files:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
@@ -74,116 +93,71 @@ def check_folder_for_slides(
     }
 
 
-@router.post("/slides/upload-from-folder")
+@router.post("/slides/upload-from-folder", status_code=status.HTTP_202_ACCEPTED)
 def upload_slides_from_folder(
     folder_path: str,
     presentation_title: str,
-    admin: User = Depends(verify_admin),
+    admin: Principal = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
     """
-    Загружает слайды из папки (slide1.jpg, slide2.jpg, ...)
+    Загружает слайды из папки (slide1.jpg, slide2.jpg, ...) фоновой задачей.
+    Возвращает номер задачи, прогресс - GET /admin/jobs/{job_id}
     """
     # Проверяем, что папка существует
     if not os.path.isdir(folder_path):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
                           detail=f"Папка не найдена: {folder_path}")
     
-    # Ищем файлы slide*.jpg
-    slide_files = []
-    for i in range(1, 1000):  # Максимум 999 слайдов
-        filename = f"slide{i}.jpg"
-        filepath = os.path.join(folder_path, filename)
-        
-        if os.path.exists(filepath):
-            slide_files.append((i, filename, filepath))
-        elif i > 1 and not os.path.exists(os.path.join(folder_path, f"slide{i-1}.jpg")):
-            # Если нет слайда i-1, значит слайдов больше нет
-            break
-    
-    if not slide_files:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                          detail="В папке не найдены файлы slide*.jpg")
-    
-    # Создаем презентацию
-    presentation = Presentation(
-        title=presentation_title,
-        filename=os.path.basename(folder_path),
-        status="draft"
-    )
-    db.add(presentation)
-    db.flush()  # Получаем ID без коммита
-    
-    # Создаем директорию для хранения
-    dest_dir = os.path.join(UPLOADS_DIR, "slides", str(presentation.id))
-    os.makedirs(dest_dir, exist_ok=True)
-    
-    # Копируем слайды и создаем записи в БД
-    created_slides = []
-    for order, filename, filepath in slide_files:
-        # Копируем файл
-        dest_path = os.path.join(dest_dir, filename)
-        shutil.copy2(filepath, dest_path)
-        
-        # Создаем запись в БД
-        slide = Slide(
-            presentation_id=presentation.id,
-            filename=filename,
-            order=order,
-            title=f"Слайд {order}"  # Название по умолчанию
-        )
-        db.add(slide)
-        created_slides.append(slide)
-    
-    db.commit()
-    db.refresh(presentation)
-    
-    return {
-        "status": "success",
-        "presentation": {
-            "id": presentation.id,
-            "title": presentation.title,
-            "status": presentation.status,
-            "slides_count": len(created_slides)
-        },
-        "slides_count": len(created_slides),
-        "message": f"Загружено {len(created_slides)} слайдов"
-    }
+    job = submit_job(db, "folder", {"folder_path": folder_path, "title": presentation_title}, admin.id)
+    return job_accepted_response(job)
 
 
-@router.post("/slides/upload-from-files")
+@router.post("/slides/upload-from-files", status_code=status.HTTP_202_ACCEPTED)
 async def upload_slides_from_files(
     presentation_title: str = Form(...),
     slides: List[UploadFile] = File(...),
-    admin: User = Depends(verify_admin),
+    admin: Principal = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
     """
     Загружает слайды из файлов (загруженных через браузер)
     Файлы должны быть названы: slide1.jpg, slide2.jpg, и т.д.
     (Frontend переименовывает файлы в нужный формат)
+    
+    Запрос только сохраняет файлы во временный каталог задачи;
+    проверка JPEG и создание презентации выполняются фоновой задачей.
     """
     if not slides or len(slides) == 0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                           detail="Не загружены файлы")
     
-    # Проверяем, что все файлы - это JPG
+    # Проверяем имена и заявленные размеры всех файлов, ошибки собираем по каждому
+    errors = []
     slide_mapping = {}
     for file in slides:
         # Проверяем расширение файла
         if not file.filename.lower().endswith(('.jpg', '.jpeg')):
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                              detail=f"Файл {file.filename} не является JPG")
+            errors.append({"file": file.filename, "error": "файл не является JPG", "status": 400})
+            continue
         
         # Извлекаем номер слайда из имени файла (уже переименовано на frontend'е в slide1.jpg, slide2.jpg)
         match = re.match(r'^slide(\d+)\.(jpg|jpeg)$', file.filename.lower())
         if not match:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                              detail=f"Имя файла {file.filename} должно быть в формате: slide1.jpg, slide2.jpg и т.д.")
+            errors.append({"file": file.filename, "status": 400,
+                           "error": "имя должно быть в формате: slide1.jpg, slide2.jpg и т.д."})
+            continue
+        
+        if file.size is not None and file.size > UPLOAD_MAX_FILE_BYTES:
+            errors.append({"file": file.filename, "error": f"больше {UPLOAD_MAX_FILE_BYTES} байт", "status": 413})
+            continue
         
         slide_num = int(match.group(1))
         slide_mapping[slide_num] = file
     
+    if errors:
+        return upload_failed_response(errors)
+    
     if not slide_mapping:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                           detail="Не найдены файлы слайдов")
@@ -195,61 +169,166 @@ async def upload_slides_from_files(
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                               detail=f"Слайды должны быть названы по порядку: slide1.jpg, slide2.jpg, и т.д. (нарушен номер: {slide_num})")
     
-    # Создаем презентацию
-    presentation = Presentation(
-        title=presentation_title,
-        filename="upload",
-        status="draft"
-    )
-    db.add(presentation)
-    db.flush()  # Получаем ID без коммита
-    
-    # Создаем директорию для хранения
-    dest_dir = os.path.join(UPLOADS_DIR, "slides", str(presentation.id))
-    os.makedirs(dest_dir, exist_ok=True)
-    
-    # Сохраняем файлы и создаем записи в БД
-    created_slides = []
-    for order in sorted_slides:
-        file = slide_mapping[order]
-        filename = f"slide{order}.jpg"
-        dest_path = os.path.join(dest_dir, filename)
-        
-        # Сохраняем файл
-        content = await file.read()
-        with open(dest_path, 'wb') as f:
-            f.write(content)
-        
-        # Создаем запись в БД
-        slide = Slide(
-            presentation_id=presentation.id,
-            filename=filename,
-            order=order,
-            title=f"Слайд {order}"  # Название по умолчанию
-        )
-        db.add(slide)
-        created_slides.append(slide)
+    # Быстрая проверка по суммарному размеру, известному после разбора multipart
+    budget = UploadBudget()
+    if sum(file.size or 0 for file in slide_mapping.values()) > budget.max_bytes:
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                          detail=f"Суммарный размер файлов больше {budget.max_bytes} байт")
+    
+    # Задача создается до записи файлов: ее номер - имя временного каталога
+    job = create_job(db, "files", {}, admin.id)
+    staging = staging_dir(job.id)
+    os.makedirs(staging, exist_ok=True)
+    
+    # ✅ Потоковая запись параллельно в пуле потоков
+    jobs = [
+        (order, slide_mapping[order].file, os.path.join(staging, f"slide{order}.jpg"), slide_mapping[order].filename)
+        for order in sorted_slides
+    ]
+    try:
+        stored, errors = await store_images(jobs, budget, validate=False)
+    except BaseException:
+        db.rollback()
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    
+    if errors:
+        db.rollback()
+        shutil.rmtree(staging, ignore_errors=True)
+        return upload_failed_response(errors)
+    
+    job.params = json.dumps({
+        "title": presentation_title,
+        "files": [
+            {
+                "order": order,
+                "filename": f"slide{order}.jpg",
+                "source_name": slide_mapping[order].filename,
+                "content_hash": stored[order]["content_hash"]
+            }
+            for order in sorted_slides
+        ]
+    })
+    job.progress_total = len(sorted_slides)
+    db.commit()
+    enqueue_job(job.id)
+    
+    return job_accepted_response(job)
+
+
+async def save_job_source(db: Session, job: IngestJob, file: UploadFile, name: str) -> None:
+    """Сохраняет исходный файл в staging задачи (вне event loop); при ошибке задача отменяется"""
+    staging = staging_dir(job.id)
+    os.makedirs(staging, exist_ok=True)
+    budget = UploadBudget()
+    try:
+        await run_in_threadpool(save_upload, file.file, os.path.join(staging, name),
+                                file.filename, budget, budget.max_bytes)
+    except UploadTooLarge as e:
+        db.rollback()
+        shutil.rmtree(staging, ignore_errors=True)
+        raise HTTPException(status_code=status.HTTP_413_CONTENT_TOO_LARGE,
+                          detail=f"Файл больше {e.limit} байт")
+    except BaseException:
+        db.rollback()
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+@router.post("/slides/upload-document", status_code=status.HTTP_202_ACCEPTED)
+async def upload_document(
+    presentation_title: str = Form(...),
+    file: UploadFile = File(...),
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Загружает презентацию PPTX или PDF: конвертация в слайды идет фоновой задачей.
+    Возвращает номер задачи, прогресс конвертации - GET /admin/jobs/{job_id}.
+    Презентация из PDF появляется сразу (status=processing, presentation_id в задаче),
+    ее слайды - по мере растеризации страниц
+    """
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    if extension not in DOCUMENT_EXTENSIONS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                          detail="Файл должен быть в формате PPTX или PDF")
+    
+    source_name = f"source{extension}"
+    job = create_job(db, "document", {
+        "title": presentation_title, "source_name": file.filename, "filename": source_name
+    }, admin.id)
+    await save_job_source(db, job, file, source_name)
     
     db.commit()
-    db.refresh(presentation)
+    enqueue_job(job.id)
     
-    return {
-        "status": "success",
-        "presentation": {
-            "id": presentation.id,
-            "title": presentation.title,
-            "status": presentation.status,
-            "slides_count": len(created_slides)
-        },
-        "slides_count": len(created_slides),
-        "message": f"Загружено {len(created_slides)} слайдов"
-    }
+    return job_accepted_response(job)
+
+
+@router.post("/presentations/{presentation_id}/reupload", status_code=status.HTTP_202_ACCEPTED)
+async def reupload_presentation(
+    presentation_id: int,
+    file: UploadFile = File(...),
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """
+    Повторная загрузка исправленного PPTX фоновой задачей.
+    Перерисовываются только измененные слайды; ID и просмотры пользователей
+    у неизмененных слайдов сохраняются
+    """
+    presentation = db.query(Presentation).filter(Presentation.id == presentation_id).first()
+    if not presentation:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Presentation not found")
+    
+    if presentation.status == "processing":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                          detail="Презентация еще загружается")
+    
+    if not file.filename.lower().endswith(".pptx"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                          detail="Файл должен быть в формате PPTX")
+    
+    job = create_job(db, "pptx_update", {"presentation_id": presentation_id, "source_name": file.filename}, admin.id)
+    await save_job_source(db, job, file, PPTX_SOURCE_NAME)
+    
+    job.presentation_id = presentation_id
+    db.commit()
+    enqueue_job(job.id)
+    
+    return job_accepted_response(job)
+
+
+@router.get("/jobs")
+def list_jobs(
+    limit: int = Query(20, ge=1, le=100),
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """Последние задачи загрузки"""
+    jobs = db.query(IngestJob).order_by(IngestJob.id.desc()).limit(limit).all()
+    return {"status": "success", "data": [job_to_dict(job) for job in jobs]}
+
+
+@router.get("/jobs/{job_id}")
+def get_job(
+    job_id: int,
+    admin: Principal = Depends(verify_admin),
+    db: Session = Depends(get_db)
+):
+    """Состояние и прогресс задачи загрузки"""
+    job = db.query(IngestJob).filter(IngestJob.id == job_id).first()
+    
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    
+    return {"status": "success", "job": job_to_dict(job)}
 
 
 @router.get("/slides/{presentation_id}")
 def get_presentation_slides(
     presentation_id: int,
-    admin: User = Depends(verify_admin),
+    admin: Principal = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
     """Получает все слайды презентации"""
@@ -276,7 +355,8 @@ def get_presentation_slides(
                 "id": slide.id,
                 "filename": slide.filename,
                 "title": slide.title,
-                "order": slide.order
+                "order": slide.order,
+                "image_url": slide_image_url(presentation_id, slide.filename, slide.content_hash)
             }
             for slide in slides
         ]
@@ -287,7 +367,7 @@ def get_presentation_slides(
 def update_slide_title(
     slide_id: int,
     title: str,
-    admin: User = Depends(verify_admin),
+    admin: Principal = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
     """Обновляет название слайда"""
@@ -297,6 +377,7 @@ def update_slide_title(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Slide not found")
     
     slide.title = title
+    touch_presentation(db, slide.presentation_id)
     db.commit()
     db.refresh(slide)
     
@@ -313,7 +394,7 @@ def update_slide_title(
 @router.post("/presentations/{presentation_id}/publish")
 def publish_presentation(
     presentation_id: int,
-    admin: User = Depends(verify_admin),
+    admin: Principal = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
     """Опубликовывает презентацию"""
@@ -324,13 +405,16 @@ def publish_presentation(
     if not presentation:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Presentation not found")
     
+    if presentation.status == "processing":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                          detail="Презентация еще загружается")
+    
     if presentation.status == "published":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
                           detail="Presentation already published")
     
     presentation.status = "published"
-    from datetime import datetime
-    presentation.published_at = datetime.utcnow()
+    presentation.published_at = func.now()
     
     db.commit()
     db.refresh(presentation)
@@ -353,7 +437,7 @@ def publish_presentation(
 @router.post("/presentations/{presentation_id}/unpublish")
 def unpublish_presentation(
     presentation_id: int,
-    admin: User = Depends(verify_admin),
+    admin: Principal = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
     """Отменяет публикацию презентации"""
@@ -364,6 +448,10 @@ def unpublish_presentation(
     if not presentation:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Presentation not found")
     
+    if presentation.status == "processing":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                          detail="Презентация еще загружается")
+    
     if presentation.status == "draft":
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
                           detail="Presentation is already draft")
@@ -387,7 +475,7 @@ def unpublish_presentation(
 def delete_presentation(
     presentation_id: int,
     confirm: bool = False,  # Требуется подтверждение
-    admin: User = Depends(verify_admin),
+    admin: Principal = Depends(verify_admin),
     db: Session = Depends(get_db)
 ):
     """Удаляет презентацию со всеми слайдами"""
@@ -415,6 +503,11 @@ def delete_presentation(
     slides_dir = os.path.join(UPLOADS_DIR, "slides", str(presentation_id))
     if os.path.exists(slides_dir):
         shutil.rmtree(slides_dir)
+    invalidate_presentation_images(presentation_id)
+    
+    # Удаляем позиции и маски прогресса пользователей, счетчик завершений
+    delete_presentation_progress(db, presentation_id)
+    db.query(PresentationStats).filter(PresentationStats.presentation_id == presentation_id).delete()
     
     # Удаляем слайды и презентацию из БД (cascade сделает это автоматически)
     for slide in slides:
@@ -1,60 +1,132 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Query, Response
+from sqlalchemy import and_, distinct, func, not_
 from sqlalchemy.orm import Session
 from database import get_db
-from models import User, Slide, UserSlideProgress, UserCompletion, Presentation
-from utils.security import decode_access_token
+from models import Slide, UserSlideProgress, UserCompletion, Presentation, UserPresentationPosition
+from progress import use_bitmap, count_bits, reset_progress
+from counters import on_completion_removed
+from dependencies import Principal, get_current_user
+from utils.http_cache import make_etag, etag_matches
 
 router = APIRouter(prefix="/user", tags=["user"])
 
-def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)):
-    if not authorization or not authorization.startswith("Bearer "):
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Missing token")
-    
-    token = authorization.split(" ")[1]
-    payload = decode_access_token(token)
-    if not payload or "sub" not in payload:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
-    
-    user_id = int(payload["sub"])
-    user = db.query(User).filter(User.id == user_id).first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
+PRESENTATION_STATUSES = ("completed", "in_progress", "not_started")
+
+
+def presentations_version(db: Session, user_id: int) -> tuple:
+    """
+    Версия списка презентаций пользователя одним запросом:
+    опубликованные презентации, позиции и завершения пользователя
+    """
+    published = Presentation.status == "published"
+    own_position = UserPresentationPosition.user_id == user_id
+    own_completion = UserCompletion.user_id == user_id
     
-    return user
+    row = db.query(
+        db.query(func.count(Presentation.id)).filter(published).scalar_subquery(),
+        db.query(func.max(Presentation.id)).filter(published).scalar_subquery(),
+        db.query(func.max(Presentation.updated_at)).filter(published).scalar_subquery(),
+        db.query(func.max(UserPresentationPosition.last_viewed_at)).filter(own_position).scalar_subquery(),
+        db.query(func.sum(UserPresentationPosition.contiguous_viewed)).filter(own_position).scalar_subquery(),
+        db.query(func.count(UserCompletion.id)).filter(own_completion).scalar_subquery(),
+        db.query(func.max(UserCompletion.completed_at)).filter(own_completion).scalar_subquery()
+    ).one()
+    return tuple(str(value) for value in row)
+
 
 @router.get("/presentations")
-def get_user_presentations(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def get_user_presentations(
+    response: Response,
+    status_filter: Optional[str] = Query(None, alias="status"),
+    after_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    if_none_match: Optional[str] = Header(None),
+    user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
     """
-    Получить список всех опубликованных презентаций с прогрессом пользователя
+    Получить список всех опубликованных презентаций с прогрессом пользователя.
+    Один GROUP BY запрос: количество слайдов, просмотров и флаг завершения.
+    Пагинация по ключу: after_id = next_cursor предыдущей страницы.
     """
-    # Получаем все опубликованные презентации
-    presentations = db.query(Presentation).filter(Presentation.status == "published").all()
+    if status_filter and status_filter not in PRESENTATION_STATUSES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid status")
     
-    if not presentations:
-        return {"data": []}
+    # ✅ Ничего не изменилось - 304 без агрегирующего запроса
+    etag = make_etag("presentations", status_filter, after_id, limit, presentations_version(db, user.id))
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers)
+    response.headers.update(cache_headers)
     
-    result = []
+    completed_count = func.count(distinct(UserCompletion.id))
     
-    for presentation in presentations:
-        # Получаем количество слайдов в презентации
-        slides = db.query(Slide).filter(Slide.presentation_id == presentation.id).all()
-        total_slides = len(slides)
-        
-        # Получаем количество просмотренных слайдов пользователем
-        viewed_slides_count = db.query(UserSlideProgress).filter(
-            UserSlideProgress.user_id == user.id,
-            UserSlideProgress.slide_id.in_([s.id for s in slides]),
-            UserSlideProgress.viewed == True
-        ).count()
-        
-        # Проверяем статус презентации для пользователя
-        completion = db.query(UserCompletion).filter(
-            UserCompletion.user_id == user.id,
-            UserCompletion.presentation_id == presentation.id
-        ).first()
+    query = db.query(
+        Presentation.id,
+        Presentation.title,
+        func.count(distinct(Slide.id)).label("slides_count"),
+        completed_count.label("completed")
+    ).outerjoin(
+        Slide, Slide.presentation_id == Presentation.id
+    ).outerjoin(
+        UserCompletion, and_(
+            UserCompletion.presentation_id == Presentation.id,
+            UserCompletion.user_id == user.id
+        )
+    )
+    
+    # Просмотры: маска из строки позиции или количество строк UserSlideProgress
+    if use_bitmap():
+        query = query.outerjoin(
+            UserPresentationPosition, and_(
+                UserPresentationPosition.presentation_id == Presentation.id,
+                UserPresentationPosition.user_id == user.id
+            )
+        ).add_columns(UserPresentationPosition.viewed_bits)
+        group_by = (Presentation.id, Presentation.title, UserPresentationPosition.viewed_bits)
+        has_views = UserPresentationPosition.viewed_bits.isnot(None)
+    else:
+        viewed_count = func.count(distinct(UserSlideProgress.slide_id))
+        query = query.outerjoin(
+            UserSlideProgress, and_(
+                UserSlideProgress.slide_id == Slide.id,
+                UserSlideProgress.user_id == user.id,
+                UserSlideProgress.viewed == True
+            )
+        ).add_columns(viewed_count.label("viewed_count"))
+        group_by = (Presentation.id, Presentation.title)
+        has_views = viewed_count > 0
+    
+    query = query.filter(Presentation.status == "published")
+    if after_id is not None:
+        query = query.filter(Presentation.id > after_id)
+    
+    query = query.group_by(*group_by)
+    if status_filter == "completed":
+        query = query.having(completed_count > 0)
+    elif status_filter == "in_progress":
+        query = query.having(and_(completed_count == 0, has_views))
+    elif status_filter == "not_started":
+        query = query.having(and_(completed_count == 0, not_(has_views)))
+    
+    query = query.order_by(Presentation.id)
+    if limit:
+        query = query.limit(limit + 1)
+    rows = query.all()
+    
+    next_cursor = None
+    if limit and len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1].id
+    
+    result = []
+    for row in rows:
+        total_slides = row.slides_count
+        viewed_slides_count = count_bits(row.viewed_bits) if use_bitmap() else row.viewed_count
         
         # Определяем статус
-        if completion:
+        if row.completed:
             status_val = "completed"
         elif viewed_slides_count > 0:
             status_val = "in_progress"
@@ -65,18 +137,18 @@ def get_user_presentations(user: User = Depends(get_current_user), db: Session =
         progress_percentage = (viewed_slides_count / total_slides * 100) if total_slides > 0 else 0
         
         result.append({
-            "id": presentation.id,
-            "title": presentation.title,
+            "id": row.id,
+            "title": row.title,
             "slides_count": total_slides,
             "status": status_val,
             "progress": int(progress_percentage),
             "viewed_slides": viewed_slides_count
         })
     
-    return {"data": result}
+    return {"data": result, "next_cursor": next_cursor}
 
 @router.post("/presentations/{presentation_id}/reset")
-def reset_presentation(presentation_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+def reset_presentation(presentation_id: int, user: Principal = Depends(get_current_user), db: Session = Depends(get_db)):
     """
     Сбросить прогресс пользователя для презентации (удалить все просмотры и завершение)
     """
@@ -85,21 +157,15 @@ def reset_presentation(presentation_id: int, user: User = Depends(get_current_us
     if not presentation:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Presentation not found")
     
-    # Получаем все слайды презентации
-    slides = db.query(Slide).filter(Slide.presentation_id == presentation_id).all()
-    slide_ids = [s.id for s in slides]
-    
-    # Удаляем все записи о просмотрах
-    db.query(UserSlideProgress).filter(
-        UserSlideProgress.user_id == user.id,
-        UserSlideProgress.slide_id.in_(slide_ids)
-    ).delete()
+    # Удаляем все записи о просмотрах, позицию и водяной знак
+    reset_progress(db, user.id, presentation_id)
     
-    # Удаляем запись о завершении
-    db.query(UserCompletion).filter(
+    # Удаляем запись о завершении и обновляем счетчики отчета
+    removed = db.query(UserCompletion).filter(
         UserCompletion.user_id == user.id,
         UserCompletion.presentation_id == presentation_id
     ).delete()
+    on_completion_removed(db, user, presentation_id, removed)
     
     db.commit()
     
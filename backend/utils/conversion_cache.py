@@ -0,0 +1,151 @@
+"""
+Кэш результатов конвертации PPTX -> JPEG на диске.
+
+Ключ - SHA-256 входного файла вместе с настройками рендеринга (рендерер,
+DPI, качество JPEG): переименованный или повторно загруженный файл
+находится в кэше, а изменение настроек дает новый ключ.
+
+Запись: conversion_cache/{key}/slide_001.jpg, ... и manifest.json. Каталог
+собирается во временном и переносится одним rename, поэтому читатель
+никогда не видит неполную запись. mtime каталога обновляется при каждом
+попадании; при превышении CONVERSION_CACHE_MAX_BYTES удаляются записи,
+которые дольше всех не использовались (LRU).
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from utils.folder_import import copy_file_fast
+
+UPLOADS_DIR = "/tmp/slideconfirm_uploads"
+CONVERSION_CACHE_DIR = os.getenv("CONVERSION_CACHE_DIR", os.path.join(UPLOADS_DIR, "conversion_cache"))
+# 0 - кэш отключен
+CONVERSION_CACHE_MAX_BYTES = int(os.getenv("CONVERSION_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+MANIFEST = "manifest.json"
+CACHE_FORMAT_VERSION = 2  # 2: запасной рендерер пропускает скрытые слайды
+
+_evict_lock = threading.Lock()
+
+
+def enabled() -> bool:
+    return CONVERSION_CACHE_MAX_BYTES > 0
+
+
+def cache_key(content_hash: str, renderer: str, dpi: int, quality: int) -> str:
+    """Ключ записи: хеш файла + все, что влияет на результат рендеринга"""
+    settings = f"{content_hash}:{renderer}:{dpi}:{quality}:v{CACHE_FORMAT_VERSION}"
+    return hashlib.sha256(settings.encode()).hexdigest()
+
+
+def _entry_dir(key: str) -> str:
+    return os.path.join(CONVERSION_CACHE_DIR, key)
+
+
+def _read_manifest(entry_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(entry_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def fetch(key: str, output_dir: str) -> Optional[list[str]]:
+    """
+    Копирует (reflink/жесткая ссылка/копия) сохраненные изображения в output_dir.
+    Возвращает пути в порядке слайдов или None, если записи нет.
+    """
+    if not enabled():
+        return None
+    entry_dir = _entry_dir(key)
+    manifest = _read_manifest(entry_dir)
+    if manifest is None:
+        return None
+
+    image_paths = []
+    try:
+        for filename in manifest["files"]:
+            image_path = os.path.join(output_dir, filename)
+            # Файлы кэша меняются только заменой каталога - жесткая ссылка безопасна
+            copy_file_fast(os.path.join(entry_dir, filename), image_path, hardlink=True)
+            image_paths.append(image_path)
+        os.utime(entry_dir)  # Отметка использования для LRU
+    except OSError:
+        # Запись удалили вытеснением прямо во время чтения - конвертируем заново
+        for image_path in image_paths:
+            if os.path.exists(image_path):
+                os.remove(image_path)
+        return None
+    return image_paths
+
+
+def store(key: str, image_paths: list[str]) -> None:
+    """Сохраняет результат конвертации; ошибки кэша не мешают загрузке"""
+    if not enabled() or not image_paths:
+        return
+    entry_dir = _entry_dir(key)
+    if os.path.isdir(entry_dir):
+        return
+
+    try:
+        os.makedirs(CONVERSION_CACHE_DIR, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=CONVERSION_CACHE_DIR)
+    except OSError as e:
+        print(f"Warning: Could not store conversion cache entry: {e}")
+        return
+
+    try:
+        files, size = [], 0
+        for image_path in image_paths:
+            filename = os.path.basename(image_path)
+            copy_file_fast(image_path, os.path.join(tmp_dir, filename), hardlink=True)
+            files.append(filename)
+            size += os.path.getsize(image_path)
+        with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+            json.dump({"files": files, "size": size, "created_at": time.time()}, f)
+        os.rename(tmp_dir, entry_dir)
+    except OSError as e:
+        # Включая гонку: ту же запись уже сохранил другой процесс
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(entry_dir):
+            print(f"Warning: Could not store conversion cache entry: {e}")
+        return
+
+    evict()
+
+
+def evict(max_bytes: int = None) -> int:
+    """Удаляет самые давно использованные записи сверх лимита, возвращает их число"""
+    max_bytes = CONVERSION_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(CONVERSION_CACHE_DIR):
+        return 0
+
+    with _evict_lock:
+        entries, total = [], 0
+        with os.scandir(CONVERSION_CACHE_DIR) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                if entry.name.startswith(".tmp_"):
+                    # Брошенная недописанная запись (процесс упал)
+                    if entry.stat().st_mtime < time.time() - 3600:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+                    continue
+                manifest = _read_manifest(entry.path)
+                size = manifest["size"] if manifest else 0
+                entries.append((entry.stat().st_mtime, size, entry.path))
+                total += size
+
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed += 1
+        return removed
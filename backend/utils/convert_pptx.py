@@ -1,87 +1,266 @@
 import os
-import subprocess
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
-import textwrap
+
+from files import file_sha256
+from utils import conversion_cache
+from utils.libreoffice_pool import find_libreoffice, get_pool
+from utils.pptx_render import default_font, extract_slide_content, render_slides, visible_slides, wrap_text
 
 UPLOADS_DIR = "/tmp/slideconfirm_uploads"
 Path(UPLOADS_DIR).mkdir(parents=True, exist_ok=True)
 
-def convert_pptx_to_images(pptx_path: str, output_dir: str) -> list[str]:
-    """Конвертирует PPTX в изображения JPG"""
-    
-    # Первый приоритет - LibreOffice
+# ✅ Растеризация PDF: качество, параллельность и размер порции страниц
+RENDER_DPI = int(os.getenv("RENDER_DPI", "150"))
+RENDER_JPEG_QUALITY = int(os.getenv("RENDER_JPEG_QUALITY", "90"))
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "4"))
+RENDER_PAGES_PER_BATCH = int(os.getenv("RENDER_PAGES_PER_BATCH", "4"))
+
+
+def render_settings() -> str:
+    """Рендерер и настройки качества (входят в отпечатки слайдов)"""
+    renderer = "libreoffice" if find_libreoffice() else "pptx"
+    return f"{renderer}:{RENDER_DPI}:{RENDER_JPEG_QUALITY}"
+
+
+def convert_pptx_to_images(pptx_path: str, output_dir: str, on_progress=None) -> list[str]:
+    """
+    Конвертирует PPTX в изображения JPG.
+    on_progress(готово, всего) вызывается по мере готовности страниц
+    """
     libreoffice_path = find_libreoffice()
+    
+    # ✅ Тот же файл с теми же настройками уже конвертировали - берем из кэша
+    content_hash = file_sha256(pptx_path) if conversion_cache.enabled() else None
+    if content_hash:
+        renderer = "libreoffice" if libreoffice_path else "pptx"
+        cached = conversion_cache.fetch(
+            conversion_cache.cache_key(content_hash, renderer, RENDER_DPI, RENDER_JPEG_QUALITY), output_dir
+        )
+        if cached is not None:
+            if on_progress:
+                on_progress(len(cached), len(cached))
+            return cached
+    
+    # Первый приоритет - LibreOffice (✅ пул запущенных процессов, см. libreoffice_pool.py)
     if libreoffice_path:
         try:
-            return convert_with_libreoffice(libreoffice_path, pptx_path, output_dir)
+            image_paths = convert_with_libreoffice(libreoffice_path, pptx_path, output_dir, on_progress)
+            if content_hash:
+                conversion_cache.store(
+                    conversion_cache.cache_key(content_hash, "libreoffice", RENDER_DPI, RENDER_JPEG_QUALITY),
+                    image_paths
+                )
+            return image_paths
         except Exception as e:
             print(f"LibreOffice конвертирование не удалось: {e}")
             # Fallback на python-pptx
     
     # Fallback на python-pptx с улучшенным отображением
-    return convert_with_enhanced_pptx(pptx_path, output_dir)
+    # (в кэш под своим ключом: временный сбой LibreOffice не подменит его результат)
+    image_paths = convert_with_enhanced_pptx(pptx_path, output_dir, on_progress)
+    if content_hash:
+        conversion_cache.store(
+            conversion_cache.cache_key(content_hash, "pptx", RENDER_DPI, RENDER_JPEG_QUALITY), image_paths
+        )
+    return image_paths
 
 
-def find_libreoffice():
-    """Ищет путь к LibreOffice"""
-    possible_paths = [
-        '/Applications/LibreOffice.app/Contents/MacOS/soffice',
-        '/usr/bin/libreoffice',
-        '/usr/bin/soffice',
-        '/opt/libreoffice/program/soffice',
-        '/usr/local/bin/libreoffice',
-    ]
+def hide_pptx_slides(pptx_path: str, dest_path: str, slide_numbers: list[int]) -> None:
+    """
+    Копия презентации, где все слайды, кроме slide_numbers, скрыты.
+    Нумерация с 1 по показываемым слайдам (скрытые автором в нее не входят и
+    остаются скрытыми). Скрытые слайды не попадают в PDF, но остаются в колоде -
+    поля с номером слайда показывают настоящую позицию
+    """
+    from pptx import Presentation
     
-    for path in possible_paths:
-        if os.path.exists(path):
-            return path
+    keep = set(slide_numbers)
+    prs = Presentation(pptx_path)
+    for number, slide in enumerate(visible_slides(prs), 1):
+        if number not in keep:
+            slide._element.set("show", "0")
+    prs.save(dest_path)
+
+
+def render_pptx_slides(pptx_path: str, output_dir: str, slide_numbers: list[int],
+                       slide_count: int, on_progress=None) -> dict[int, str]:
+    """
+    Рендерит только указанные слайды: {номер слайда: путь к slide_NNN.jpg}.
+    LibreOffice получает копию презентации, где остальные слайды скрыты,
+    запасной рендерер рисует только эти слайды; номера слайдов сохраняются.
+    """
+    slide_numbers = sorted(slide_numbers)
+    if not slide_numbers:
+        return {}
+    if len(slide_numbers) == slide_count:
+        image_paths = convert_pptx_to_images(pptx_path, output_dir, on_progress)
+    else:
+        image_paths = render_pptx_subset(pptx_path, output_dir, slide_numbers, on_progress)
     
-    # Пытаемся найти через which
-    try:
-        result = subprocess.run(['which', 'libreoffice'], capture_output=True, text=True, timeout=5)
-        if result.returncode == 0:
-            return result.stdout.strip()
-    except:
-        pass
+    if len(image_paths) != len(slide_numbers):
+        # Рендерер выдал не все страницы - номера слайдов не сопоставить
+        raise Exception(f"Получено {len(image_paths)} изображений вместо {len(slide_numbers)}")
     
-    return None
+    rendered = {}
+    # Сначала во временные имена: slide_002.jpg подмножества может быть слайдом 5
+    staged = []
+    for number, path in zip(slide_numbers, image_paths):
+        tmp_path = os.path.join(output_dir, f".render_{number:03d}.jpg")
+        os.replace(path, tmp_path)
+        staged.append((number, tmp_path))
+    for number, tmp_path in staged:
+        image_path = os.path.join(output_dir, f"slide_{number:03d}.jpg")
+        os.replace(tmp_path, image_path)
+        rendered[number] = image_path
+    return rendered
 
 
-def convert_with_libreoffice(libreoffice_path: str, pptx_path: str, output_dir: str) -> list[str]:
+def render_pptx_subset(pptx_path: str, output_dir: str, slide_numbers: list[int], on_progress=None) -> list[str]:
+    """Изображения слайдов slide_numbers в их порядке (без кэша конвертаций)"""
+    libreoffice_path = find_libreoffice()
+    if libreoffice_path:
+        subset_path = os.path.join(output_dir, ".subset.pptx")
+        try:
+            hide_pptx_slides(pptx_path, subset_path, slide_numbers)
+            return convert_with_libreoffice(libreoffice_path, subset_path, output_dir, on_progress)
+        except Exception as e:
+            print(f"LibreOffice конвертирование не удалось: {e}")
+        finally:
+            if os.path.exists(subset_path):
+                os.remove(subset_path)
+    
+    return convert_with_enhanced_pptx(pptx_path, output_dir, on_progress, slide_numbers=slide_numbers)
+
+
+def convert_with_libreoffice(libreoffice_path: str, pptx_path: str, output_dir: str, on_progress=None) -> list[str]:
     """Конвертирует PPTX в PDF через LibreOffice, затем PDF в JPG"""
+    pdf_path = os.path.join(output_dir, "presentation.pdf")
     try:
-        pdf_path = os.path.join(output_dir, "presentation.pdf")
+        # Конвертируем PPTX в PDF через LibreOffice (воркер пула, с таймаутом)
+        get_pool().convert_to_pdf(pptx_path, pdf_path)
         
-        # Конвертируем PPTX в PDF через LibreOffice
-        subprocess.run([
-            libreoffice_path, '--headless', '--convert-to', 'pdf',
-            '--outdir', output_dir, pptx_path
-        ], check=True, capture_output=True, timeout=300)
-        
-        # Конвертируем PDF в JPG через pdftoppm
-        from pdf2image import convert_from_path
-        images = convert_from_path(pdf_path, dpi=150, fmt='jpg')
-        
-        # Сохраняем изображения
-        image_paths = []
-        for idx, image in enumerate(images, 1):
-            image_path = os.path.join(output_dir, f"slide_{idx:03d}.jpg")
-            image.save(image_path, 'JPEG', quality=90)
-            image_paths.append(image_path)
+        # Конвертируем PDF в JPG через pdftoppm (порциями страниц, сразу на диск)
+        return rasterize_pdf(pdf_path, output_dir, on_progress=on_progress)
         
+    except Exception as e:
+        raise Exception(f"LibreOffice conversion failed: {str(e)}")
+    finally:
         # Удаляем PDF
         if os.path.exists(pdf_path):
             os.remove(pdf_path)
+
+
+def pdf_page_count(pdf_path: str) -> int:
+    """Число страниц PDF (pdfinfo, без растеризации)"""
+    from pdf2image import pdfinfo_from_path
+    return int(pdfinfo_from_path(pdf_path)["Pages"])
+
+
+def page_batches(page_count: int, batch_size: int) -> list[tuple[int, int]]:
+    """Диапазоны страниц (first_page, last_page), нумерация с 1"""
+    batch_size = max(1, batch_size)
+    return [
+        (first, min(first + batch_size - 1, page_count))
+        for first in range(1, page_count + 1, batch_size)
+    ]
+
+
+def _render_batch(pdf_path: str, first_page: int, last_page: int, output_dir: str,
+                  dpi: int, quality: int) -> list[str]:
+    """
+    Рендерит диапазон страниц: pdftoppm пишет JPEG сам (paths_only - без загрузки
+    в PIL), файлы переименовываются в slide_NNN.jpg
+    """
+    from pdf2image import convert_from_path
+
+    batch_dir = tempfile.mkdtemp(prefix=f".pages_{first_page}_", dir=output_dir)
+    try:
+        rendered = convert_from_path(
+            pdf_path, dpi=dpi, first_page=first_page, last_page=last_page,
+            output_folder=batch_dir, output_file="page", fmt="jpeg",
+            jpegopt={"quality": quality, "optimize": True, "progressive": False},
+            paths_only=True
+        )
+        if len(rendered) != last_page - first_page + 1:
+            raise Exception(f"pdftoppm вернул {len(rendered)} страниц вместо {last_page - first_page + 1}")
         
+        image_paths = []
+        for idx, path in enumerate(sorted(rendered), first_page):
+            image_path = os.path.join(output_dir, f"slide_{idx:03d}.jpg")
+            os.replace(path, image_path)
+            image_paths.append(image_path)
         return image_paths
-        
-    except Exception as e:
-        raise Exception(f"LibreOffice conversion failed: {str(e)}")
+    finally:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+def rasterize_pdf(pdf_path: str, output_dir: str, on_progress=None, dpi: int = None,
+                  quality: int = None, workers: int = None, batch_size: int = None,
+                  on_pages=None) -> list[str]:
+    """
+    Растеризует PDF в slide_001.jpg, slide_002.jpg, ... параллельно порциями страниц.
+    Одновременно рендерится не больше workers * batch_size страниц, каждая страница
+    сразу пишется на диск - память не растет с размером презентации.
+    on_pages(первая страница, пути) вызывается в вызывающем потоке для каждой
+    готовой порции (порции могут завершаться не по порядку).
+    """
+    dpi = RENDER_DPI if dpi is None else dpi
+    quality = RENDER_JPEG_QUALITY if quality is None else quality
+    workers = max(1, RENDER_WORKERS if workers is None else workers)
+    batch_size = RENDER_PAGES_PER_BATCH if batch_size is None else batch_size
+
+    page_count = pdf_page_count(pdf_path)
+    if page_count == 0:
+        raise Exception("PDF не содержит страниц")
+    if on_progress:
+        on_progress(0, page_count)
+
+    batches = page_batches(page_count, batch_size)
+    results = {}
+    first_pages = {}
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rasterize") as executor:
+        pending = set()
+        for first_page, last_page in batches:
+            # Новую порцию ставим, только когда освободился воркер
+            if len(pending) >= workers:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                done += _collect_batches(finished, first_pages, results, on_pages)
+                if on_progress:
+                    on_progress(done, page_count)
+            future = executor.submit(_render_batch, pdf_path, first_page, last_page, output_dir, dpi, quality)
+            first_pages[future] = first_page
+            pending.add(future)
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            done += _collect_batches(finished, first_pages, results, on_pages)
+            if on_progress:
+                on_progress(done, page_count)
+
+    return [path for first_page, _ in batches for path in results[first_page]]
 
 
-def convert_with_enhanced_pptx(pptx_path: str, output_dir: str) -> list[str]:
-    """Улучшенное конвертирование с использованием python-pptx"""
+def _collect_batches(finished, first_pages: dict, results: dict, on_pages=None) -> int:
+    pages = 0
+    for future in finished:
+        paths = future.result()  # Ошибка рендеринга прерывает конвертацию
+        results[first_pages[future]] = paths
+        pages += len(paths)
+        if on_pages:
+            on_pages(first_pages[future], paths)
+    return pages
+
+
+def convert_with_enhanced_pptx(pptx_path: str, output_dir: str, on_progress=None,
+                               slide_numbers: list[int] = None) -> list[str]:
+    """
+    Улучшенное конвертирование с использованием python-pptx (✅ слайды рисуются в пуле процессов).
+    slide_numbers - рисовать только эти слайды (под своими номерами).
+    Как и LibreOffice, скрытые слайды пропускает и не нумерует
+    """
     try:
         from pptx import Presentation
     except ImportError:
@@ -89,114 +268,19 @@ def convert_with_enhanced_pptx(pptx_path: str, output_dir: str) -> list[str]:
     
     try:
         prs = Presentation(pptx_path)
-        slide_count = len(prs.slides)
+        slides = visible_slides(prs)
         
-        if slide_count == 0:
+        if not slides:
             raise Exception("PPTX файл не содержит слайдов")
         
-        image_paths = []
-        width, height = 1280, 720
-        
-        # Для каждого слайда создаем JPG
-        for idx, slide in enumerate(prs.slides, 1):
-            # Создаем белое изображение
-            img = Image.new('RGB', (width, height), color=(255, 255, 255))
-            draw = ImageDraw.Draw(img)
-            
-            # Рисуем серый фон для разделения
-            draw.rectangle([0, 0, width, height], fill=(250, 250, 250), outline=(150, 150, 200), width=2)
-            
-            # Добавляем содержимое слайда
-            y_offset = 30
-            shape_count = 0
-            
-            # Обрабатываем все shape'ы на слайде
-            for shape_idx, shape in enumerate(slide.shapes):
-                # Обработка текстовых блоков
-                if hasattr(shape, "text_frame"):
-                    text_frame = shape.text_frame
-                    if text_frame.text.strip():
-                        # Анализируем структуру текста
-                        for para_idx, paragraph in enumerate(text_frame.paragraphs):
-                            text = paragraph.text.strip()
-                            if not text:
-                                continue
-                            
-                            level = paragraph.level
-                            
-                            # Определяем стиль в зависимости от уровня
-                            if level == 0 and para_idx == 0:
-                                # Заголовок слайда
-                                font_size = 18
-                                color = (0, 0, 100)
-                                y_offset += 10
-                            elif level == 0:
-                                # Основной текст
-                                font_size = 14
-                                color = (30, 30, 30)
-                            else:
-                                # Текст второго уровня
-                                font_size = 12
-                                color = (80, 80, 80)
-                                text = "  • " + text
-                            
-                            # Рисуем текст с переносами
-                            lines = textwrap.wrap(text, width=90)
-                            for line in lines:
-                                if y_offset > height - 80:
-                                    break
-                                
-                                draw.text((40, y_offset), line, fill=color, font=None)
-                                y_offset += font_size + 4
-                            
-                            shape_count += 1
-                            
-                            if y_offset > height - 80:
-                                break
-                
-                # Обработка таблиц
-                elif hasattr(shape, "has_table") and shape.has_table:
-                    table = shape.table
-                    y_offset += 15
-                    
-                    for row_idx, row in enumerate(table.rows):
-                        for col_idx, cell in enumerate(row.cells):
-                            text = cell.text.strip()
-                            if text:
-                                color = (0, 0, 100) if row_idx == 0 else (50, 50, 50)
-                                x_pos = 40 + col_idx * 280
-                                
-                                # Обрезаем длинный текст
-                                if len(text) > 30:
-                                    text = text[:27] + "..."
-                                
-                                draw.text((x_pos, y_offset), text, fill=color, font=None)
-                        
-                        y_offset += 25
-                        if y_offset > height - 80:
-                            break
-                    
-                    shape_count += 1
-                
-                if y_offset > height - 80:
-                    break
-            
-            # Если слайд пустой, добавляем сообщение
-            if shape_count == 0:
-                draw.text((width // 2 - 100, height // 2 - 30), 
-                         f"Слайд {idx} (без текста)", 
-                         fill=(150, 150, 150), font=None)
-            
-            # Добавляем номер слайда
-            draw.text((width - 150, height - 40), f"Слайд {idx}", 
-                     fill=(150, 150, 150), font=None)
-            
-            # Сохраняем JPG
-            image_path = os.path.join(output_dir, f"slide_{idx:03d}.jpg")
-            img.save(image_path, 'JPEG', quality=95)
-            image_paths.append(image_path)
-        
-        return image_paths
+        # PPTX разбирается один раз, воркерам передается только то, что рисуется
+        keep = set(slide_numbers) if slide_numbers is not None else None
+        tasks = [
+            (idx, extract_slide_content(slide), os.path.join(output_dir, f"slide_{idx:03d}.jpg"))
+            for idx, slide in enumerate(slides, 1)
+            if keep is None or idx in keep
+        ]
+        return render_slides(tasks, on_progress=on_progress)
         
     except Exception as e:
         raise Exception(f"PPTX conversion failed: {str(e)}")
@@ -207,13 +291,7 @@ def draw_wrapped_text(draw, text, x, y, max_width, color, font_size=14, bold=Fal
     # Подготовляем текст
     lines = text.split('\n')
     
-    try:
-        if font_size > 16:
-            font = ImageFont.load_default()
-        else:
-            font = ImageFont.load_default()
-    except:
-        font = ImageFont.load_default()
+    font = default_font()
     
     current_y = y
     char_width = 8  # Примерная ширина символа
@@ -225,7 +303,7 @@ def draw_wrapped_text(draw, text, x, y, max_width, color, font_size=14, bold=Fal
             continue
         
         # Разбиваем длинные строки
-        wrapped_lines = textwrap.wrap(line.strip(), width=chars_per_line)
+        wrapped_lines = wrap_text(line.strip(), chars_per_line)
         
         for wrapped_line in wrapped_lines:
             if current_y > 700:  # Не выходим за границы
@@ -0,0 +1,141 @@
+"""
+Импорт слайдов из папки на сервере.
+
+Папка читается одним проходом os.scandir (имя, размер, mtime каждого файла)
+вместо проверки slide1.jpg..slide999.jpg по одному имени. Файлы переносятся
+самым дешевым доступным способом: reflink, жесткая ссылка (только если
+включена), copy_file_range, и только затем обычное копирование.
+"""
+import errno
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from files import file_sha256
+
+# Жесткая ссылка делит inode с исходным файлом: запись в исходник "на месте"
+# изменит и слайд, а его URL с хешем отдается как immutable - клиенты и CDN
+# сохранят старые байты. Поэтому только явно: FOLDER_IMPORT_HARDLINKS=1
+FOLDER_IMPORT_HARDLINKS = os.getenv("FOLDER_IMPORT_HARDLINKS", "0") == "1"
+FOLDER_IMPORT_WORKERS = int(os.getenv("FOLDER_IMPORT_WORKERS", "8"))
+MAX_FOLDER_SLIDES = 999
+
+SLIDE_NAME_RE = re.compile(r"^slide(\d+)\.jpg$")
+FICLONE = 0x40049409  # ioctl клонирования файла (Linux: btrfs, xfs, ...)
+
+
+@dataclass(frozen=True)
+class FolderSlide:
+    order: int
+    filename: str
+    path: str
+    size: int
+    mtime: float
+
+
+def scan_slide_folder(folder_path: str) -> list[FolderSlide]:
+    """
+    Индекс slide*.jpg папки за один проход.
+    Как и прежде, последовательность обрывается на двух пропущенных номерах подряд.
+    """
+    found = {}
+    with os.scandir(folder_path) as entries:
+        for entry in entries:
+            match = SLIDE_NAME_RE.match(entry.name)
+            if not match or not entry.is_file():
+                continue
+            order = int(match.group(1))
+            if 1 <= order <= MAX_FOLDER_SLIDES:
+                stat_result = entry.stat()
+                found[order] = FolderSlide(order, entry.name, entry.path, stat_result.st_size, stat_result.st_mtime)
+
+    slides = []
+    for order in range(1, MAX_FOLDER_SLIDES + 1):
+        if order in found:
+            slides.append(found[order])
+        elif order > 1 and order - 1 not in found:
+            break
+    return slides
+
+
+def _reflink(src: str, dst: str) -> bool:
+    try:
+        import fcntl
+    except ImportError:
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(dst)
+    return False
+
+
+def _copy_file_range(src: str, dst: str) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            if remaining == 0:
+                return True
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EBADF):
+                raise
+    os.remove(dst)
+    return False
+
+
+def copy_file_fast(src: str, dst: str, hardlink: bool = None) -> str:
+    """
+    Переносит файл самым дешевым способом, возвращает его название.
+    hardlink - разрешить жесткую ссылку (по умолчанию FOLDER_IMPORT_HARDLINKS)
+    """
+    hardlink = FOLDER_IMPORT_HARDLINKS if hardlink is None else hardlink
+    if os.path.exists(dst):
+        os.remove(dst)
+
+    if _reflink(src, dst):
+        shutil.copystat(src, dst)
+        return "reflink"
+
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            pass  # Другая файловая система или ссылки не поддерживаются
+
+    if _copy_file_range(src, dst):
+        shutil.copystat(src, dst)
+        return "copy_file_range"
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def import_slide(slide: FolderSlide, dest_dir: str) -> tuple[str, str]:
+    """Переносит один слайд в dest_dir, возвращает (способ, sha256)"""
+    dest_path = os.path.join(dest_dir, slide.filename)
+    method = copy_file_fast(slide.path, dest_path)
+    return method, file_sha256(dest_path)
+
+
+def import_slides(slides: list[FolderSlide], dest_dir: str, on_progress=None) -> list[tuple[str, str]]:
+    """Параллельный перенос слайдов (сетевые папки), результаты в порядке slides"""
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, FOLDER_IMPORT_WORKERS)) as executor:
+        for done, result in enumerate(executor.map(lambda slide: import_slide(slide, dest_dir), slides), 1):
+            results.append(result)
+            if on_progress:
+                on_progress(done)
+    return results
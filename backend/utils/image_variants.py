@@ -0,0 +1,248 @@
+"""
+Адаптивные варианты изображений слайдов.
+
+При загрузке для каждого слайда создаются уменьшенные копии (миниатюра, 720p, 1080p)
+и версии в WebP/AVIF. Варианты лежат в подпапке variants/ рядом с оригиналом
+и работают как кэш: отсутствующий или устаревший вариант пересоздается в фоне
+после первого запроса, а до тех пор отдается ближайший готовый вариант или оригинал.
+"""
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional
+
+from PIL import Image, features
+
+VARIANTS_DIRNAME = "variants"
+
+# Ширины вариантов: миниатюра, 720p, 1080p
+VARIANT_WIDTHS = tuple(
+    int(w) for w in os.getenv("SLIDE_VARIANT_WIDTHS", "320,1280,1920").split(",") if w.strip()
+)
+VARIANT_WORKERS = int(os.getenv("SLIDE_VARIANT_WORKERS", "4"))
+
+FORMATS = {
+    "jpeg": {"ext": "jpg", "media_type": "image/jpeg", "pil": "JPEG", "options": {"quality": 85, "optimize": True}},
+    "webp": {"ext": "webp", "media_type": "image/webp", "pil": "WEBP", "options": {"quality": 80, "method": 4}},
+    "avif": {"ext": "avif", "media_type": "image/avif", "pil": "AVIF", "options": {"quality": 60}},
+}
+
+
+def _format_supported(name: str) -> bool:
+    if name == "jpeg":
+        return True
+    try:
+        return bool(features.check(name))
+    except Exception:
+        return False
+
+
+# Форматы, которые создаются при загрузке (AVIF - только если Pillow его поддерживает)
+VARIANT_FORMATS = tuple(
+    name for name in os.getenv("SLIDE_VARIANT_FORMATS", "jpeg,webp,avif").split(",")
+    if name in FORMATS and _format_supported(name)
+)
+
+
+def variant_path(source_path: str, width: Optional[int], fmt: str) -> str:
+    """Путь варианта: variants/slide1_1280.webp; width=None - исходный размер"""
+    directory, filename = os.path.split(source_path)
+    stem = os.path.splitext(filename)[0]
+    size = str(width) if width else "full"
+    return os.path.join(directory, VARIANTS_DIRNAME, f"{stem}_{size}.{FORMATS[fmt]['ext']}")
+
+
+def remove_variants(source_path: str) -> None:
+    """Удаляет все варианты изображения (исходный файл заменен или удален)"""
+    directory, filename = os.path.split(source_path)
+    prefix = os.path.splitext(filename)[0] + "_"
+    variants_dir = os.path.join(directory, VARIANTS_DIRNAME)
+    if not os.path.isdir(variants_dir):
+        return
+    for entry in os.scandir(variants_dir):
+        if entry.name.startswith(prefix):
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+def _is_fresh(path: str, source_mtime: float) -> bool:
+    try:
+        return os.path.getmtime(path) >= source_mtime
+    except OSError:
+        return False
+
+
+def _save_atomic(image: Image.Image, path: str, fmt: str) -> None:
+    """Запись через временный файл - читатели не видят недописанный вариант"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            image.save(f, FORMATS[fmt]["pil"], **FORMATS[fmt]["options"])
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _resized(image: Image.Image, width: Optional[int]) -> Image.Image:
+    if not width or width >= image.width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def planned_variants(source_width: int) -> list:
+    """(width, fmt) для загрузки: без увеличения и без копии оригинала в JPEG"""
+    plan = []
+    for fmt in VARIANT_FORMATS:
+        if fmt != "jpeg":
+            plan.append((None, fmt))
+        for width in VARIANT_WIDTHS:
+            if width < source_width:
+                plan.append((width, fmt))
+    return plan
+
+
+def generate_variants(source_path: str) -> list[str]:
+    """Создает все варианты одного слайда, возвращает пути"""
+    source_mtime = os.path.getmtime(source_path)
+    paths = []
+    with Image.open(source_path) as source:
+        source = source.convert("RGB")
+        for width, fmt in planned_variants(source.width):
+            path = variant_path(source_path, width, fmt)
+            if not _is_fresh(path, source_mtime):
+                _save_atomic(_resized(source, width), path, fmt)
+            paths.append(path)
+    return paths
+
+
+def generate_variants_for_files(source_paths: list[str]) -> None:
+    """Варианты для набора слайдов в пуле потоков (Pillow отпускает GIL при кодировании)"""
+    if not VARIANT_FORMATS:
+        return
+    with ThreadPoolExecutor(max_workers=max(1, VARIANT_WORKERS)) as executor:
+        list(executor.map(generate_variants, source_paths))
+
+
+_background = ThreadPoolExecutor(max_workers=1, thread_name_prefix="variants")
+
+
+def _generate_quietly(source_paths: list[str]) -> None:
+    try:
+        generate_variants_for_files(source_paths)
+    except Exception as e:
+        # Варианты - кэш: недостающие создаются по первому запросу
+        print(f"Warning: Could not generate image variants: {e}")
+
+
+def schedule_variants(source_paths: list[str]) -> None:
+    """Создание вариантов в фоне, без ожидания"""
+    if VARIANT_FORMATS and source_paths:
+        _background.submit(_generate_quietly, list(source_paths))
+
+
+_regenerating = set()
+_regenerating_lock = threading.Lock()
+
+
+def _regenerate(source_path: str, width: Optional[int], fmt: str) -> None:
+    try:
+        with Image.open(source_path) as source:
+            _save_atomic(_resized(source.convert("RGB"), width), variant_path(source_path, width, fmt), fmt)
+    except Exception as e:
+        print(f"Warning: Could not regenerate image variant: {e}")
+    finally:
+        with _regenerating_lock:
+            _regenerating.discard((source_path, width, fmt))
+
+
+def request_variant(source_path: str, width: Optional[int], fmt: str, source_mtime: float) -> Optional[str]:
+    """
+    Путь к свежему варианту или None. Вытесненный или устаревший вариант
+    пересоздается в фоне - один раз, сколько бы запросов его ни ждало
+    """
+    path = variant_path(source_path, width, fmt)
+    if _is_fresh(path, source_mtime):
+        return path
+    key = (source_path, width, fmt)
+    with _regenerating_lock:
+        if key in _regenerating:
+            return None
+        _regenerating.add(key)
+    _background.submit(_regenerate, source_path, width, fmt)
+    return None
+
+
+def _nearest_variant(source_path: str, width: Optional[int], fmt: str, source_mtime: float) -> Optional[tuple]:
+    """Ближайший готовый вариант того же формата не уже width: (ширина, путь)"""
+    widths = sorted(w for w in VARIANT_WIDTHS if width and w > width)
+    if fmt != "jpeg":
+        widths.append(None)  # Полный размер в WebP/AVIF; для JPEG это оригинал
+    for candidate in widths:
+        path = variant_path(source_path, candidate, fmt)
+        if _is_fresh(path, source_mtime):
+            return candidate, path
+    return None
+
+
+@lru_cache(maxsize=8192)
+def _cached_width(path: str, mtime_ns: int) -> int:
+    with Image.open(path) as image:  # Читается только заголовок
+        return image.width
+
+
+def image_width(path: str) -> int:
+    """Ширина изображения, кэшируется до изменения файла"""
+    return _cached_width(path, os.stat(path).st_mtime_ns)
+
+
+def accepted_formats(accept: Optional[str]) -> list[str]:
+    """Форматы из заголовка Accept в порядке предпочтения сервера (AVIF, WebP)"""
+    accept = (accept or "").lower()
+    return [
+        fmt for fmt in ("avif", "webp")
+        if fmt in VARIANT_FORMATS and FORMATS[fmt]["media_type"] in accept
+    ]
+
+
+def preferred_format(accept: Optional[str]) -> str:
+    """Формат, который получит клиент с таким Accept"""
+    formats = accepted_formats(accept)
+    return formats[0] if formats else "jpeg"
+
+
+def choose_variant(source_path: str, width: Optional[int], accept: Optional[str]) -> tuple:
+    """
+    Выбирает вариант по ширине и Accept.
+    Возвращает (путь, media_type, тег варианта для ETag, вариант тот, что нужен);
+    тег "" - оригинал. Пока нужный вариант пересоздается, отдается ближайший
+    готовый или оригинал (False в последнем поле - такой ответ не кэшируется).
+    """
+    target_width = None
+    source_width = image_width(source_path) if width else None
+    if width and width < source_width:
+        # Наименьший вариант не уже запрошенной ширины
+        candidates = [w for w in VARIANT_WIDTHS if width <= w < source_width]
+        target_width = min(candidates) if candidates else None
+
+    fmt = preferred_format(accept)
+    if fmt == "jpeg" and target_width is None:
+        return source_path, FORMATS["jpeg"]["media_type"], "", True
+
+    source_mtime = os.path.getmtime(source_path)
+    path = request_variant(source_path, target_width, fmt, source_mtime)
+    if path is not None:
+        return path, FORMATS[fmt]["media_type"], f"-{target_width or 'full'}.{FORMATS[fmt]['ext']}", True
+
+    nearest = _nearest_variant(source_path, target_width, fmt, source_mtime)
+    if nearest is not None:
+        nearest_width, path = nearest
+        return path, FORMATS[fmt]["media_type"], f"-{nearest_width or 'full'}.{FORMATS[fmt]['ext']}", False
+    return source_path, FORMATS["jpeg"]["media_type"], "", False
@@ -0,0 +1,300 @@
+"""
+Пул долгоживущих процессов LibreOffice для конвертации PPTX -> PDF.
+
+Раньше каждая конвертация запускала новый `soffice --headless`: несколько
+секунд уходило на старт и создание профиля. Теперь каждый воркер пула держит
+запущенный soffice с UNO-слушателем (--accept=pipe,...) и процесс-мост на
+Python с модулем uno, который получает задания построчно (JSON) через stdin.
+Конвертация стоит только времени рендеринга.
+
+Если Python с модулем uno не найден (его нет в python:3.x-slim), воркер
+вызывает `soffice --convert-to` для каждой задачи, но с постоянным
+профилем - повторное создание профиля при этом не требуется.
+
+- Одновременно идет не больше LIBREOFFICE_WORKERS конвертаций (на процесс)
+- Задача дольше LIBREOFFICE_TIMEOUT секунд прерывается, soffice перезапускается
+- Упавший soffice перезапускается при следующей задаче
+"""
+import atexit
+import json
+import os
+import queue
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from typing import Optional
+
+LIBREOFFICE_WORKERS = int(os.getenv("LIBREOFFICE_WORKERS", "2"))
+LIBREOFFICE_TIMEOUT = float(os.getenv("LIBREOFFICE_TIMEOUT", "300"))
+LIBREOFFICE_START_TIMEOUT = float(os.getenv("LIBREOFFICE_START_TIMEOUT", "60"))
+# Перезапуск воркера после N конвертаций (защита от утечек памяти soffice)
+LIBREOFFICE_MAX_JOBS = int(os.getenv("LIBREOFFICE_MAX_JOBS", "200"))
+LIBREOFFICE_PROFILES_DIR = os.path.join(tempfile.gettempdir(), "slideconfirm_lo_profiles")
+
+SOFFICE_PATHS = [
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice',
+    '/usr/bin/libreoffice',
+    '/usr/bin/soffice',
+    '/opt/libreoffice/program/soffice',
+    '/usr/local/bin/libreoffice',
+]
+
+# Мост к soffice: выполняется интерпретатором с модулем uno (Python 3 любой версии)
+BRIDGE_SCRIPT = r'''
+import json, sys, time
+import uno
+from com.sun.star.beans import PropertyValue
+
+def prop(name, value):
+    p = PropertyValue()
+    p.Name = name
+    p.Value = value
+    return p
+
+local = uno.getComponentContext()
+resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+deadline = time.monotonic() + float(sys.argv[2])
+while True:
+    try:
+        ctx = resolver.resolve("uno:pipe,name=%s;urp;StarOffice.ComponentContext" % sys.argv[1])
+        break
+    except Exception:
+        if time.monotonic() > deadline:
+            raise
+        time.sleep(0.1)
+desktop = ctx.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", ctx)
+print(json.dumps({"ready": True}), flush=True)
+
+for line in sys.stdin:
+    job = json.loads(line)
+    try:
+        doc = desktop.loadComponentFromURL(uno.systemPathToFileUrl(job["src"]), "_blank", 0,
+                                           (prop("Hidden", True), prop("ReadOnly", True)))
+        if doc is None:
+            raise RuntimeError("document could not be loaded")
+        try:
+            doc.storeToURL(uno.systemPathToFileUrl(job["dst"]), (prop("FilterName", "impress_pdf_Export"),))
+        finally:
+            doc.close(True)
+        print(json.dumps({"ok": True}), flush=True)
+    except Exception as e:
+        print(json.dumps({"ok": False, "error": "%s: %s" % (type(e).__name__, e)}), flush=True)
+'''
+
+
+class ConversionError(Exception):
+    """LibreOffice не смог сконвертировать файл"""
+
+
+class ConversionTimeout(ConversionError):
+    """Конвертация не уложилась в таймаут (soffice будет перезапущен)"""
+
+
+@lru_cache(maxsize=1)
+def find_libreoffice() -> Optional[str]:
+    """Путь к soffice (ищется один раз за процесс)"""
+    for path in SOFFICE_PATHS:
+        if os.path.exists(path):
+            return path
+    return shutil.which("libreoffice") or shutil.which("soffice")
+
+
+@lru_cache(maxsize=None)
+def find_uno_python(soffice_path: str) -> Optional[str]:
+    """Интерпретатор с модулем uno: встроенный в LibreOffice или системный"""
+    program_dir = os.path.dirname(os.path.realpath(soffice_path))
+    candidates = [
+        os.path.join(program_dir, "python"),
+        os.path.join(program_dir, "..", "Resources", "python"),  # macOS
+        "/usr/bin/python3",
+    ]
+    for candidate in candidates:
+        if not os.path.isfile(candidate):
+            continue
+        try:
+            result = subprocess.run([candidate, "-c", "import uno"], capture_output=True, timeout=30)
+        except (OSError, subprocess.TimeoutExpired):
+            continue
+        if result.returncode == 0:
+            return candidate
+    return None
+
+
+def _kill(process: Optional[subprocess.Popen]) -> None:
+    """Останавливает процесс вместе с дочерними (soffice запускает soffice.bin)"""
+    if process is None or process.poll() is not None:
+        return
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (OSError, AttributeError):
+        process.kill()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        pass
+
+
+class LibreOfficeWorker:
+    """Один soffice с постоянным профилем; с мостом uno - постоянно запущенный"""
+
+    def __init__(self, index: int, soffice_path: str, uno_python: Optional[str]):
+        self.soffice_path = soffice_path
+        self.uno_python = uno_python
+        self.name = f"slideconfirm_lo_{os.getpid()}_{index}"
+        self.profile_dir = os.path.join(LIBREOFFICE_PROFILES_DIR, self.name)
+        self.jobs_done = 0
+        self._soffice = None
+        self._bridge = None
+        self._responses = queue.Queue()
+
+    @property
+    def profile_url(self) -> str:
+        return "file://" + self.profile_dir
+
+    def alive(self) -> bool:
+        return (self._soffice is not None and self._soffice.poll() is None
+                and self._bridge is not None and self._bridge.poll() is None)
+
+    def start(self) -> None:
+        self.stop()
+        self.jobs_done = 0
+        self._soffice = subprocess.Popen([
+            self.soffice_path, "--headless", "--invisible", "--nologo", "--nodefault",
+            "--norestore", "--nolockcheck",
+            f"--accept=pipe,name={self.name};urp;StarOffice.ComponentContext",
+            f"-env:UserInstallation={self.profile_url}"
+        ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        self._bridge = subprocess.Popen(
+            [self.uno_python, "-c", BRIDGE_SCRIPT, self.name, str(LIBREOFFICE_START_TIMEOUT)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, bufsize=1, start_new_session=True
+        )
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read_responses, args=(self._bridge, self._responses),
+                         daemon=True, name=f"{self.name}-reader").start()
+
+        response = self._wait_response(LIBREOFFICE_START_TIMEOUT + 5)
+        if not response.get("ready"):
+            self.stop()
+            raise ConversionError("LibreOffice не запустился")
+
+    @staticmethod
+    def _read_responses(bridge: subprocess.Popen, responses: queue.Queue) -> None:
+        for line in bridge.stdout:
+            try:
+                responses.put(json.loads(line))
+            except ValueError:
+                continue  # Посторонний вывод soffice/uno
+        responses.put(None)  # Мост завершился
+
+    def _wait_response(self, timeout: float) -> dict:
+        try:
+            response = self._responses.get(timeout=timeout)
+        except queue.Empty:
+            self.stop()
+            raise ConversionTimeout(f"LibreOffice не ответил за {timeout:.0f} с")
+        if response is None:
+            self.stop()
+            raise ConversionError("LibreOffice завершился во время конвертации")
+        return response
+
+    def stop(self) -> None:
+        for process in (self._bridge, self._soffice):
+            _kill(process)
+        self._bridge = None
+        self._soffice = None
+
+    def convert(self, src_path: str, pdf_path: str, timeout: float) -> None:
+        if self.uno_python is None:
+            self._convert_subprocess(src_path, pdf_path, timeout)
+            return
+
+        if not self.alive() or self.jobs_done >= LIBREOFFICE_MAX_JOBS:
+            self.start()
+        self._bridge.stdin.write(json.dumps({
+            "src": os.path.abspath(src_path), "dst": os.path.abspath(pdf_path)
+        }) + "\n")
+        self._bridge.stdin.flush()
+        response = self._wait_response(timeout)
+        self.jobs_done += 1
+        if not response.get("ok"):
+            raise ConversionError(response.get("error") or "LibreOffice conversion failed")
+
+    def _convert_subprocess(self, src_path: str, pdf_path: str, timeout: float) -> None:
+        """Запасной вариант без uno: отдельный soffice на задачу, профиль постоянный"""
+        out_dir = tempfile.mkdtemp(prefix="lo_out_")
+        try:
+            process = subprocess.Popen([
+                self.soffice_path, "--headless", "--norestore", "--nolockcheck",
+                f"-env:UserInstallation={self.profile_url}",
+                "--convert-to", "pdf", "--outdir", out_dir, src_path
+            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+            try:
+                _, stderr = process.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                _kill(process)
+                raise ConversionTimeout(f"LibreOffice не уложился в {timeout:.0f} с")
+
+            produced = os.path.join(out_dir, os.path.splitext(os.path.basename(src_path))[0] + ".pdf")
+            if process.returncode != 0 or not os.path.exists(produced):
+                raise ConversionError(stderr.decode(errors="replace").strip() or "LibreOffice conversion failed")
+            shutil.move(produced, pdf_path)
+        finally:
+            shutil.rmtree(out_dir, ignore_errors=True)
+
+    def close(self) -> None:
+        self.stop()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+class LibreOfficePool:
+    """Ограниченный набор воркеров: задача ждет свободного воркера"""
+
+    def __init__(self, soffice_path: str, size: int = LIBREOFFICE_WORKERS):
+        uno_python = find_uno_python(soffice_path)
+        self.persistent = uno_python is not None
+        self.workers = [LibreOfficeWorker(index, soffice_path, uno_python) for index in range(max(1, size))]
+        self._idle = queue.LifoQueue()  # Последний освободившийся воркер - самый "теплый"
+        for worker in self.workers:
+            self._idle.put(worker)
+
+    def convert_to_pdf(self, src_path: str, pdf_path: str, timeout: Optional[float] = None) -> None:
+        timeout = LIBREOFFICE_TIMEOUT if timeout is None else timeout
+        worker = self._idle.get()
+        try:
+            try:
+                worker.convert(src_path, pdf_path, timeout)
+            except ConversionTimeout:
+                raise
+            except ConversionError:
+                if worker.alive() or not self.persistent:
+                    raise
+                # soffice упал на этом файле - повторяем один раз на свежем процессе
+                worker.convert(src_path, pdf_path, timeout)
+        finally:
+            self._idle.put(worker)
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> Optional[LibreOfficePool]:
+    """Пул процесса (создается при первой конвертации); None - LibreOffice не установлен"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            soffice_path = find_libreoffice()
+            if soffice_path is None:
+                return None
+            _pool = LibreOfficePool(soffice_path)
+            atexit.register(_pool.close)
+        return _pool
@@ -0,0 +1,218 @@
+"""
+Запасной рендерер слайдов PPTX (без LibreOffice) на пуле процессов.
+
+Родительский процесс один раз разбирает PPTX через python-pptx и извлекает
+из каждого слайда только то, что рисуется: абзацы текста (уровень, текст)
+и ячейки таблиц. Рисование и кодирование JPEG - основная работа - идут
+в PPTX_RENDER_WORKERS процессах; каждый воркер сам пишет файл на диск.
+
+В воркере кэшируются шрифт, фон слайда (копируется вместо рисования заново)
+и переносы строк. Результаты возвращаются в порядке слайдов по мере готовности.
+Модуль импортируется в процессах-воркерах, поэтому зависит только от PIL.
+"""
+import multiprocessing
+import os
+import textwrap
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+# 0 - рендеринг в текущем процессе
+PPTX_RENDER_WORKERS = int(os.getenv("PPTX_RENDER_WORKERS", str(min(4, os.cpu_count() or 1))))
+SLIDE_WIDTH, SLIDE_HEIGHT = 1280, 720
+JPEG_QUALITY = 95
+BOTTOM_MARGIN = 80
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: воркеры не наследуют потоки и блокировки процесса приложения
+            _executor = ProcessPoolExecutor(
+                max_workers=PPTX_RENDER_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def visible_slides(prs) -> list:
+    """
+    Слайды, которые попадают в показ и экспорт: скрытые автором (show="0")
+    LibreOffice в PDF не выводит, поэтому они пропускаются везде
+    """
+    return [slide for slide in prs.slides if slide._element.get("show") not in ("0", "false")]
+
+
+def extract_slide_content(slide) -> list[tuple]:
+    """
+    Что рисуется на слайде: [("text", [(номер абзаца, уровень, текст)]),
+    ("table", [[текст ячейки, ...], ...])] в порядке фигур
+    """
+    blocks = []
+    for shape in slide.shapes:
+        # Обработка текстовых блоков
+        if hasattr(shape, "text_frame"):
+            text_frame = shape.text_frame
+            if text_frame.text.strip():
+                blocks.append(("text", [
+                    (para_idx, paragraph.level, paragraph.text.strip())
+                    for para_idx, paragraph in enumerate(text_frame.paragraphs)
+                ]))
+
+        # Обработка таблиц
+        elif hasattr(shape, "has_table") and shape.has_table:
+            blocks.append(("table", [
+                [cell.text.strip() for cell in row.cells]
+                for row in shape.table.rows
+            ]))
+    return blocks
+
+
+@lru_cache(maxsize=1)
+def default_font():
+    """Шрифт по умолчанию загружается один раз на процесс"""
+    return ImageFont.load_default()
+
+
+@lru_cache(maxsize=4096)
+def wrap_text(text: str, width: int) -> tuple:
+    """Перенос строк (повторяющиеся заголовки и колонтитулы считаются один раз)"""
+    return tuple(textwrap.wrap(text, width=width))
+
+
+@lru_cache(maxsize=1)
+def _background() -> Image.Image:
+    """Фон слайда: рисуется один раз, для каждого слайда копируется"""
+    img = Image.new('RGB', (SLIDE_WIDTH, SLIDE_HEIGHT), color=(255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    # Рисуем серый фон для разделения
+    draw.rectangle([0, 0, SLIDE_WIDTH, SLIDE_HEIGHT], fill=(250, 250, 250), outline=(150, 150, 200), width=2)
+    return img
+
+
+def render_slide(idx: int, blocks: list, image_path: str) -> str:
+    """Рисует один слайд и сохраняет JPEG (выполняется в воркере)"""
+    img = _background().copy()
+    draw = ImageDraw.Draw(img)
+    font = default_font()
+    width, height = SLIDE_WIDTH, SLIDE_HEIGHT
+
+    # Добавляем содержимое слайда
+    y_offset = 30
+    shape_count = 0
+
+    for kind, content in blocks:
+        if kind == "text":
+            # Анализируем структуру текста
+            for para_idx, level, text in content:
+                if not text:
+                    continue
+
+                # Определяем стиль в зависимости от уровня
+                if level == 0 and para_idx == 0:
+                    # Заголовок слайда
+                    font_size = 18
+                    color = (0, 0, 100)
+                    y_offset += 10
+                elif level == 0:
+                    # Основной текст
+                    font_size = 14
+                    color = (30, 30, 30)
+                else:
+                    # Текст второго уровня
+                    font_size = 12
+                    color = (80, 80, 80)
+                    text = "  • " + text
+
+                # Рисуем текст с переносами
+                for line in wrap_text(text, 90):
+                    if y_offset > height - BOTTOM_MARGIN:
+                        break
+
+                    draw.text((40, y_offset), line, fill=color, font=font)
+                    y_offset += font_size + 4
+
+                shape_count += 1
+
+                if y_offset > height - BOTTOM_MARGIN:
+                    break
+
+        else:
+            y_offset += 15
+
+            for row_idx, row in enumerate(content):
+                for col_idx, text in enumerate(row):
+                    if text:
+                        color = (0, 0, 100) if row_idx == 0 else (50, 50, 50)
+                        x_pos = 40 + col_idx * 280
+
+                        # Обрезаем длинный текст
+                        if len(text) > 30:
+                            text = text[:27] + "..."
+
+                        draw.text((x_pos, y_offset), text, fill=color, font=font)
+
+                y_offset += 25
+                if y_offset > height - BOTTOM_MARGIN:
+                    break
+
+            shape_count += 1
+
+        if y_offset > height - BOTTOM_MARGIN:
+            break
+
+    # Если слайд пустой, добавляем сообщение
+    if shape_count == 0:
+        draw.text((width // 2 - 100, height // 2 - 30),
+                 f"Слайд {idx} (без текста)",
+                 fill=(150, 150, 150), font=font)
+
+    # Добавляем номер слайда
+    draw.text((width - 150, height - 40), f"Слайд {idx}",
+             fill=(150, 150, 150), font=font)
+
+    img.save(image_path, 'JPEG', quality=JPEG_QUALITY)
+    return image_path
+
+
+def _render_task(task: tuple) -> str:
+    return render_slide(*task)
+
+
+def render_slides(tasks: list[tuple], on_progress=None, workers: int = None) -> list[str]:
+    """
+    Рендерит слайды tasks = [(номер, блоки, путь)] в пуле процессов.
+    Результаты собираются в порядке слайдов, on_progress(готово, всего) - по мере готовности.
+    """
+    global _executor
+    workers = PPTX_RENDER_WORKERS if workers is None else workers
+    total = len(tasks)
+    image_paths = []
+
+    if workers > 0 and total > 1:
+        try:
+            # Порции по несколько слайдов: меньше накладных расходов на передачу
+            chunksize = max(1, total // (workers * 4))
+            for image_path in _get_executor().map(_render_task, tasks, chunksize=chunksize):
+                image_paths.append(image_path)
+                if on_progress:
+                    on_progress(len(image_paths), total)
+            return image_paths
+        except BrokenProcessPool:
+            # Воркер упал - пересоздаем пул при следующем вызове, остаток рисуем здесь
+            with _executor_lock:
+                _executor = None
+            print("Warning: PPTX render pool failed, rendering in process")
+
+    for task in tasks[len(image_paths):]:
+        image_paths.append(_render_task(task))
+        if on_progress:
+            on_progress(len(image_paths), total)
+    return image_paths
@@ -1,3 +1,9 @@
+import asyncio
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from datetime import datetime, timedelta
@@ -6,14 +12,110 @@ SECRET_KEY = "your-super-secret-key-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# ✅ Стоимость bcrypt и пул процессов для хеширования
+# PASSWORD_POOL_WORKERS=0 - хешировать в текущем потоке (скрипты, отладка)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_POOL_WORKERS = int(os.getenv("PASSWORD_POOL_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_POOL_MAX_QUEUE = int(os.getenv("PASSWORD_POOL_MAX_QUEUE", "32"))
 
-def hash_password(password: str) -> str:
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь пула хеширования переполнена - клиенту отдается 503"""
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = 0  # Задач в пуле (выполняются и ждут)
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn: воркеры не наследуют потоки и блокировки процесса приложения
+            _executor = ProcessPoolExecutor(
+                max_workers=PASSWORD_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _reserve() -> None:
+    global _in_flight
+    with _executor_lock:
+        if _in_flight >= PASSWORD_POOL_MAX_QUEUE:
+            raise PasswordHasherBusy()
+        _in_flight += 1
+
+
+def _release() -> None:
+    global _in_flight
+    with _executor_lock:
+        _in_flight -= 1
+
+
+def _reset_executor() -> None:
+    # Воркер упал - пересоздаем пул при следующем вызове
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def _run_in_pool(fn, *args):
+    """Выполняет fn в пуле процессов и ждет результат (скрипты, старт приложения)"""
+    if PASSWORD_POOL_WORKERS <= 0:
+        return fn(*args)
+
+    _reserve()
+    try:
+        return _get_executor().submit(fn, *args).result()
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
+    finally:
+        _release()
+
+
+async def _run_in_pool_async(fn, *args):
+    """
+    ✅ То же для async-эндпоинтов: результат ожидается в event loop,
+    поток пула запросов не занят на время хеширования
+    """
+    if PASSWORD_POOL_WORKERS <= 0:
+        return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+    _reserve()
+    try:
+        return await asyncio.wrap_future(_get_executor().submit(fn, *args))
+    except BrokenProcessPool:
+        _reset_executor()
+        raise
+    finally:
+        _release()
+
+
+def _hash(password: str) -> str:
     return pwd_context.hash(password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
+
+def hash_password(password: str) -> str:
+    return _run_in_pool(_hash, password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return _run_in_pool(_verify, plain_password, hashed_password)
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool_async(_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_pool_async(_verify, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
@@ -0,0 +1,59 @@
+"""
+Отпечатки слайдов PPTX для повторной загрузки исправленной презентации.
+
+Отпечаток слайда - SHA-256 его XML и всех частей, от которых зависит
+картинка: изображения и медиа, диаграммы, макет, образец и тема (рекурсивно
+по связям). Заметки докладчика, комментарии и ссылки на другие слайды на
+изображение не влияют и не учитываются. В отпечаток также входят размер
+слайдов презентации и настройки рендеринга: их изменение перерисовывает все.
+Отпечаток не зависит от позиции слайда и имен частей пакета, поэтому
+перемещенный слайд узнается на новом месте. Скрытые слайды не экспортируются
+и в нумерацию не входят (см. visible_slides).
+"""
+import hashlib
+
+from pptx import Presentation
+from pptx.opc.constants import RELATIONSHIP_TYPE as RT
+
+from utils.pptx_render import visible_slides
+
+# Связи, не влияющие на изображение слайда
+IGNORED_RELATIONSHIPS = {RT.NOTES_SLIDE, RT.COMMENTS, RT.SLIDE, RT.COMMENT_AUTHORS}
+
+
+def _part_digest(part, memo: dict) -> bytes:
+    partname = str(part.partname)
+    if partname in memo:
+        return memo[partname]
+
+    # Имя части не учитывается: при удалении или вставке слайда части перенумеровываются
+    digest = hashlib.sha256()
+    digest.update(part.blob)
+    for rId, rel in sorted(part.rels.items()):
+        if rel.reltype in IGNORED_RELATIONSHIPS:
+            continue
+        # Образец ссылается на все свои макеты - учитываем только путь макет -> образец
+        if rel.reltype == RT.SLIDE_LAYOUT and partname.startswith("/ppt/slideMasters/"):
+            continue
+        digest.update(rId.encode())
+        digest.update(rel.reltype.encode())
+        if rel.is_external:
+            digest.update(rel.target_ref.encode())
+        else:
+            digest.update(_part_digest(rel.target_part, memo))
+
+    memo[partname] = digest.digest()
+    return memo[partname]
+
+
+def slide_fingerprints(pptx_path: str, settings: str = "") -> list[str]:
+    """Отпечатки показываемых слайдов в порядке показа (hex)"""
+    prs = Presentation(pptx_path)
+    memo = {}
+    common = f"{prs.slide_width}x{prs.slide_height}:{settings}".encode()
+    fingerprints = []
+    for slide in visible_slides(prs):
+        digest = hashlib.sha256(common)
+        digest.update(_part_digest(slide.part, memo))
+        fingerprints.append(digest.hexdigest())
+    return fingerprints
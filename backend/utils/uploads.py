@@ -0,0 +1,232 @@
+"""
+Потоковое сохранение загруженных файлов.
+Файл копируется на диск блоками: хеш и размер считаются по ходу записи,
+в памяти одновременно находится не больше одного блока.
+
+Многофайловая загрузка идет конвейером в пуле потоков: запись и проверка
+JPEG (с декодированием) выполняются параллельно, ошибки собираются по каждому файлу.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageFile
+
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv("UPLOAD_MAX_FILE_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_MAX_IMAGE_SIDE = int(os.getenv("UPLOAD_MAX_IMAGE_SIDE", "10000"))
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "8"))
+# Пакет слайдов (ZIP) при докачиваемой загрузке: размер архива и распакованных слайдов
+UPLOAD_MAX_PACKAGE_BYTES = int(os.getenv("UPLOAD_MAX_PACKAGE_BYTES", str(2 * 1024 * 1024 * 1024)))
+MAX_PACKAGE_SLIDES = 999
+
+SLIDE_FILE_RE = re.compile(r"^slide(\d+)\.(jpg|jpeg)$")
+
+_executor = ThreadPoolExecutor(max_workers=max(1, UPLOAD_WORKERS), thread_name_prefix="upload")
+
+
+class UploadTooLarge(Exception):
+    """Файл или запрос превысил лимит - клиенту отдается 413"""
+
+    def __init__(self, filename: str, limit: int):
+        super().__init__(filename, limit)
+        self.filename = filename
+        self.limit = limit
+
+
+class InvalidImage(Exception):
+    """Файл не является корректным JPEG нужного размера"""
+
+
+class InvalidPackage(Exception):
+    """Пакет слайдов (ZIP) поврежден или не содержит slide1.jpg, slide2.jpg, ..."""
+
+
+class UploadBudget:
+    """Остаток байтов на весь запрос (общий для всех файлов и потоков)"""
+
+    def __init__(self, max_bytes: int = None):
+        self.max_bytes = UPLOAD_MAX_REQUEST_BYTES if max_bytes is None else max_bytes
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def consume(self, filename: str, size: int) -> None:
+        with self._lock:
+            self.used += size
+            exceeded = self.used > self.max_bytes
+        if exceeded:
+            raise UploadTooLarge(filename, self.max_bytes)
+
+
+def save_upload(source, dest_path: str, filename: str, budget: UploadBudget,
+                max_file_bytes: int = None) -> tuple[str, int]:
+    """
+    Копирует файловый объект загрузки в dest_path блоками (блокирующий вызов,
+    запускать в пуле потоков). Возвращает (sha256, размер).
+    При превышении лимита недописанный файл удаляется.
+    """
+    max_file_bytes = UPLOAD_MAX_FILE_BYTES if max_file_bytes is None else max_file_bytes
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(dest_path, "wb") as f:
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_BYTES), b""):
+                size += len(chunk)
+                if size > max_file_bytes:
+                    raise UploadTooLarge(filename, max_file_bytes)
+                budget.consume(filename, len(chunk))
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+    return digest.hexdigest(), size
+
+
+def validate_image(path: str) -> tuple[int, int]:
+    """Проверяет, что файл - декодируемый JPEG допустимого размера, возвращает (ширина, высота)"""
+    try:
+        with Image.open(path) as image:
+            if image.format != "JPEG":
+                raise InvalidImage(f"формат {image.format}, ожидается JPEG")
+            width, height = image.size
+            image.verify()
+    except InvalidImage:
+        raise
+    except Exception as e:
+        raise InvalidImage(f"не удалось прочитать изображение: {e}")
+    
+    if width > UPLOAD_MAX_IMAGE_SIDE or height > UPLOAD_MAX_IMAGE_SIDE:
+        raise InvalidImage(f"размер {width}x{height} больше {UPLOAD_MAX_IMAGE_SIDE}px")
+    
+    # ✅ verify() для JPEG проверяет только заголовок - обрезанный файл проходит.
+    # Декодируем изображение целиком (ImageFile.LOAD_TRUNCATED_IMAGES должен быть False)
+    if ImageFile.LOAD_TRUNCATED_IMAGES:
+        raise RuntimeError("ImageFile.LOAD_TRUNCATED_IMAGES включен - проверка JPEG невозможна")
+    try:
+        with Image.open(path) as image:
+            image.load()
+    except (OSError, SyntaxError, ValueError) as e:
+        raise InvalidImage(f"изображение повреждено: {e}")
+    return width, height
+
+
+def store_image(source, dest_path: str, filename: str, budget: UploadBudget, validate: bool = True) -> dict:
+    """Сохраняет и проверяет одно изображение (в потоке пула)"""
+    content_hash, size = save_upload(source, dest_path, filename, budget)
+    if not validate:
+        return {"content_hash": content_hash, "size": size}
+    try:
+        width, height = validate_image(dest_path)
+    except InvalidImage:
+        os.remove(dest_path)
+        raise
+    return {"content_hash": content_hash, "size": size, "width": width, "height": height}
+
+
+def _collect(keys_and_names, outcomes) -> tuple[dict, list]:
+    results, errors = {}, []
+    for (key, filename), outcome in zip(keys_and_names, outcomes):
+        if isinstance(outcome, UploadTooLarge):
+            errors.append({"file": filename, "error": f"превышен лимит {outcome.limit} байт", "status": 413})
+        elif isinstance(outcome, InvalidImage):
+            errors.append({"file": filename, "error": str(outcome), "status": 400})
+        elif isinstance(outcome, BaseException):
+            raise outcome
+        else:
+            results[key] = outcome
+    return results, errors
+
+
+async def store_images(jobs: list, budget: UploadBudget, validate: bool = True) -> tuple[dict, list]:
+    """
+    Параллельно сохраняет изображения: jobs - список (ключ, файловый объект, путь, имя).
+    Возвращает ({ключ: результат store_image}, [{"file", "error", "status"}]).
+    validate=False - только запись (проверку выполнит фоновая задача)
+    """
+    loop = asyncio.get_running_loop()
+    outcomes = await asyncio.gather(*[
+        loop.run_in_executor(_executor, store_image, source, dest_path, filename, budget, validate)
+        for _, source, dest_path, filename in jobs
+    ], return_exceptions=True)
+    return _collect([(key, filename) for key, _, _, filename in jobs], outcomes)
+
+
+def validate_images(items: list, on_progress=None) -> tuple[dict, list]:
+    """
+    Проверяет уже сохраненные изображения в пуле потоков: items - список (ключ, путь, имя).
+    Возвращает ({ключ: (ширина, высота)}, [{"file", "error", "status"}]).
+    """
+    futures = [_executor.submit(validate_image, path) for _, path, _ in items]
+    outcomes = []
+    for done, future in enumerate(futures, 1):
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            outcomes.append(e)
+        if on_progress:
+            on_progress(done)
+    return _collect([(key, filename) for key, _, filename in items], outcomes)
+
+
+def read_slide_package(zip_path: str) -> list[tuple[int, zipfile.ZipInfo]]:
+    """
+    Оглавление пакета слайдов: [(номер, запись ZIP)] по порядку.
+    Папки внутри архива игнорируются, остальные файлы - тоже;
+    номера слайдов должны идти подряд с 1, как при загрузке файлов.
+    """
+    try:
+        with zipfile.ZipFile(zip_path) as archive:
+            infos = archive.infolist()
+    except (zipfile.BadZipFile, OSError) as e:
+        raise InvalidPackage(f"не удалось прочитать ZIP: {e}")
+
+    found = {}
+    for info in infos:
+        name = info.filename.replace("\\", "/").rsplit("/", 1)[-1].lower()
+        if info.is_dir() or info.filename.startswith("__MACOSX/"):
+            continue
+        match = SLIDE_FILE_RE.match(name)
+        if not match:
+            continue
+        order = int(match.group(1))
+        if order in found:
+            raise InvalidPackage(f"слайд {order} встречается в архиве дважды")
+        found[order] = info
+
+    if not found:
+        raise InvalidPackage("в архиве не найдены файлы slide*.jpg")
+    if len(found) > MAX_PACKAGE_SLIDES:
+        raise InvalidPackage(f"больше {MAX_PACKAGE_SLIDES} слайдов")
+    for expected, order in enumerate(sorted(found), 1):
+        if order != expected:
+            raise InvalidPackage(f"слайды должны идти по порядку: slide1.jpg, slide2.jpg, и т.д. (нарушен номер: {order})")
+    return [(order, found[order]) for order in sorted(found)]
+
+
+def extract_slide_package(zip_path: str, entries: list, dest_dir: str, budget: UploadBudget,
+                          on_progress=None) -> tuple[dict, list]:
+    """
+    Распаковывает слайды пакета в dest_dir/slide{N}.jpg потоково (лимиты считаются
+    по фактически распакованным байтам, а не по заголовкам ZIP).
+    Возвращает ({номер: {"content_hash", "size"}}, [{"file", "error", "status"}]).
+    """
+    outcomes = []
+    with zipfile.ZipFile(zip_path) as archive:
+        for done, (order, info) in enumerate(entries, 1):
+            dest_path = os.path.join(dest_dir, f"slide{order}.jpg")
+            try:
+                with archive.open(info) as source:
+                    content_hash, size = save_upload(source, dest_path, info.filename, budget)
+                outcomes.append({"content_hash": content_hash, "size": size})
+            except (UploadTooLarge, zipfile.BadZipFile) as e:
+                outcomes.append(e if isinstance(e, UploadTooLarge) else InvalidImage(f"поврежден в архиве: {e}"))
+            if on_progress:
+                on_progress(done)
+    return _collect([(order, info.filename) for order, info in entries], outcomes)
@@ -297,13 +297,16 @@ const AdminPanel = () => {
       const response = await api.post('/admin/slides/upload-from-files', formData);
       
       console.log('Server response:', response.data);
-      setSuccess(`✅ Presentation uploaded successfully! Total slides: ${response.data.slides_count}`);
+      // Server processes the upload in a background job - wait for it
+      const job = await waitForJob(response.data.job_id);
+      const slidesCount = job.result?.slides_count;
+      setSuccess(`✅ Presentation uploaded successfully! Total slides: ${slidesCount}`);
       
       // Store recently uploaded presentation data
       const newPresentation = {
-        id: response.data.presentation_id,
+        id: job.presentation_id,
         title: presentationTitle,
-        slides_count: response.data.slides_count,
+        slides_count: slidesCount,
         uploaded_at: new Date().toLocaleString(),
         uploaded_by: currentUserEmail || 'Unknown'
       };
@@ -333,6 +336,23 @@ const AdminPanel = () => {
     }
   };
 
+  // Poll a background ingestion job until it finishes
+  const waitForJob = async (jobId) => {
+    while (true) {
+      const { data } = await api.get(`/admin/jobs/${jobId}`);
+      const job = data.job;
+      if (job.status === 'succeeded') {
+        return job;
+      }
+      if (job.status === 'failed') {
+        const fileErrors = (job.result?.errors || []).map((e) => `${e.file}: ${e.error}`).join('; ');
+        throw new Error(fileErrors ? `${job.error}: ${fileErrors}` : job.error);
+      }
+      setSuccess(`⏳ Processing slides... ${job.progress.done}/${job.progress.total}`);
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  };
+
   const validateEmail = (email) => {
     const emailRegex = /^[^\s@]+@[^\s@]+\.[^\s@]+$/;
     return emailRegex.test(email);